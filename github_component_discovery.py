@@ -26,18 +26,22 @@ Optional environment variables
 - SLACK_NOTIFY_CHANNEL: Slack channel for notifications
 - SLACK_ALERT_CHANNEL: Slack channel for alerts
 - LOG_LEVEL: Log level (default: INFO)
+- GIT_MIRROR_DIR: read repository files from local git mirrors kept in this directory
+- GIT_MIRROR_URL: remote URL template for the git mirrors (eg. file:///repos/{repo}.git)
+- ALERTMANAGER_CACHE_FILE: keep the Alertmanager config between runs in this file
 
 """
 
 import argparse
 
 # hmpps
-from hmpps import ServiceCatalogue, GithubSession, AlertmanagerData, CircleCI
+from hmpps import ServiceCatalogue, GithubSession, CircleCI
 from hmpps.services.job_log_handling import log_debug, log_error, log_info
 
 
 # local
 import processes.components as components
+from includes import alertmanager, git_mirror, github_audit
 
 # Set maximum number of concurrent threads to run, try to avoid
 # secondary github api limits.
@@ -47,8 +51,8 @@ max_threads = 10
 class Services:
   def __init__(self):
     self.sc = ServiceCatalogue()
-    self.gh = GithubSession()
-    self.am = AlertmanagerData()
+    self.gh = git_mirror.wrap_session(GithubSession())
+    self.am = alertmanager.get_alertmanager()
     self.cc = CircleCI()
 
 
@@ -61,6 +65,7 @@ def main():
   args = parser.parse_args()
   component_name = args.component_name
 
+  github_audit.enable_from_env()
   services = Services()
 
   component = services.sc.get_record(services.sc.components_get, 'name', component_name)
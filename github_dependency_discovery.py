@@ -24,17 +24,21 @@ Optional environment variables
 - SLACK_NOTIFY_CHANNEL: Slack channel for notifications
 - SLACK_ALERT_CHANNEL: Slack channel for alerts
 - LOG_LEVEL: Log level (default: INFO)
+- DRY_RUN_FILE: where --dry-run records the Service Catalogue writes
 """
 
 import re
+import sys
 from datetime import date, datetime
 
 import requests
-import yaml
 
 from hmpps import ServiceCatalogue, GithubSession, Slack
 from hmpps.services.job_log_handling import log_error, log_info, log_warning, job
 
+# local
+from includes import sc_pages, sc_query, sc_recorder, yaml_loader
+
 
 class Services:
   def __init__(self):
@@ -176,7 +180,7 @@ def _get_latest_helm_chart_versions(chart_names):
   try:
     response = requests.get(source, timeout=15)
     response.raise_for_status()
-    index_data = yaml.safe_load(response.text) or {}
+    index_data = yaml_loader.safe_load(response.text) or {}
   except Exception as e:
     raise RuntimeError(f'Unable to read helm repository index: {e}')
 
@@ -307,7 +311,7 @@ def _get_latest_version_for_action(gh, action_name):
 
 def _get_unique_github_actions_from_components(sc):
   action_names = set()
-  components = sc.get_all_records(sc.components_get)
+  components = sc_pages.get_all_records(sc, sc_query.COMPONENT_VERSIONS.query(sc))
 
   for component in components:
     versions = component.get('versions') or {}
@@ -420,6 +424,9 @@ def main():
   job.name = 'hmpps-github-discovery-dependencies-latest'
 
   services = Services()
+  # Record the Service Catalogue writes instead of making them
+  if '--dry-run' in sys.argv:
+    services.sc = sc_recorder.record_writes(services.sc, job.name)
   slack = services.slack
   sc = services.sc
   gh = services.gh
@@ -438,7 +445,7 @@ def main():
     changed_dependency_results = []
     total_updates = 0
     total_creates = 0
-    recommended_versions_records = sc.get_all_records('recommended-versions')
+    recommended_versions_records = sc_pages.get_all_records(sc, 'recommended-versions')
     recommended_versions_index = _build_recommended_versions_index(
       recommended_versions_records
     )
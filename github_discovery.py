@@ -4,6 +4,13 @@ the results in the service catalogue
 
 Optional parameters:
 -f, --force: Force update of the service catalogue
+--dry-run: Record the Service Catalogue writes instead of making them
+--since: Only process components changed in the Service Catalogue or pushed to in
+  Github since this time (ISO 8601, or relative - eg. 30m, 6h, 2d)
+--component: Only process this component (can be given more than once)
+--match: Only process components with names matching this regular expression
+--product: Only process components of this product ID (can be given more than once)
+--team: Only process components of this team's products (can be given more than once)
 
 Required environment variables
 ------------------------------
@@ -29,22 +36,38 @@ Optional environment variables
 - SLACK_NOTIFY_CHANNEL: Slack channel for notifications
 - SLACK_ALERT_CHANNEL: Slack channel for alerts
 - LOG_LEVEL: Log level (default: INFO)
+- DRY_RUN_FILE: where --dry-run records the Service Catalogue writes
+- GIT_MIRROR_DIR: read repository files from local git mirrors kept in this directory
+- GIT_MIRROR_URL: remote URL template for the git mirrors (eg. file:///repos/{repo}.git)
+- PREFETCH_DEPTH: prefetch Github data for up to this many upcoming components
+- PROBE_CACHE_FILE: keep endpoint probe results between runs in this file
+- ALERTMANAGER_CACHE_FILE: keep the Alertmanager config between runs in this file
+- ALERTMANAGER_CACHE_TTL: seconds to use the cached config without revalidating it
+- PROBE_CACHE_FULL_REFRESH: set to true to probe every endpoint again on full runs
+- ENV_RECONCILE: set to true to remove stale and duplicate environments at the end
+  of the run, instead of as each component is processed
 
 """
 
-import sys
+import argparse
+import re
+from datetime import datetime, timedelta, timezone
 
 # Classes for the various parts of the script
 # from classes.health import HealthServer
 from hmpps import ServiceCatalogue
 from hmpps import GithubSession
 from hmpps import Slack
-from hmpps import AlertmanagerData
 from hmpps import CircleCI
 
 # Components
 import processes.products as products
 import processes.components as components
+from includes import alertmanager, environment_reconciliation, git_mirror
+from includes import github_audit, prefetch, probe_cache
+from includes import sc_diff, sc_pages, sc_query, sc_recorder, sc_writer
+from includes.github_api import get_repos_pushed_since
+from includes.sc_query import Selection
 from hmpps.services.job_log_handling import log_error, log_info, job
 
 # Set maximum number of concurrent threads to run,
@@ -55,9 +78,9 @@ max_threads = 10
 class Services:
   def __init__(self):
     self.slack = Slack()
-    self.sc = ServiceCatalogue()
-    self.gh = GithubSession()
-    self.am = AlertmanagerData()
+    self.sc = sc_writer.wrap_catalogue(ServiceCatalogue())
+    self.gh = prefetch.wrap_session(git_mirror.wrap_session(GithubSession()))
+    self.am = alertmanager.get_alertmanager()
     self.cc = CircleCI()
 
 
@@ -148,6 +171,9 @@ def create_summary(
   summary += summarize_processed_components(
     processed_components, 'component', component_attributes, force_update
   )
+  summary += sc_diff.stats.summary()
+  summary += sc_diff.environment_stats.summary()
+  summary += environment_reconciliation.summary()
   summary += summarize_processed_products(processed_products, 'product', force_update)
   summary += summarize_duplicate_app_role_with_details(
     duplicate_appinsights_cloud_role, 'component', force_update
@@ -161,19 +187,77 @@ def create_summary(
   log_info(summary)
 
 
+def parse_since(value):
+  # Relative times (eg. 6h) are counted back from now
+  if match := re.fullmatch(r'(\d+)([mhd])', value):
+    unit = {'m': 'minutes', 'h': 'hours', 'd': 'days'}[match[2]]
+    return datetime.now(timezone.utc) - timedelta(**{unit: int(match[1])})
+  try:
+    since = datetime.fromisoformat(value)
+  except ValueError:
+    raise argparse.ArgumentTypeError(f'invalid time: {value}')
+  return since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('-f', '--force', action='store_true')
+  parser.add_argument('--dry-run', action='store_true')
+  parser.add_argument('--since', type=parse_since)
+  parser.add_argument('--component', action='append')
+  parser.add_argument('--match')
+  parser.add_argument('--product', action='append')
+  parser.add_argument('--team', action='append')
+  return parser.parse_args()
+
+
+def get_selection(services, args):
+  # Narrows the batch down to the selected components, if any were given -
+  # archived components are always left out
+  pushed_repos = []
+  if args.since:
+    pushed = get_repos_pushed_since(services.gh, args.since)
+    # Only the organisation's repositories that are in the Service Catalogue
+    catalogue_repos = {
+      component.get('github_repo')
+      for component in sc_pages.get_all_records(
+        services.sc, sc_query.COMPONENT_REPOS.query(services.sc)
+      )
+    }
+    pushed_repos = [repo for repo in pushed if repo in catalogue_repos]
+    log_info(
+      f'{len(pushed_repos)} Service Catalogue repositories (of {len(pushed)}) '
+      f'pushed to since {args.since}'
+    )
+  return Selection(
+    names=args.component,
+    name_regex=args.match,
+    products=args.product,
+    teams=args.team,
+    since=args.since,
+    pushed_repos=pushed_repos,
+  )
+
+
 def main():
+  args = parse_args()
   #### Use the -f parameter to force an update regardless of environment /
   # main branch changes
   force_update = False
-  if '-f' in sys.argv or '--force' in sys.argv:
+  if args.force:
     job.name = 'hmpps-github-discovery-full'  # type: ignore[assignment]
     force_update = True
   else:
     job.name = 'hmpps-github-discovery-incremental'  # type: ignore[assignment]
+  probe_cache.refresh_on_full_run(force_update)
 
   #### Create resources ####
 
+  github_audit.enable_from_env()
   services = Services()
+  # Record the Service Catalogue writes instead of making them
+  if args.dry_run:
+    services.sc = sc_recorder.record_writes(services.sc, job.name)
   slack = services.slack
   cc = services.cc
   sc = services.sc
@@ -208,10 +292,19 @@ def main():
   # httpHealth.start()
 
   log_info('Batch processing components')
+  selection = get_selection(services, args)
+  environment_reconciliation.start()
   processed_components = components.batch_process_sc_components(
-    services, max_threads, force_update=force_update
+    services,
+    max_threads,
+    force_update=force_update,
+    selection=selection,
   )
 
+  # Remove the environments that discovery no longer finds, and duplicates
+  sc_writer.flush(sc)
+  environment_reconciliation.reconcile(services, selection)
+
   # Process products
   log_info('Batch processing products...')
   processed_products = products.batch_process_sc_products(services, max_threads)
@@ -221,6 +314,9 @@ def main():
     services, max_threads, force_update=force_update
   )
 
+  # Make sure all of the queued Service Catalogue writes have been sent
+  sc_writer.close(sc)
+
   create_summary(
     services,
     processed_components,
@@ -20,8 +20,14 @@ Optional environment variables
 - SLACK_NOTIFY_CHANNEL: Slack channel for notifications
 - SLACK_ALERT_CHANNEL: Slack channel for alerts
 - LOG_LEVEL: Log level (default: INFO)
+- DRY_RUN_FILE: where --dry-run records the Service Catalogue writes
+- GIT_MIRROR_DIR: read repository files from local git mirrors kept in this directory
+- GIT_MIRROR_URL: remote URL template for the git mirrors (eg. file:///repos/{repo}.git)
+- PREFETCH_DEPTH: prefetch Github data for up to this many upcoming components
 """
 
+import sys
+
 # hmpps
 from hmpps import ServiceCatalogue, GithubSession, Slack
 from hmpps.services.job_log_handling import (
@@ -32,6 +38,8 @@ from hmpps.services.job_log_handling import (
 
 # local
 from processes import components
+from includes import git_mirror, github_audit, prefetch, sc_diff, sc_query
+from includes import sc_recorder, sc_writer
 
 # Set maximum number of concurrent threads to run, try to avoid secondary github
 # api limits.
@@ -41,8 +49,8 @@ max_threads = 10
 class Services:
   def __init__(self):
     self.slack = Slack()
-    self.sc = ServiceCatalogue()
-    self.gh = GithubSession()
+    self.sc = sc_writer.wrap_catalogue(ServiceCatalogue())
+    self.gh = prefetch.wrap_session(git_mirror.wrap_session(GithubSession()))
 
 
 # def create_summary(services, processed_components):
@@ -62,6 +70,7 @@ def create_summary(services, processed_components):
       #   for item in filtered_items:
       #     summary += f'  {item[0]}\n'
       #   summary += '\n'
+    summary += sc_diff.stats.summary()
     summary += (
       '\n_(generated by <https://github.com/ministryofjustice/hmpps-github-discovery|'
       'hmpps-github-discovery>)_'
@@ -85,7 +94,11 @@ def main():
   #### Create resources ####
   job.name = 'hmpps-github-discovery-security'  # type: ignore[assignment]
 
+  github_audit.enable_from_env()
   services = Services()
+  # Record the Service Catalogue writes instead of making them
+  if '--dry-run' in sys.argv:
+    services.sc = sc_recorder.record_writes(services.sc, job.name)
   slack = services.slack
   sc = services.sc
   gh = services.gh
@@ -113,8 +126,14 @@ def main():
     max_threads,
     module='processes.security',
     function='process_sc_component_security',
+    projection=sc_query.SECURITY_COMPONENTS,
+    # Only unarchived components
+    selection=sc_query.Selection(),
   )
 
+  # Make sure all of the queued Service Catalogue writes have been sent
+  sc_writer.close(sc)
+
   create_summary(services, processed_components)
 
   if job.error_messages:
@@ -2,12 +2,15 @@
 """Github discovery - queries the github API for info about hmpps services and stores
 the results in the service catalogue"""
 
+import sys
+
 # hmpps
 from hmpps import GithubSession, ServiceCatalogue, Slack
 from hmpps.services.job_log_handling import log_info, job
 
 # local
 from processes import github_teams
+from includes import github_audit, sc_recorder
 
 
 class Services:
@@ -47,7 +50,11 @@ def summarize_processed_teams(processed_teams):
 
 def main():
   job.name = 'hmpps-github-teams-discovery'  # type: ignore[assignment]
+  github_audit.enable_from_env()
   services = Services()
+  # Record the Service Catalogue writes instead of making them
+  if '--dry-run' in sys.argv:
+    services.sc = sc_recorder.record_writes(services.sc, job.name)
   slack = services.slack
   sc = services.sc
 
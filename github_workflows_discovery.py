@@ -20,14 +20,22 @@ Optional environment variables
 - SLACK_NOTIFY_CHANNEL: Slack channel for notifications
 - SLACK_ALERT_CHANNEL: Slack channel for alerts
 - LOG_LEVEL: Log level (default: INFO)
+- DRY_RUN_FILE: where --dry-run records the Service Catalogue writes
+- GIT_MIRROR_DIR: read repository files from local git mirrors kept in this directory
+- GIT_MIRROR_URL: remote URL template for the git mirrors (eg. file:///repos/{repo}.git)
+- PREFETCH_DEPTH: prefetch Github data for up to this many upcoming components
 """
 
+import sys
+
 # hmpps
 from hmpps import ServiceCatalogue, GithubSession, Slack
 from hmpps.services.job_log_handling import log_error, log_info, job
 
 # local
 import processes.components as components
+from includes import git_mirror, github_audit, prefetch, sc_diff, sc_query
+from includes import sc_recorder, sc_writer
 
 
 # Set maximum number of concurrent threads to run, try to avoid secondary github
@@ -38,8 +46,8 @@ max_threads = 10
 class Services:
   def __init__(self):
     self.slack = Slack()
-    self.sc = ServiceCatalogue()
-    self.gh = GithubSession()
+    self.sc = sc_writer.wrap_catalogue(ServiceCatalogue())
+    self.gh = prefetch.wrap_session(git_mirror.wrap_session(GithubSession()))
 
 
 # def create_summary(services, processed_components):
@@ -66,6 +74,7 @@ def create_summary(services, processed_components):
   summary += summarize_processed_components(
     processed_components, 'component', component_attributes
   )
+  summary += sc_diff.stats.summary()
   summary += (
     '\n_(generated by <https://github.com/ministryofjustice/hmpps-github-discovery|'
     'hmpps-github-discovery>)_'
@@ -78,7 +87,11 @@ def main():
   #### Create resources ####
   job.name = 'hmpps-github-discovery-workflows'  # type: ignore[assignment]
 
+  github_audit.enable_from_env()
   services = Services()
+  # Record the Service Catalogue writes instead of making them
+  if '--dry-run' in sys.argv:
+    services.sc = sc_recorder.record_writes(services.sc, job.name)
   slack = services.slack
   sc = services.sc
   gh = services.gh
@@ -106,8 +119,14 @@ def main():
     max_threads,
     module='processes.workflows',
     function='process_sc_component_workflows',
+    projection=sc_query.WORKFLOWS_COMPONENTS,
+    # Only unarchived components
+    selection=sc_query.Selection(),
   )
 
+  # Make sure all of the queued Service Catalogue writes have been sent
+  sc_writer.close(sc)
+
   create_summary(services, processed_components)
 
   if job.error_messages:
@@ -0,0 +1,166 @@
+# Alertmanager config snapshot
+# Reads the Alertmanager config once and compiles its routes into an index from
+# severity label to Slack channel, so that looking up an environment's alerts
+# channel is a dictionary lookup.
+#
+# If ALERTMANAGER_CACHE_FILE is set, the config is kept between runs along with
+# its ETag / Last-Modified headers. A cached config younger than the TTL is used
+# without asking Alertmanager at all; an older one is revalidated with a
+# conditional request, so the config is only downloaded when it has changed.
+#
+# If the config can't be read, the hmpps library's AlertmanagerData reads it
+# instead, and its config is compiled into the same index - so the channels are
+# the same whichever way the config was read. The library itself only looks at
+# the match of the top-level routes, so channels from nested routes and
+# matchers are new for environments that used to get their channel from it.
+#
+# Optional environment variables
+# - ALERTMANAGER_CACHE_FILE: JSON file used to keep the config between runs
+# - ALERTMANAGER_CACHE_TTL: seconds to use a cached config without revalidating
+#   it (default 0 - always revalidate)
+
+import json
+import os
+import re
+import time
+
+import requests
+
+# hmpps
+from hmpps import AlertmanagerData
+from hmpps.services.job_log_handling import log_debug, log_info, log_warning
+
+# local
+from includes import yaml_loader
+
+# eg. severity="hmpps-team" or severity=~"team-a|team-b"
+SEVERITY_MATCHER = re.compile(r'^\s*severity\s*(=~?)\s*"?([^"]*)"?\s*$')
+
+
+def _load_cache(cache_file):
+  if not cache_file:
+    return None
+  try:
+    with open(cache_file) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    log_debug(f'No Alertmanager cache found at {cache_file}')
+  except Exception as e:
+    log_warning(f'Unable to load Alertmanager cache from {cache_file} - {e}')
+  return None
+
+
+def _save_cache(cache_file, cached):
+  if not cache_file:
+    return
+  try:
+    with open(f'{cache_file}.tmp', 'w') as f:
+      json.dump(cached, f)
+    os.replace(f'{cache_file}.tmp', cache_file)
+  except Exception as e:
+    log_warning(f'Unable to save Alertmanager cache to {cache_file} - {e}')
+
+
+def _route_severities(route):
+  # The severity labels a route matches, from match or matchers
+  severities = []
+  if severity := (route.get('match') or {}).get('severity'):
+    severities.append(severity)
+  for matcher in route.get('matchers') or []:
+    if match := SEVERITY_MATCHER.match(str(matcher)):
+      operator, value = match.groups()
+      severities += value.split('|') if operator == '=~' else [value]
+  return severities
+
+
+def build_index(config):
+  # Severity label -> Slack channel, from the first route that matches each
+  # label (the order Alertmanager tries them in)
+  channels = {}
+  for receiver in config.get('receivers') or []:
+    if slack_configs := receiver.get('slack_configs'):
+      channels[receiver.get('name')] = slack_configs[0].get('channel')
+
+  index = {}
+  root = config.get('route') or {}
+  # Routes without a receiver use their parent's
+  routes = [(route, root.get('receiver')) for route in root.get('routes') or []]
+  while routes:
+    route, parent_receiver = routes.pop(0)
+    receiver = route.get('receiver') or parent_receiver
+    if channel := channels.get(receiver):
+      for severity in _route_severities(route):
+        index.setdefault(severity, channel)
+    routes[0:0] = [(child, receiver) for child in route.get('routes') or []]
+  return index
+
+
+class AlertmanagerSnapshot:
+  # Stands in for AlertmanagerData
+  def __init__(self, json_config_data, index):
+    self.json_config_data = json_config_data
+    self.index = index
+
+  def isDataAvailable(self):
+    return bool(self.index)
+
+  def find_channel_by_severity_label(self, alert_severity_label):
+    # '' if there's no channel, like AlertmanagerData
+    return self.index.get(alert_severity_label) or ''
+
+
+def _fetch(endpoint, cached):
+  headers = {}
+  if cached:
+    if etag := cached.get('etag'):
+      headers['If-None-Match'] = etag
+    if last_modified := cached.get('last_modified'):
+      headers['If-Modified-Since'] = last_modified
+  r = requests.get(endpoint, headers=headers, timeout=30)
+  if r.status_code == 304 and cached:
+    log_info('Alertmanager config unchanged since the last run')
+    cached['fetched'] = time.time()
+    return cached
+  r.raise_for_status()
+  return {
+    'data': r.json(),
+    'etag': r.headers.get('ETag'),
+    'last_modified': r.headers.get('Last-Modified'),
+    'fetched': time.time(),
+  }
+
+
+def get_alertmanager():
+  endpoint = os.getenv('ALERTMANAGER_ENDPOINT')
+  cache_file = os.getenv('ALERTMANAGER_CACHE_FILE')
+  ttl = int(os.getenv('ALERTMANAGER_CACHE_TTL', '0'))
+  cached = _load_cache(cache_file)
+  try:
+    if cached and time.time() - cached.get('fetched', 0) < ttl:
+      log_info('Using the cached Alertmanager config')
+      snapshot = cached
+    else:
+      snapshot = _fetch(endpoint, cached)
+    data = snapshot['data']
+    config = yaml_loader.safe_load(data['config']['original'])
+    if index := build_index(config):
+      _save_cache(cache_file, snapshot)
+      log_info(f'Alertmanager config has {len(index)} severity labels')
+      return AlertmanagerSnapshot(config, index)
+    log_warning('No severity routes found in the Alertmanager config')
+  except Exception as e:
+    log_warning(f'Unable to read an Alertmanager snapshot - {e}')
+  return _from_library()
+
+
+def _from_library():
+  # The library reads the config itself, but its channels are looked up with
+  # the same index as a snapshot's
+  am = AlertmanagerData()
+  if config := getattr(am, 'json_config_data', None):
+    try:
+      if index := build_index(config):
+        return AlertmanagerSnapshot(config, index)
+    except Exception as e:
+      log_warning(f'Unable to index the Alertmanager config - {e}')
+  return am
@@ -0,0 +1,170 @@
+# Environment endpoint probes
+# Checks the health, info, Swagger docs and subject access request endpoints of
+# each environment's ingress host. The checks for a component's environments run
+# at the same time in a shared, bounded pool, with a short connect timeout and a
+# cap on how much of each response is read. The results are kept for the rest of
+# the run, so components and environments that share a host share the checks,
+# and between runs in the probe cache (see includes/probe_cache.py).
+#
+# Optional environment variables
+# - PROBE_THREADS: endpoint checks run at the same time (default 8)
+# - PROBE_CONNECT_TIMEOUT: seconds to wait for a connection (default 3)
+# - PROBE_READ_TIMEOUT: seconds to wait for a response (default 10)
+# - PROBE_MAX_BYTES: most of a response body that is read (default 1048576)
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug, log_info
+
+# local
+from includes import probe_cache
+from includes.singleflight import SingleFlight
+
+HEADERS = {'User-Agent': 'hmpps-service-discovery'}
+SAR_PATH = '/subject-access-request'
+
+_lock = threading.Lock()
+_results = {}  # (check, url) -> found
+_in_flight = SingleFlight()
+_pool = None
+
+
+def _executor():
+  global _pool
+  with _lock:
+    if _pool is None:
+      _pool = ThreadPoolExecutor(
+        max_workers=int(os.getenv('PROBE_THREADS', '8')), thread_name_prefix='probe'
+      )
+    return _pool
+
+
+def _get(url):
+  timeout = (
+    float(os.getenv('PROBE_CONNECT_TIMEOUT', '3')),
+    float(os.getenv('PROBE_READ_TIMEOUT', '10')),
+  )
+  return requests.get(
+    url, headers=HEADERS, allow_redirects=False, timeout=timeout, stream=True
+  )
+
+
+def _read_body(r):
+  # Returns the body (up to the limit) and whether all of it was read
+  limit = int(os.getenv('PROBE_MAX_BYTES', '1048576'))
+  body = b''
+  for chunk in r.iter_content(65536):
+    body += chunk
+    if len(body) > limit:
+      return body[:limit], False
+  return body, True
+
+
+def _json(body):
+  try:
+    return json.loads(body)
+  except ValueError:
+    return None
+
+
+# Checks
+########
+def check_json_endpoint(url):
+  # Health and info endpoints return JSON
+  with _get(url) as r:
+    if r.status_code == 404:
+      return False
+    body, complete = _read_body(r)
+  return complete and bool(_json(body))
+
+
+def check_swagger_docs(url):
+  # Swagger UI redirects to the docs
+  with _get(url) as r:
+    location = r.headers.get('Location', '')
+    return r.status_code == 302 and (
+      '/swagger-ui/index.html' in location or 'api-docs/index.html' in location
+    )
+
+
+def check_subject_access_request(url):
+  with _get(url) as r:
+    if r.status_code != 200:
+      return False
+    body, complete = _read_body(r)
+  if not complete:
+    # Too big to parse, but the path would be there if it's documented
+    return f'"{SAR_PATH}"'.encode() in body
+  docs = _json(body)
+  return isinstance(docs, dict) and bool((docs.get('paths') or {}).get(SAR_PATH))
+
+
+CHECKS = {
+  'health': check_json_endpoint,
+  'info': check_json_endpoint,
+  'swagger': check_swagger_docs,
+  'sar': check_subject_access_request,
+}
+
+
+def _check(check, url):
+  if (found := probe_cache.get(check, url)) is not None:
+    log_debug(f'Cached {check} endpoint result for {url}: {found}')
+    return found
+  try:
+    found = bool(CHECKS[check](url))
+  except Exception as e:
+    # Connection errors and timeouts aren't cached, so the endpoint is probed
+    # again on the next run
+    log_info(f'Could not connect to endpoint {url} - {e}')
+    return False
+  if found:
+    log_debug(f'Found {check} endpoint: {url}')
+  probe_cache.put(check, url, found)
+  return found
+
+
+def probe(check, url):
+  # Concurrent probes of the same URL share one request
+  key = (check, url)
+  with _lock:
+    if key in _results:
+      return _results[key]
+  found = _in_flight.do(key, _check, check, url)
+  with _lock:
+    _results[key] = found
+  return found
+
+
+def _run(checks, results):
+  found = _executor().map(lambda check: probe(check[1], check[2]), checks)
+  for (env, check, _), result in zip(checks, found):
+    results[env][check] = result
+
+
+def probe_environments(endpoints, api_docs=True):
+  # endpoints is environment -> (url, health path, info path). The subject access
+  # request endpoint is only checked where Swagger docs were found.
+  results = {env: dict.fromkeys(CHECKS, False) for env in endpoints}
+  checks = []
+  for env, (url, health_path, info_path) in endpoints.items():
+    checks.append((env, 'health', f'{url}{health_path}'))
+    checks.append((env, 'info', f'{url}{info_path}'))
+    if api_docs:
+      checks.append((env, 'swagger', f'{url}/swagger-ui.html'))
+  _run(checks, results)
+  _run(
+    [
+      (env, 'sar', f'{url}/v3/api-docs')
+      for env, (url, _, _) in endpoints.items()
+      if results[env]['swagger']
+    ],
+    results,
+  )
+  return results
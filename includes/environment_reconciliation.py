@@ -0,0 +1,189 @@
+# End-of-run environment reconciliation
+# Instead of each processed component deleting its own stale environments, the
+# environments that discovery finds for each component are registered during the
+# run (see process_environments). At the end of the run the whole environments
+# table is read once and compared with them:
+# - orphans: environments of a processed component that discovery no longer
+#   finds, and environments that don't belong to any component
+# - duplicates: more than one environment with the same component, name and
+#   namespace (as utilities/check_duplicate_environments.py reports them) - the
+#   one in the environment lookup index (or else the oldest) is kept
+# These are deleted in batches, and reported in the job summary. Environments of
+# components that weren't processed in the run (eg. archived) are left alone,
+# apart from duplicates. On selective runs (eg. --component or --since) only the
+# selected components' environments are reconciled.
+#
+# If more environments would be deleted than ENV_RECONCILE_MAX_DELETES, nothing
+# is deleted and an error is logged, since that's more likely to be a discovery
+# problem than real changes.
+#
+# Optional environment variables
+# - ENV_RECONCILE: set to true to reconcile environments at the end of the run
+# - ENV_RECONCILE_MAX_DELETES: most environments deleted in one run (default 100)
+# - ENV_RECONCILE_BATCH_SIZE: environments deleted at the same time (default 10)
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# hmpps
+from hmpps.services.job_log_handling import log_error, log_info, log_warning
+
+# local
+from includes import sc_lookups, sc_pages
+from includes.sc_query import Projection
+
+ENVIRONMENTS = Projection(
+  'environments', fields=('name', 'namespace'), populate={'component': ('name',)}
+)
+
+_lock = threading.Lock()
+_discovered = None  # component name -> environment names, while active
+_results = {'orphaned': [], 'duplicates': [], 'failed': 0, 'skipped': None}
+
+
+def start():
+  # Called at the start of a batch run that reconciles at the end
+  global _discovered
+  if os.getenv('ENV_RECONCILE', '').lower() not in ('1', 'true', 'yes'):
+    return
+  with _lock:
+    _discovered = {}
+  log_info('Environments will be reconciled at the end of the run')
+
+
+def active():
+  return _discovered is not None
+
+
+def discovered(component_name, env_names):
+  # Returns True if the component's environments will be reconciled at the end
+  # of the run (rather than by the caller)
+  with _lock:
+    if _discovered is None:
+      return False
+    _discovered[component_name] = set(env_names)
+    return True
+
+
+def _stale(sc, records, discovered, selective=False):
+  # Returns (orphaned, duplicates) lists of environment records
+  orphaned = []
+  duplicates = []
+  by_key = {}
+  for record in records:
+    component_name = (record.get('component') or {}).get('name')
+    if selective and component_name not in discovered:
+      continue
+    if not component_name:
+      orphaned.append(record)
+    elif (
+      component_name in discovered
+      and record.get('name') not in discovered[component_name]
+    ):
+      orphaned.append(record)
+    else:
+      key = (component_name, record.get('name'), record.get('namespace'))
+      by_key.setdefault(key, []).append(record)
+
+  for (component_name, env_name, _), copies in by_key.items():
+    if len(copies) < 2:
+      continue
+    # Keep the one that discovery has been updating, if it's one of them
+    indexed_id = sc_lookups.get_environment(sc, component_name, env_name).get(
+      'documentId'
+    )
+    keep = next(
+      (copy for copy in copies if copy.get('documentId') == indexed_id),
+      min(copies, key=lambda copy: copy.get('id') or 0),
+    )
+    duplicates += [copy for copy in copies if copy is not keep]
+  return orphaned, duplicates
+
+
+def _delete(sc, record, orphaned):
+  component_name = (record.get('component') or {}).get('name')
+  env_name = record.get('name')
+  if sc.delete(sc.environments, record.get('documentId')):
+    # The copy of a duplicate that's kept is still there
+    if orphaned and component_name:
+      sc_lookups.record_deleted(sc, 'environments', (component_name, env_name))
+    return True
+  log_warning(
+    f'Failed to remove environment {env_name} ({record.get("documentId")}) '
+    f'of {component_name} from Service Catalogue'
+  )
+  return False
+
+
+def reconcile(services, selection=None):
+  # Compares the environments table with the environments found in the run.
+  # selection is the Selection the batch was run with, if any.
+  sc = services.sc
+  if not active():
+    return
+  with _lock:
+    discovered = dict(_discovered)
+  try:
+    records = sc_pages.get_all_records(sc, ENVIRONMENTS.query())
+  except Exception as e:
+    log_error(f'Unable to read the environments table to reconcile it - {e}')
+    return
+  if not records:
+    log_warning('No environments found in the Service Catalogue to reconcile')
+    return
+
+  # A record can be read twice if it moved between pages while they were read
+  records = list({record.get('documentId'): record for record in records}.values())
+  selective = selection is not None and selection.is_selective()
+  orphaned, duplicates = _stale(sc, records, discovered, selective)
+  stale = orphaned + duplicates
+  log_info(
+    f'{len(records)} environments reconciled with {len(discovered)} components: '
+    f'{len(orphaned)} orphaned, {len(duplicates)} duplicates'
+  )
+  max_deletes = int(os.getenv('ENV_RECONCILE_MAX_DELETES', '100'))
+  if len(stale) > max_deletes:
+    log_error(
+      f'Not removing {len(stale)} stale environments - more than '
+      f'ENV_RECONCILE_MAX_DELETES ({max_deletes})'
+    )
+    _results['skipped'] = len(stale)
+    return
+
+  batch_size = max(1, int(os.getenv('ENV_RECONCILE_BATCH_SIZE', '10')))
+  with ThreadPoolExecutor(max_workers=batch_size) as pool:
+    deleted = list(
+      pool.map(
+        lambda record, orphaned: _delete(sc, record, orphaned),
+        stale,
+        [True] * len(orphaned) + [False] * len(duplicates),
+      )
+    )
+  for i, (record, ok) in enumerate(zip(stale, deleted)):
+    if ok:
+      kind = 'orphaned' if i < len(orphaned) else 'duplicates'
+      component_name = (record.get('component') or {}).get('name') or '(none)'
+      _results[kind].append(f'{component_name} {record.get("name")}')
+    else:
+      _results['failed'] += 1
+
+
+def summary():
+  if not active():
+    return ''
+  summary = (
+    f'{len(_results["orphaned"])} orphaned and {len(_results["duplicates"])} '
+    'duplicate environment(s) removed\n'
+  )
+  for kind in ('orphaned', 'duplicates'):
+    for name in _results[kind]:
+      summary += f'  {name} ({kind})\n'
+  if _results['failed']:
+    summary += f'- {_results["failed"]} environment(s) could not be removed\n'
+  if _results['skipped']:
+    summary += (
+      f'- {_results["skipped"]} stale environment(s) not removed - more than '
+      'ENV_RECONCILE_MAX_DELETES\n'
+    )
+  return summary
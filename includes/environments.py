@@ -1,6 +1,9 @@
 # Environment specific functions
 # This will prepare data to be updated in the environment table
 # as well as returning data to be added to the component table (to be deprecated)
+#
+# A component's environments (bootstrap/Github and Helm) are worked out once by an
+# EnvironmentResolver, which check_env_change and process_environments share.
 # hmpps
 from hmpps import update_dict
 
@@ -12,7 +15,7 @@ from hmpps.services.job_log_handling import (
 
 # locals
 from includes.utils import get_existing_env_config
-from includes import helm
+from includes import environment_reconciliation, helm, sc_diff, sc_lookups
 from includes.values import env_mapping
 
 
@@ -39,8 +42,8 @@ def get_environments(component, repo, bootstrap_projects, services):
         {
           'type': 'dev',
           'namespace': project['circleci_project_k8s_namespace'],
-          'ns': sc.get_id(
-            'namespaces', 'name', project['circleci_project_k8s_namespace']
+          'ns': sc_lookups.get_id(
+            sc, 'namespaces', 'name', project['circleci_project_k8s_namespace']
           ),
         },
       )
@@ -57,7 +60,9 @@ def get_environments(component, repo, bootstrap_projects, services):
             {
               'type': env_type,
               'namespace': circleci_env['namespace'],
-              'ns': sc.get_id('namespaces', 'name', circleci_env['namespace']),
+              'ns': sc_lookups.get_id(
+                sc, 'namespaces', 'name', circleci_env['namespace']
+              ),
             },
           )
 
@@ -90,7 +95,7 @@ def get_environments(component, repo, bootstrap_projects, services):
                 if var.name == 'KUBE_NAMESPACE':
                   log_info(f'Found namespace {var.value} for {component_name}')
                   namespace = var.value
-                  ns_id = sc.get_id('namespaces', 'name', var.value)
+                  ns_id = sc_lookups.get_id(sc, 'namespaces', 'name', var.value)
 
               update_dict(
                 envs,
@@ -122,6 +127,50 @@ def get_environments(component, repo, bootstrap_projects, services):
   return envs
 
 
+#######################################################################################
+# EnvironmentResolver
+# Works out a component's environments once, the first time they're needed:
+# - the bootstrap/Github environments (get_environments)
+# - the helm_deploy listing and the environments in it
+# - the environments common to both, which are the ones that are kept
+# so that checking for changes and processing the environments don't each go back
+# to Github and the Service Catalogue for them.
+#######################################################################################
+class EnvironmentResolver:
+  def __init__(self, component, repo, bootstrap_projects, services):
+    self.component = component
+    self.repo = repo
+    self.bootstrap_projects = bootstrap_projects
+    self.services = services
+    self._config_envs = None
+    self._helm_dirs = None
+    self._helm_envs = None
+
+  def config_environments(self):
+    if self._config_envs is None:
+      self._config_envs = get_environments(
+        self.component, self.repo, self.bootstrap_projects, self.services
+      )
+    return self._config_envs
+
+  def helm_dirs(self):
+    if self._helm_dirs is None:
+      self._helm_dirs = helm.get_helm_dirs(self.repo, self.component, self.services.gh)
+    return self._helm_dirs
+
+  def helm_environments(self):
+    if self._helm_envs is None:
+      self._helm_envs = helm.get_envs_from_helm(
+        self.component, self.repo, self.services, self.helm_dirs()
+      )
+    return self._helm_envs
+
+  def current_environments(self):
+    # The helm environments that are also bootstrap/Github environments
+    config_envs = self.config_environments()
+    return [env for env in self.helm_environments() if env in config_envs]
+
+
 #######################################################################################
 # process_environments
 # This is the main function to process environments based on data from the helm chart
@@ -132,9 +181,11 @@ def get_environments(component, repo, bootstrap_projects, services):
 # associating it with a component.
 #######################################################################################
 def process_environments(
-  component, repo, helm_environments, bootstrap_projects, services
+  component, repo, helm_environments, bootstrap_projects, services, resolver=None
 ):
   sc = services.sc
+  if resolver is None:
+    resolver = EnvironmentResolver(component, repo, bootstrap_projects, services)
 
   component_name = component.get('name')
   log_debug(f'Processing environments for {component_name}')
@@ -152,9 +203,7 @@ def process_environments(
   # - namespace
   # - ns_id
 
-  if environment_data := get_environments(
-    component, repo, bootstrap_projects, services
-  ):
+  if environment_data := resolver.config_environments():
     log_debug(f'Found environments from bootstrap/Github: {environment_data}')
     # The helm environments are used as the primary source of truth for environments
     # since they define the enviroments to which the app can be deployed.
@@ -180,8 +229,7 @@ def process_environments(
       # Prepare the environment record with the basic data
       environment_record = helm_environments[env]
       # Link the environment record with the component record
-      component_id = sc.get_id('components', 'name', component_name)
-      if not component_id:
+      if not (component_id := _component_id(sc, component)):
         log_warning(
           f'Skipping environment {env} for {component_name}: component ID not found'
         )
@@ -191,27 +239,33 @@ def process_environments(
       # Add the environment name to the environment record
       environment_record['name'] = f'{env}'
 
-      # env_id fix starts here
-      env_id = None
-      # New logic to look for an environment name corresponding to a component_id
-      if env_id := services.sc.get_record(
-        services.sc.environments_get,
-        f'name][$eq]={env}&filters[component][name',
-        f'{component_name}',
-      ).get('documentId', ''):
-        # print(f'{json.dumps(env, indent=2)}')
+      # Look for an environment with this name belonging to the component
+      sc_env = _sc_environment(sc, component, env)
+      if env_id := sc_env.get('documentId', ''):
         log_info(
           f'Environment ID {env_id} found for environment name {env} associated with '
           f'{component_name} ({component_id})'
         )
-      if env_id:
         # Update the environment in the environment table if anything has changed
-        log_info(
-          f'Updating environment {env} for {component_name} in the environment table'
-        )
         log_debug(f'Environment_record: {environment_record}')
-        if sc.update(sc.environments, env_id, environment_record):
-          env_flags['env_updated'] = True
+        if changes := sc_diff.changed_fields(sc_env, environment_record):
+          log_info(
+            f'Updating environment {env} for {component_name} in the environment '
+            'table'
+          )
+        if sc_diff.update(
+          sc,
+          sc.environments,
+          sc_env,
+          environment_record,
+          name=f'{component_name} {env}',
+          write_stats=sc_diff.environment_stats,
+        ):
+          if changes:
+            sc_lookups.record_updated(
+              sc, 'environments', (component_name, env), sc_env, changes
+            )
+            env_flags['env_updated'] = True
         else:
           env_flags['env_error'] = True
       else:
@@ -221,20 +275,19 @@ def process_environments(
           'to the environment table'
         )
         log_debug(f'Environment data: {environment_record}')
-        if sc.add(sc.environments, environment_record):
+        if added := sc.add(sc.environments, environment_record):
+          sc_lookups.record_added(sc, 'environments', (component_name, env), added)
           env_flags['env_added'] = True
         else:
           env_flags['env_error'] = True
 
   # Check if SC has extra environments that are not in the helm chart
-  # and delete them from environment table
-  current_envs = []
+  # and delete them from environment table - unless they're being reconciled
+  # at the end of the run
+  current_envs = resolver.current_environments()
+  if environment_reconciliation.discovered(component_name, current_envs):
+    return env_flags
   sc_envs = component.get('envs', {})
-  config_envs = get_environments(component, repo, bootstrap_projects, services).keys()
-  helm_envs = helm.get_envs_from_helm(component, repo, services)
-  for helm_env in helm_envs:
-    if helm_env in config_envs:
-      current_envs.append(helm_env)
   extra_envs = set(env.get('name') for env in sc_envs if isinstance(env, dict)) - set(
     current_envs
   )
@@ -249,6 +302,7 @@ def process_environments(
       f'{component_name}'
     )
     if sc.delete(sc.environments, env_id):
+      sc_lookups.record_deleted(sc, 'environments', (component_name, env_name))
       log_info(
         f'Environment {env_name} removed from Service Catalogue for {component_name}'
       )
@@ -258,20 +312,37 @@ def process_environments(
   return env_flags
 
 
+# The component's documentId is in the record that's being processed, so there's
+# no need to look it up
+def _component_id(sc, component):
+  if component_id := component.get('documentId'):
+    return component_id
+  return sc_lookups.get_id(sc, 'components', 'name', component.get('name'))
+
+
+# Environments are compared with the indexed records, which have all their fields.
+# Without the index, the component's Service Catalogue environments are normally
+# populated (or pre-joined by the GraphQL read path), so there's no need to look
+# them up
+def _sc_environment(sc, component, env):
+  if sc_lookups.indexed(sc):
+    return sc_lookups.get_environment(sc, component.get('name'), env)
+  for sc_env in component.get('envs') or []:
+    if isinstance(sc_env, dict) and sc_env.get('name') == env:
+      if sc_env.get('documentId'):
+        return sc_env
+  return sc_lookups.get_environment(sc, component.get('name'), env)
+
+
 # Logic to check if the branch specific components need to be processed
-def check_env_change(component, repo, bootstrap_projects, services):
+def check_env_change(component, repo, bootstrap_projects, services, resolver=None):
   env_changed = False
   component_name = component.get('name')
-  current_envs = []
-  # Current envs are the combination of helm environments
-  # and the bootstrap/Github environments
-  config_envs = get_environments(component, repo, bootstrap_projects, services).keys()
-  helm_envs = helm.get_envs_from_helm(component, repo, services)
-
-  # get the environments that are common to both the helm and Github/Bootstrap
-  for helm_env in helm_envs:
-    if helm_env in config_envs:
-      current_envs.append(helm_env)
+  if resolver is None:
+    resolver = EnvironmentResolver(component, repo, bootstrap_projects, services)
+  # Current envs are the environments that are common to both the helm
+  # and Github/Bootstrap environments
+  current_envs = resolver.current_environments()
 
   log_debug(f'Current environments for {component_name}: {current_envs}')
   # Get the environments from the service catalogue
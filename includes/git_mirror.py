@@ -0,0 +1,305 @@
+# Local bare-mirror git cache
+# Keeps partial-clone (blobless) bare mirrors of component repositories on a
+# volume, so that file contents and directory listings can be read from local
+# git objects instead of the Github contents API.
+#
+# Each repository is fetched at most once per run - an incremental `git fetch`
+# if the mirror already exists, otherwise a blobless clone. Blobs are pulled
+# lazily by git the first time a file is read, so only the files discovery
+# actually looks at are ever downloaded.
+#
+# A file is only reported as missing if it isn't in the tree. If it's there but
+# can't be read (eg. the blob fetch failed), it's read from Github instead.
+#
+# Optional environment variables
+# - GIT_MIRROR_DIR: directory to hold the mirrors (mirroring is disabled if unset)
+# - GIT_MIRROR_URL: remote URL template, with {repo} replaced by the repository name
+#   (default https://github.com/ministryofjustice/{repo}.git). A file:// template
+#   (eg. file:///tmp/test-repos/{repo}.git) can be used as an offline stand-in.
+
+import base64
+import json
+import os
+import posixpath
+import subprocess
+import threading
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug, log_info, log_warning
+
+# local
+from includes import yaml_loader
+
+DEFAULT_MIRROR_URL = 'https://github.com/ministryofjustice/{repo}.git'
+GIT_TIMEOUT = 300
+
+
+def _normalise_path(path):
+  # Turn './helm_deploy/values.yaml', '/x' or '.' into paths git understands
+  path = posixpath.normpath(path or '.').lstrip('/')
+  return '' if path == '.' else path
+
+
+class MirrorReadError(Exception):
+  # A file is in the mirror's tree, but it can't be read (eg. the lazy blob
+  # fetch failed, or the mirror is corrupt)
+  pass
+
+
+class MirrorContentFile:
+  # Minimal stand-in for PyGithub's ContentFile, for directory listings
+  # that are read from a local mirror. Contents are only read when asked for.
+  def __init__(self, mirror, repo_name, ref, path, type, sha, token=None):
+    self._mirror = mirror
+    self._repo_name = repo_name
+    self._ref = ref
+    self._token = token
+    self.path = path
+    self.name = posixpath.basename(path)
+    self.type = type
+    self.sha = sha
+
+  @property
+  def decoded_content(self):
+    return (
+      self._mirror.read_file(self._repo_name, self.path, self._ref, self._token)
+      or b''
+    )
+
+  def __repr__(self):
+    return f'MirrorContentFile(path="{self.path}")'
+
+
+class GitMirror:
+  def __init__(self, mirror_dir, url_template=DEFAULT_MIRROR_URL):
+    self.mirror_dir = mirror_dir
+    self.url_template = url_template
+    self._synced = {}
+    self._repo_locks = {}
+    self._lock = threading.Lock()
+    os.makedirs(self.mirror_dir, exist_ok=True)
+
+  def repo_dir(self, repo_name):
+    return os.path.join(self.mirror_dir, f'{repo_name}.git')
+
+  def _git(self, *args, token=None, check=True):
+    cmd = ['git']
+    # The token is passed as a header on each call rather than being embedded in
+    # the remote URL, so it never ends up in the mirror's git config
+    if token and self.url_template.startswith('https://'):
+      basic = base64.b64encode(f'x-access-token:{token}'.encode()).decode()
+      cmd.extend(['-c', f'http.extraHeader=Authorization: Basic {basic}'])
+    cmd.extend(args)
+    return subprocess.run(
+      cmd,
+      capture_output=True,
+      check=check,
+      timeout=GIT_TIMEOUT,
+      env={**os.environ, 'GIT_TERMINAL_PROMPT': '0'},
+    )
+
+  def _repo_lock(self, repo_name):
+    with self._lock:
+      return self._repo_locks.setdefault(repo_name, threading.Lock())
+
+  def sync(self, repo_name, token=None):
+    # Clone or fetch the mirror - only once per run for each repository.
+    # Returns True if the mirror is up to date and can be read from.
+    with self._repo_lock(repo_name):
+      if repo_name in self._synced:
+        return self._synced[repo_name]
+
+      git_dir = self.repo_dir(repo_name)
+      url = self.url_template.format(repo=repo_name)
+      try:
+        if os.path.isdir(git_dir):
+          log_debug(f'Fetching git mirror for {repo_name}')
+          self._git(
+            '--git-dir',
+            git_dir,
+            'fetch',
+            '--prune',
+            '--no-tags',
+            '--filter=blob:none',
+            url,
+            '+refs/heads/*:refs/heads/*',
+            token=token,
+          )
+        else:
+          log_info(f'Creating git mirror for {repo_name}')
+          self._git(
+            'clone',
+            '--bare',
+            '--filter=blob:none',
+            '--no-tags',
+            url,
+            git_dir,
+            token=token,
+          )
+        synced = True
+      except Exception as e:
+        stderr = getattr(e, 'stderr', b'') or b''
+        log_warning(
+          f'Unable to sync git mirror for {repo_name} - {e} {stderr.decode().strip()}'
+        )
+        synced = False
+
+      self._synced[repo_name] = synced
+      return synced
+
+  def read_file(self, repo_name, path, ref='HEAD', token=None):
+    # Returns the file contents as bytes, or None if it isn't in the tree.
+    # Raises MirrorReadError if it can't be read for any other reason.
+    result = self._git(
+      '--git-dir',
+      self.repo_dir(repo_name),
+      'cat-file',
+      'blob',
+      f'{ref}:{_normalise_path(path)}',
+      token=token,
+      check=False,
+    )
+    if result.returncode == 0:
+      return result.stdout
+    if self.path_exists(repo_name, path, ref, token) is False:
+      log_debug(f'{path} not found in git mirror for {repo_name} ({ref})')
+      return None
+    raise MirrorReadError(
+      f'Unable to read {path} from git mirror for {repo_name} ({ref}) - '
+      f'{result.stderr.decode(errors="replace").strip()}'
+    )
+
+  def path_exists(self, repo_name, path, ref='HEAD', token=None):
+    # Answered from the trees, which a blobless mirror always has locally.
+    # Returns None if the tree can't be read.
+    result = self._git(
+      '--git-dir',
+      self.repo_dir(repo_name),
+      'ls-tree',
+      ref,
+      '--',
+      _normalise_path(path),
+      token=token,
+      check=False,
+    )
+    if result.returncode != 0:
+      return None
+    return bool(result.stdout.strip())
+
+  def list_dir(self, repo_name, path, ref='HEAD', token=None):
+    # Returns a list of MirrorContentFile objects, or None if the directory
+    # doesn't exist
+    dir_path = _normalise_path(path)
+    result = self._git(
+      '--git-dir',
+      self.repo_dir(repo_name),
+      'ls-tree',
+      f'{ref}:{dir_path}',
+      token=token,
+      check=False,
+    )
+    if result.returncode != 0:
+      log_debug(f'{path} not found in git mirror for {repo_name} ({ref})')
+      return None
+
+    contents = []
+    for line in result.stdout.decode().splitlines():
+      # <mode> SP <type> SP <sha> TAB <name>
+      meta, name = line.split('\t', 1)
+      _, object_type, sha = meta.split()
+      if object_type not in ('blob', 'tree'):
+        continue  # submodules
+      contents.append(
+        MirrorContentFile(
+          self,
+          repo_name,
+          ref,
+          posixpath.join(dir_path, name),
+          'dir' if object_type == 'tree' else 'file',
+          sha,
+          token,
+        )
+      )
+    return contents
+
+
+class GitMirrorSession:
+  # Wraps a GithubSession so that file reads and directory listings are served
+  # from local git mirrors. Everything else is passed straight through to the
+  # Github session, and reads fall back to the API if a mirror can't be synced.
+  def __init__(self, gh, mirror):
+    self._gh = gh
+    self.mirror = mirror
+
+  def __getattr__(self, name):
+    return getattr(self._gh, name)
+
+  def _token(self):
+    return getattr(self._gh, 'rest_token', None)
+
+  def _ref(self, repo):
+    return f'refs/heads/{repo.default_branch}'
+
+  def _mirror_ready(self, repo):
+    return self.mirror.sync(repo.name, token=self._token())
+
+  def get_file_plain(self, repo, path):
+    if not self._mirror_ready(repo):
+      return self._gh.get_file_plain(repo, path)
+    try:
+      content = self.mirror.read_file(
+        repo.name, path, self._ref(repo), self._token()
+      )
+    except MirrorReadError as e:
+      log_warning(f'{e} - reading it from Github instead')
+      return self._gh.get_file_plain(repo, path)
+    if content is None:
+      return None
+    return content.decode('utf-8', errors='replace')
+
+  def file_exists(self, repo, path):
+    # None if the mirror isn't available (or its tree can't be read)
+    if not self._mirror_ready(repo):
+      return None
+    return self.mirror.path_exists(repo.name, path, self._ref(repo), self._token())
+
+  def get_file_yaml(self, repo, path):
+    if not self._mirror_ready(repo):
+      return self._gh.get_file_yaml(repo, path)
+    if (content := self.get_file_plain(repo, path)) is None:
+      return None
+    try:
+      return yaml_loader.safe_load(content)
+    except yaml_loader.YAMLError as e:
+      log_warning(f'Unable to parse {path} in {repo.name} - {e}')
+      return None
+
+  def get_file_json(self, repo, path):
+    if not self._mirror_ready(repo):
+      return self._gh.get_file_json(repo, path)
+    if (content := self.get_file_plain(repo, path)) is None:
+      return None
+    try:
+      return json.loads(content)
+    except json.JSONDecodeError as e:
+      log_warning(f'Unable to parse {path} in {repo.name} - {e}')
+      return None
+
+  def get_dir_contents(self, repo, path):
+    # Returns None if the mirror isn't available, so the caller can use the API
+    if not self._mirror_ready(repo):
+      return None
+    contents = self.mirror.list_dir(repo.name, path, self._ref(repo), self._token())
+    if contents is None:
+      raise FileNotFoundError(f'{path} not found in {repo.name}')
+    return contents
+
+
+def wrap_session(gh):
+  # Returns a mirror-backed session if GIT_MIRROR_DIR is set,
+  # otherwise the Github session unchanged
+  if mirror_dir := os.getenv('GIT_MIRROR_DIR'):
+    log_info(f'Using local git mirrors in {mirror_dir}')
+    mirror = GitMirror(mirror_dir, os.getenv('GIT_MIRROR_URL', DEFAULT_MIRROR_URL))
+    return GitMirrorSession(gh, mirror)
+  return gh
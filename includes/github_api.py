@@ -1,3 +1,6 @@
+# local
+from includes.singleflight import SingleFlight
+
 GITHUB_API_BASE_URL = 'https://api.github.com'
 GITHUB_API_VERSION = '2026-03-10'
 GITHUB_ACCEPT_HEADER = 'application/vnd.github+json'
@@ -8,4 +11,28 @@ def get_github_api_headers(token):
     'Authorization': f'Bearer {token}',
     'Accept': GITHUB_ACCEPT_HEADER,
     'X-GitHub-Api-Version': GITHUB_API_VERSION,
-  }
\ No newline at end of file
+  }
+
+
+# Components in a monorepo share a Github repository, so concurrent lookups of
+# the same repository share a single request
+_repo_lookups = SingleFlight()
+
+
+def get_org_repo(gh, repo_name):
+  # Components without a Github repository aren't found
+  if not repo_name:
+    return None
+  return _repo_lookups.do(repo_name, gh.get_org_repo, repo_name)
+
+
+def get_repos_pushed_since(gh, since):
+  # Names of the organisation's repositories that have been pushed to since a
+  # time - the repositories are listed most recently pushed first, so the listing
+  # can stop at the first one that's older
+  repos = []
+  for repo in gh.org.get_repos(sort='pushed', direction='desc'):
+    if repo.pushed_at and repo.pushed_at < since:
+      break
+    repos.append(repo.name)
+  return repos
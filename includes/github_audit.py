@@ -0,0 +1,70 @@
+# PyGithub lazy-completion audit
+# PyGithub objects that were built from partial data (eg. an item in a list, or
+# an object embedded in another response) silently make an extra GET request
+# the first time an attribute that wasn't in that data is read.
+#
+# Setting GITHUB_LAZY_AUDIT=true logs every one of those requests along with
+# the line of discovery code that caused it, and a summary by call site when
+# the job finishes.
+
+import atexit
+import os
+import threading
+import traceback
+from collections import Counter
+
+# hmpps
+from hmpps.services.job_log_handling import log_info, log_warning
+
+_call_sites = Counter()
+_lock = threading.Lock()
+
+
+def _discovery_call_site():
+  # The innermost frame that isn't in PyGithub (or this module)
+  for frame in reversed(traceback.extract_stack()[:-2]):
+    if f'{os.sep}github{os.sep}' not in frame.filename and frame.filename != __file__:
+      return f'{os.path.relpath(frame.filename)}:{frame.lineno} ({frame.name})'
+  return 'unknown'
+
+
+def report():
+  with _lock:
+    if not _call_sites:
+      log_info('Github lazy-completion audit: no implicit requests')
+      return
+    summary = f'Github lazy-completion audit: {sum(_call_sites.values())} requests\n'
+    for call_site, count in _call_sites.most_common():
+      summary += f'  {count:>5} {call_site}\n'
+  log_info(summary)
+
+
+def enable_lazy_completion_audit():
+  try:
+    from github.GithubObject import CompletableGithubObject
+  except ImportError as e:
+    log_warning(f'Unable to enable Github lazy-completion audit - {e}')
+    return
+
+  complete_if_needed = CompletableGithubObject._completeIfNeeded
+
+  def _audited_complete_if_needed(self):
+    if not getattr(self, '_CompletableGithubObject__completed', True):
+      call_site = _discovery_call_site()
+      with _lock:
+        _call_sites[call_site] += 1
+      # Read the URL attribute directly - the url property could itself complete
+      url = getattr(getattr(self, '_url', None), 'value', '')
+      log_info(
+        f'Github lazy completion of {type(self).__name__} ({url}) from {call_site}'
+      )
+    return complete_if_needed(self)
+
+  CompletableGithubObject._completeIfNeeded = _audited_complete_if_needed
+  atexit.register(report)
+  log_info('Github lazy-completion audit enabled')
+
+
+def enable_from_env():
+  if os.getenv('GITHUB_LAZY_AUDIT', '').lower() in ('1', 'true', 'yes'):
+    enable_lazy_completion_audit()
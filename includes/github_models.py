@@ -0,0 +1,55 @@
+# Lightweight Github repository and team models
+# These are read from the JSON that Github has already returned for a PyGithub
+# object (or from raw API JSON), so reading their attributes never triggers
+# one of PyGithub's hidden completion requests. Attributes that weren't in the
+# JSON are simply None.
+
+
+def _raw_data(github_object):
+  # PyGithub keeps the JSON it was built from in _rawData - the public raw_data
+  # property would complete the object first
+  return getattr(github_object, '_rawData', None) or {}
+
+
+class RepoModel:
+  __slots__ = (
+    'name',
+    'full_name',
+    'description',
+    'language',
+    'visibility',
+    'archived',
+    'default_branch',
+    'pushed_at',
+  )
+
+  def __init__(self, data):
+    for attr in self.__slots__:
+      setattr(self, attr, data.get(attr))
+    if self.visibility is None and 'private' in data:
+      self.visibility = 'private' if data['private'] else 'public'
+
+  @classmethod
+  def from_github(cls, repo):
+    return cls(_raw_data(repo))
+
+
+class TeamModel:
+  __slots__ = (
+    'id',
+    'name',
+    'slug',
+    'description',
+    'parent_name',
+  )
+
+  def __init__(self, data):
+    self.id = data.get('id')
+    self.name = data.get('name')
+    self.slug = data.get('slug')
+    self.description = data.get('description')
+    self.parent_name = (data.get('parent') or {}).get('name')
+
+  @classmethod
+  def from_github(cls, team):
+    return cls(_raw_data(team))
@@ -1,7 +1,7 @@
 import re
 
 # hmpps
-from hmpps import update_dict, fetch_yaml_values_for_key
+from hmpps import update_dict
 from hmpps.services.job_log_handling import (
   log_debug,
   log_info,
@@ -9,17 +9,16 @@ from hmpps.services.job_log_handling import (
 )
 
 # Locals
+from includes import endpoint_probe, helm_values, negative_cache, sc_lookups
 from includes.utils import (
+  get_dir_contents,
   remove_version,
-  test_endpoint,
-  test_swagger_docs,
-  test_subject_access_request_endpoint,
   is_ipallowList_enabled,
 )
 from includes.values import env_mapping
 
 
-def get_helm_dirs(repo, component):
+def get_helm_dirs(repo, component, gh):
   component_name = component.get('name')
 
   component_project_dir = (
@@ -32,18 +31,17 @@ def get_helm_dirs(repo, component):
   log_debug(f'helm_dir for {component_name} is {helm_dir}')
 
   try:
-    helm_deploy_dir = repo.get_contents(
-      helm_dir, ref=repo.get_branch(repo.default_branch).commit.sha
-    )
+    helm_deploy_dir = get_dir_contents(gh, repo, helm_dir)
   except Exception as e:
     helm_deploy_dir = None
     log_warning(f'Unable to load the helm_deploy folder for {component_name}: {e}')
   return (helm_dir, helm_deploy_dir)
 
 
-def get_envs_from_helm(component, repo, services):
+def get_envs_from_helm(component, repo, services, helm_dirs=None):
   helm_environments = []
-  helm_dirs = get_helm_dirs(repo, component)
+  if helm_dirs is None:
+    helm_dirs = get_helm_dirs(repo, component, services.gh)
   helm_dir, helm_deploy_dir = helm_dirs
   if helm_deploy_dir:
     for helm_file in helm_deploy_dir:
@@ -53,109 +51,115 @@ def get_envs_from_helm(component, repo, services):
   return helm_environments
 
 
-def fetch_helm_default_values(
-  sc, helm_default_values, allow_list_key, component_name, data
-):
-  helm_defaults = {
-    'mod_security': {},
-    'alert_severity_label': None,
-    'ip_allow_list': (
-      fetch_yaml_values_for_key(helm_default_values, allow_list_key) or {}
-    ),
-  }
+class HelmFiles:
+  # The Helm values files of a component. The environment files are taken from
+  # the helm_deploy listing, so there's no need to probe for .yaml / .yml, and
+  # each file is fetched and parsed once however many times it's read.
+  def __init__(self, gh, repo, component, helm_dir, helm_deploy_dir):
+    self.gh = gh
+    self.repo = repo
+    self.component = component
+    self.helm_dir = helm_dir
+    self.listed = [helm_file.name for helm_file in helm_deploy_dir]
+    # Blob (or tree) SHAs from the listing, used to cache the effective values
+    self.shas = {
+      helm_file.name: getattr(helm_file, 'sha', None) for helm_file in helm_deploy_dir
+    }
+    # environment -> values file name (.yaml in preference to .yml)
+    self.env_files = {}
+    for name in self.listed:
+      if envs := re.match('values-([a-z0-9-]+)\\.y[a]?ml', name):
+        if self.env_files.get(envs[1], '.yml').endswith('.yml'):
+          self.env_files[envs[1]] = name
+    self._files = {}
+    self._is_node_app = None
+
+  @property
+  def environments(self):
+    return list(self.env_files)
+
+  def _get(self, path):
+    if path not in self._files:
+      self._files[path] = negative_cache.get_file_yaml(self.gh, self.repo, path)
+    return self._files[path]
+
+  def env_values(self, env):
+    if file_name := self.env_files.get(env):
+      return self._get(f'{self.helm_dir}/{file_name}') or None
+    return None
+
+  def default_values(self):
+    component_name = self.component.get('name')
+    paths = [
+      f'{self.helm_dir}/{component_name}/values.yaml',
+      f'{self.helm_dir}/{component_name}/values.yml',
+    ]
+    # Files directly in the helm_deploy directory are only read if listed
+    paths += [
+      f'{self.helm_dir}/{name}'
+      for name in ('values.yaml', 'values.yml')
+      if name in self.listed
+    ]
+    for path in paths:
+      if values := self._get(path):
+        return values
+    return {}
+
+  def env_values_sha(self, env):
+    return self.shas.get(self.env_files.get(env))
+
+  def default_values_shas(self):
+    # values.yaml is either in the component's chart directory (whose tree SHA
+    # covers it) or directly in the helm_deploy directory
+    if not any(self.shas.values()):
+      return None
+    return tuple(
+      self.shas.get(name)
+      for name in (self.component.get('name'), 'values.yaml', 'values.yml')
+    )
+
+  def is_node_app(self):
+    if self._is_node_app is None:
+      component_project_dir = (
+        self.component.get('path_to_project', self.component.get('name'))
+        if self.component.get('part_of_monorepo')
+        else '.'
+      )
+      self._is_node_app = bool(
+        negative_cache.get_file_json(
+          self.gh, self.repo, f'{component_project_dir}/package.json'
+        )
+      )
+    return self._is_node_app
+
 
-  # Try to get the container image
-  if container_image := helm_default_values.get('image', {}).get('repository', {}):
+def fetch_helm_default_values(sc, helm_defaults, component_name, data):
+  # Container image and product from values.yaml
+  if container_image := helm_defaults.container_image:
     data['container_image'] = container_image
     log_debug(
-      f'Container image found in image->repository for {component_name}: '
-      f'{container_image}'
+      f'Container image found in values.yaml for {component_name}: {container_image}'
     )
-  if 'generic-service' in helm_default_values:
-    log_debug(f'generic-service found for {component_name}')
-    if 'generic-service' in helm_default_values and (
-      container_image := helm_default_values.get('generic-service', {})
-      .get('image', {})
-      .get('repository')
-    ):
-      data['container_image'] = container_image
-      log_debug(
-        f'Container image found in generic-service->image->repository for '
-        f'{component_name}: {container_image}'
-      )
-
-    # Try to get the productID from helm values.yaml
-    if helm_product_id := helm_default_values.get('generic-service', {}).get(
-      'productId', {}
-    ):
-      if sc_product_id := sc.get_id('products', 'p_id', helm_product_id):
-        data['product'] = sc_product_id
-
-    # Get modsecurity data defaults, if enabled.
-    for mod_security_type in [
-      'modsecurity_enabled',
-      'modsecurity_audit_enabled',
-      'modsecurity_snippet',
-    ]:
-      helm_defaults['mod_security'][mod_security_type] = (
-        helm_default_values.get('generic-service', {})
-        .get('ingress', {})
-        .get(mod_security_type, None)
-      )
+  if helm_product_id := helm_defaults.product_id:
+    if sc_product_id := sc_lookups.get_id(sc, 'products', 'p_id', helm_product_id):
+      data['product'] = sc_product_id
   if not data.get('container_image'):
     log_info(f'No container image found for {component_name}')
 
-  helm_defaults['alert_severity_label'] = helm_default_values.get(
-    'generic-prometheus-alerts', {}
-  ).get('alertSeverity', None)
-
-  return helm_defaults
-
-
-def get_mod_security_settings(values, helm_defaults, helm_envs, env):
-  for mod_security_type in [
-    ('modsecurity_enabled', False),
-    ('modsecurity_audit_enabled', False),
-    ('modsecurity_snippet', None),
-  ]:  # default to this
-    if 'generic-service' in values and 'ingress' in values['generic-service']:
-      if mod_security_env_enabled := values['generic-service']['ingress'].get(
-        mod_security_type[0]
-      ):
-        log_debug(
-          f'Updating {mod_security_type[0]} to environment value: '
-          f'{mod_security_env_enabled}'
-        )
-        update_dict(
-          helm_envs,
-          env,
-          {mod_security_type[0]: mod_security_env_enabled},
-        )
-      elif helm_defaults.get('mod_security', {}).get(mod_security_type[0]):
-        log_debug(
-          f'Updating {mod_security_type[0]} to default value: '
-          f'{helm_defaults.get("mod_security", {}).get(mod_security_type[0])}'
-        )
-        update_dict(
-          helm_envs,
-          env,
-          {
-            mod_security_type[0]: helm_defaults.get('mod_security', {}).get(
-              mod_security_type[0]
-            )
-          },
-        )
-      else:  # default either to false or None
-        update_dict(helm_envs, env, {mod_security_type[0]: mod_security_type[1]})
+
+def get_mod_security_settings(env_values, helm_envs, env):
+  if env_values.mod_security is not None:
+    log_debug(f'Updating {env} modsecurity settings to {env_values.mod_security}')
+    update_dict(helm_envs, env, env_values.mod_security)
 
 
 def get_generic_prometheus_alerts(
-  am, component_name, env, values, helm_defaults, helm_envs, data
+  am, component_name, env, env_values, helm_defaults, helm_envs
 ):
-  if generic_prometheus_alerts := values.get('generic-prometheus-alerts'):
+  if generic_prometheus_alerts := env_values.generic_prometheus_alerts:
     # Alertmanager config
     if alertmanager_config := fetch_alertmanager_config(
-      am, env, helm_defaults, component_name, generic_prometheus_alerts
+      am, env, helm_defaults, component_name, env_values.alert_severity_label
     ):
       log_debug(f'Alertmanager config for {env} is now: {alertmanager_config}')
       # Update the helm environment data with the outcome of this check
@@ -212,26 +216,23 @@ def fetch_sqs_alerts_config(generic_prometheus_alerts):
 
 
 def fetch_alertmanager_config(
-  am, env, helm_defaults, component_name, generic_prometheus_alerts
+  am, env, helm_defaults, component_name, env_alert_severity_label
 ):
   alertmanager_config = {}
   alert_severity_label = None
   alerts_slack_channel = None
   if am.isDataAvailable():
     # Update Alert severity label and slack channel
-    alert_severity_label = generic_prometheus_alerts.get('alertSeverity')
+    alert_severity_label = env_alert_severity_label
     if alert_severity_label:
-      log_debug(
-        f'generic-prometheus alerts found in values: {generic_prometheus_alerts}'
-      )
       log_debug(f'Updating {env} alert_severity_label to {alert_severity_label}')
 
-  if not alert_severity_label and helm_defaults.get('alert_severity_label'):
+  if not alert_severity_label and helm_defaults.alert_severity_label:
     log_info(
       f'Alert severity label not found for {component_name} in {env} - '
       f'setting to default'
     )
-    alert_severity_label = helm_defaults.get('alert_severity_label')
+    alert_severity_label = helm_defaults.alert_severity_label
   else:
     log_info(
       f'Alert severity label not found for {component_name} in values.yaml & '
@@ -268,7 +269,8 @@ def update_helm_dep_versions(gh, repo, helm_dir, component_name, data):
   helm_dep_versions = {}
 
   for path in helm_file_paths:
-    if (helm_chart := gh.get_file_yaml(repo, path)) and 'dependencies' in helm_chart:
+    helm_chart = negative_cache.get_file_yaml(gh, repo, path)
+    if helm_chart and 'dependencies' in helm_chart:
       helm_dep_versions = {
         item['name']: {'ref': item['version'], 'path': path}
         for item in helm_chart['dependencies']
@@ -281,23 +283,7 @@ def update_helm_dep_versions(gh, repo, helm_dir, component_name, data):
     remove_version(data, 'Helm Dependencies')
 
 
-# Use this to check for AUDIT_SQS_QUEUE_URL
-def check_for_key(data, target_key):
-  target_key = target_key.upper()
-  if isinstance(data, dict):
-    for k, v in data.items():
-      if str(k).upper() == target_key:
-        return True
-      if check_for_key(v, target_key):
-        return True
-  elif isinstance(data, list):
-    for item in data:
-      if check_for_key(item, target_key):
-        return True
-  return False
-
-
-def get_info_from_helm(data, component, repo, services):
+def get_info_from_helm(data, component, repo, services, helm_dirs=None):
   gh = services.gh
   am = services.am
   sc = services.sc
@@ -305,71 +291,32 @@ def get_info_from_helm(data, component, repo, services):
   # Shortcuts to make it easier to read
   component_name = component.get('name')
 
-  audit_sqs_defined = False
-
-  helm_environments = []
-  # environments is returned from helm as a dictionary
-
-  helm_dirs = get_helm_dirs(repo, component)
+  # The listing may already have been read to work out the environments
+  if helm_dirs is None:
+    helm_dirs = get_helm_dirs(repo, component, gh)
   helm_dir, helm_deploy_dir = helm_dirs
 
   # No point in continuing if there's no deploy directory
   if not helm_deploy_dir:
     return False
 
-  # variables used for implementation of findind IP allowlist in helm values files
-  allow_list_key = 'allowlist'
-  ip_allow_list_data = {}
-  ip_allow_list = {}
-
-  # Read in the environments from the helm deployment directory
-  for helm_file in helm_deploy_dir:
-    if not helm_file.name.startswith('values-'):
-      continue
-
-    if envs := re.match('values-([a-z0-9-]+)\\.y[a]?ml', helm_file.name):
-      helm_environments.append(envs[1])
-
-    # HEAT-223 Start : Read and collate data for IPallowlist from all environment
-    # specific values.yaml files.
-    ip_allow_list[helm_file] = fetch_yaml_values_for_key(
-      gh.get_file_yaml(repo, f'{helm_dir}/{helm_file.name}'),
-      allow_list_key,
-    )
-    if ip_allow_list[helm_file]:
-      ip_allow_list_data[helm_file.name] = ip_allow_list[helm_file]
-    # HEAT-223 End : Read and collate data for IPallowlist from all environment
-    # specific values.yaml files.
+  # Every values file is fetched and parsed once, and read from here
+  helm_files = HelmFiles(gh, repo, component, helm_dir, helm_deploy_dir)
+  helm_environments = helm_files.environments
 
   # DEFAULT VALUES SECTION
   # ----------------------
-  # Default values for modsecurity and alert_severity_label - clear these out
-  # in case theres's nothing set
-
-  # Get the default values chart filename (including yml versions)
-  helm_defaults = {}
-  helm_default_values = (
-    gh.get_file_yaml(repo, f'{helm_dir}/{component.get("name")}/values.yaml')
-    or gh.get_file_yaml(repo, f'{helm_dir}/{component.get("name")}/values.yml')
-    or gh.get_file_yaml(repo, f'{helm_dir}/values.yaml')
-    or gh.get_file_yaml(repo, f'{helm_dir}/values.yml')
-    or {}
-  )
-  log_debug(f'helm_default_values: {helm_default_values}')
+  # Settings from values.yaml, which the environments fall back to
+  helm_defaults = helm_values.defaults_for(helm_files)
+  fetch_helm_default_values(sc, helm_defaults, component_name, data)
 
   # First place to check for AUDIT_SQS_QUEUE_URL
-  if check_for_key(helm_default_values, 'AUDIT_SQS_QUEUE_URL'):
-    audit_sqs_defined = True
-
-  # Get the default values from the helm chart - and only proceed if there is one
-
-  if helm_default_values:
-    helm_defaults = fetch_helm_default_values(
-      sc, helm_default_values, allow_list_key, component_name, data
-    )
+  audit_sqs_defined = helm_defaults.audit_sqs_defined
 
   # Main dictionary to store helm data as we go
   helm_envs = {}
+  # Environment -> (url, health path, info path) to check
+  endpoints = {}
 
   # Process the helm environments
   # -----------------------------
@@ -382,158 +329,95 @@ def get_info_from_helm(data, component, repo, services):
       # If the repo is archived, then monitoring should be automatically set to False
       update_dict(helm_envs, env, {'monitor': False})
 
-    # Get the values.yaml file for the environment
-    values = (
-      gh.get_file_yaml(repo, f'{helm_dir}/values-{env}.yaml')
-      or gh.get_file_yaml(repo, f'{helm_dir}/values-{env}.yml')
-      or None
-    )
-    log_debug(f'helm values for {component_name} in {env}: {values}')
-    if values:
-      if 'generic-service' in values:
-        # Check for postgres database restore setting
-        if postgres_restore := (
-          values['generic-service'].get('postgresDatabaseRestore', {}).get('enabled')
-        ):
-          update_dict(helm_envs, env, {'postgres_database_restore': postgres_restore})
-          log_debug(
-            f'postgresDatabaseRestore set to {postgres_restore} in {env} for '
-            f'{component_name}'
-          )
-        # Check for ingress
-        if ingress_dict := values['generic-service'].get('ingress'):
-          if 'host' in ingress_dict:
-            update_dict(helm_envs, env, {'url': f'https://{ingress_dict["host"]}'})
-          elif 'hosts' in ingress_dict:
-            last_host_record = ingress_dict.get('hosts')[-1]
-            log_debug(
-              f'hosts found - last record is {last_host_record} - which is of type '
-              f'{type(last_host_record)}'
-            )
-            host = (
-              last_host_record.get('host', '')
-              if isinstance(last_host_record, dict)
-              else last_host_record
-            )
-            log_debug(f'host is: {host}')
-            update_dict(
-              helm_envs,
-              env,
-              {'url': f'https://{host}'},
-            )
-      # ingress->host(s)
-      elif 'ingress' in values:
-        ingress_dict = values.get('ingress')
-        if host := ingress_dict.get('host'):
-          update_dict(helm_envs, env, {'url': f'https://{host}'})
-        elif 'hosts' in ingress_dict:
-          last_host_record = ingress_dict.get('hosts')[-1]
-          log_debug(
-            f'hosts found - last record is {last_host_record} - which is of type '
-            f'{type(last_host_record)}'
-          )
-          host = (
-            last_host_record.get('host', '')
-            if isinstance(last_host_record, dict)
-            else last_host_record
-          )
-          log_debug(f'host is: {host}')
-          update_dict(
-            helm_envs,
-            env,
-            {'url': f'https://{host}'},
-          )
-
-      # Container image alternative location
-      if 'image' in values:
-        # image->repository
-        if container_image := values.get('image', {}).get('repository', {}):
-          data['container_image'] = container_image
-        # generic-service->image->repository
-        elif 'generic-service' in values and 'image' in values['generic-service']:
-          if container_image := values['generic-service']['image']['repository']:
-            data['container_image'] = container_image
-
-      # Check if front-end app
-      component_project_dir = (
-        component.get('path_to_project', component_name)
-        if component.get('part_of_monorepo')
-        else '.'
+    # The effective values for the environment
+    env_values = helm_values.environment_for(helm_files, env, helm_defaults)
+    if not env_values:
+      continue
+
+    # Check for postgres database restore setting
+    if postgres_restore := env_values.postgres_database_restore:
+      update_dict(helm_envs, env, {'postgres_database_restore': postgres_restore})
+      log_debug(
+        f'postgresDatabaseRestore set to {postgres_restore} in {env} for '
+        f'{component_name}'
       )
-      is_node_app = False
-      if services.gh.get_file_json(repo, f'{component_project_dir}/package.json'):
-        is_node_app = True
 
-      data['api'] = not is_node_app
-      data['frontend'] = is_node_app
+    # ingress->host(s)
+    if env_values.url:
+      update_dict(helm_envs, env, {'url': env_values.url})
 
-      # Modsecurity settings
-      get_mod_security_settings(values, helm_defaults, helm_envs, env)
+    # Container image alternative location
+    if container_image := env_values.container_image:
+      data['container_image'] = container_image
 
-      # Generic prometheus alert configs
-      get_generic_prometheus_alerts(
-        am, component_name, env, values, helm_defaults, helm_envs, data
-      )
+    # Check if front-end app (package.json is only fetched once)
+    is_node_app = helm_files.is_node_app()
 
-      # Health paths using the host name:
-      health_path = None
-      info_path = None
-      if env_host := helm_envs[env].get('url'):
-        env_url = f'{env_host}'
-        health_path = '/health'
-        info_path = '/info'
-        # Hack for hmpps-auth non standard endpoints
-        if 'sign-in' in env_url:
-          health_path = '/auth/health'
-          info_path = '/auth/info'
-        if test_endpoint(env_url, health_path):
-          update_dict(helm_envs, env, {'health_path': health_path})
-        if test_endpoint(env_url, info_path):
-          update_dict(helm_envs, env, {'info_path': info_path})
-        # Test for API docs - and if found also test for SAR endpoint.
-        if not data['frontend'] and test_swagger_docs(env_url):
-          update_dict(helm_envs, env, {'swagger_docs': '/swagger-ui.html'})
-          data['api'] = True
-          data['frontend'] = False
-          if test_subject_access_request_endpoint(env_url):
-            update_dict(
-              helm_envs,
-              env,
-              {'include_in_subject_access_requests': True},
-            )
-          else:
-            update_dict(
-              helm_envs,
-              env,
-              {'include_in_subject_access_requests': False},
-            )
-      # Modification to set monitoring to False if no health path is found
-      if not health_path:
-        update_dict(helm_envs, env, {'monitor': False})
-
-      if ip_allow_list_env := ip_allow_list_data.get(f'values-{env}.yaml'):
-        values_filename = f'values-{env}.yaml'
-        allow_list_values = {
-          f'{values_filename}': ip_allow_list_env,
-          'values.yaml': helm_defaults.get('ip_allow_list'),
-        }
-      else:
-        allow_list_values = {
-          f'values-{env}.yaml': {},
-          'values.yaml': helm_defaults.get('ip_allow_list'),
-        }
+    data['api'] = not is_node_app
+    data['frontend'] = is_node_app
+
+    # Modsecurity settings
+    get_mod_security_settings(env_values, helm_envs, env)
+
+    # Generic prometheus alert configs
+    get_generic_prometheus_alerts(
+      am, component_name, env, env_values, helm_defaults, helm_envs
+    )
+
+    # Health paths using the host name:
+    health_path = None
+    info_path = None
+    if env_url := env_values.url:
+      health_path = '/health'
+      info_path = '/info'
+      # Hack for hmpps-auth non standard endpoints
+      if 'sign-in' in env_url:
+        health_path = '/auth/health'
+        info_path = '/auth/info'
+      # The endpoints are checked once all of the environments are known
+      endpoints[env] = (env_url, health_path, info_path)
+    # Modification to set monitoring to False if no health path is found
+    if not health_path:
+      update_dict(helm_envs, env, {'monitor': False})
 
-      # Check within environments for AUDIT_SQS_QUEUE_URL
-      if check_for_key(values, 'AUDIT_SQS_QUEUE_URL'):
-        audit_sqs_defined = True
+    # HEAT-223 IP allowlists from the environment specific values.yaml files
+    allow_list_values = {
+      f'values-{env}.yaml': env_values.ip_allow_list or {},
+      'values.yaml': helm_defaults.ip_allow_list,
+    }
 
+    # Check within environments for AUDIT_SQS_QUEUE_URL
+    if env_values.audit_sqs_defined:
+      audit_sqs_defined = True
+
+    update_dict(
+      helm_envs,
+      env,
+      {
+        'ip_allow_list': allow_list_values,
+        'ip_allow_list_enabled': is_ipallowList_enabled(allow_list_values),
+      },
+    )
+
+  # Check the environments' endpoints at the same time - API docs (and if found,
+  # the SAR endpoint) are only checked for components that aren't frontends
+  probes = endpoint_probe.probe_environments(
+    endpoints, api_docs=not data.get('frontend')
+  )
+  for env, (env_url, health_path, info_path) in endpoints.items():
+    found = probes[env]
+    if found['health']:
+      update_dict(helm_envs, env, {'health_path': health_path})
+    if found['info']:
+      update_dict(helm_envs, env, {'info_path': info_path})
+    if found['swagger']:
+      update_dict(helm_envs, env, {'swagger_docs': '/swagger-ui.html'})
+      data['api'] = True
+      data['frontend'] = False
       update_dict(
         helm_envs,
         env,
-        {
-          'ip_allow_list': allow_list_values,
-          'ip_allow_list_enabled': is_ipallowList_enabled(allow_list_values),
-        },
+        {'include_in_subject_access_requests': found['sar']},
       )
 
   # Need to add the helm data to the main data list of environments
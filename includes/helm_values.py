@@ -0,0 +1,180 @@
+# Effective Helm values
+# Each environment's settings are resolved once from the chart's values.yaml and
+# the environment's values-<env>.yaml into a slotted model, which the extractors
+# in includes/helm.py read from. Environment settings take precedence over the
+# values.yaml settings, which take precedence over the chart defaults below.
+#
+# The models are cached by the blob SHAs of the values files they were resolved
+# from (taken from the helm_deploy listing), so an unchanged pair of files is
+# only resolved once.
+#
+# The keys that can be anywhere in a values file (IP allowlists and the audit SQS
+# queue URL) are found in a single walk of each file (see includes/yaml_visitor.py).
+
+import threading
+from collections import OrderedDict
+
+# local
+from includes.yaml_visitor import Exists, KeyVisitor, Subtree
+
+MAX_CACHED = 1024
+ALLOW_LIST_KEY = 'allowlist'
+AUDIT_SQS_KEY = 'AUDIT_SQS_QUEUE_URL'
+
+VALUES_KEYS = KeyVisitor(
+  ip_allow_list=Subtree(ALLOW_LIST_KEY),
+  audit_sqs_defined=Exists(AUDIT_SQS_KEY),
+)
+
+# generic-service chart defaults, used when neither values file sets them
+MOD_SECURITY_DEFAULTS = {
+  'modsecurity_enabled': False,
+  'modsecurity_audit_enabled': False,
+  'modsecurity_snippet': None,
+}
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def _dict(value):
+  return value if isinstance(value, dict) else {}
+
+
+def ingress_url(ingress):
+  # The ingress host, or the last of the ingress hosts
+  if host := ingress.get('host'):
+    return f'https://{host}'
+  if hosts := ingress.get('hosts'):
+    last_host_record = hosts[-1]
+    host = (
+      last_host_record.get('host', '')
+      if isinstance(last_host_record, dict)
+      else last_host_record
+    )
+    return f'https://{host}'
+  return None
+
+
+class DefaultValues:
+  # Settings from the chart's values.yaml
+  __slots__ = (
+    'container_image',
+    'product_id',
+    'mod_security',
+    'alert_severity_label',
+    'ip_allow_list',
+    'audit_sqs_defined',
+  )
+
+  def __init__(self, values):
+    values = values or {}
+    generic_service = _dict(values.get('generic-service'))
+    # generic-service->image->repository takes precedence over image->repository
+    self.container_image = _dict(generic_service.get('image')).get(
+      'repository'
+    ) or _dict(values.get('image')).get('repository')
+    self.product_id = generic_service.get('productId')
+    ingress = _dict(generic_service.get('ingress'))
+    self.mod_security = {key: ingress.get(key) for key in MOD_SECURITY_DEFAULTS}
+    self.alert_severity_label = _dict(values.get('generic-prometheus-alerts')).get(
+      'alertSeverity'
+    )
+    found = VALUES_KEYS.visit(values)
+    self.ip_allow_list = (found['ip_allow_list'] or {}) if values else None
+    self.audit_sqs_defined = found['audit_sqs_defined']
+
+
+class EnvironmentValues:
+  # The effective settings for an environment
+  __slots__ = (
+    'url',
+    'postgres_database_restore',
+    'container_image',
+    'mod_security',
+    'generic_prometheus_alerts',
+    'alert_severity_label',
+    'ip_allow_list',
+    'audit_sqs_defined',
+  )
+
+  def __init__(self, values, defaults, allow_list=True):
+    generic_service = values.get('generic-service')
+    self.url = None
+    if generic_service is not None:
+      # The ingress is only read from generic-service if it's there
+      self.url = ingress_url(_dict(_dict(generic_service).get('ingress')))
+    elif 'ingress' in values:
+      self.url = ingress_url(_dict(values.get('ingress')))
+    generic_service = _dict(generic_service)
+
+    self.postgres_database_restore = _dict(
+      generic_service.get('postgresDatabaseRestore')
+    ).get('enabled')
+
+    # Only set if the environment has its own image settings
+    self.container_image = None
+    if 'image' in values:
+      self.container_image = _dict(values.get('image')).get('repository') or _dict(
+        generic_service.get('image')
+      ).get('repository')
+
+    # Modsecurity settings are only set for environments with a generic-service
+    # ingress - each setting falls back to values.yaml, then the chart default
+    self.mod_security = None
+    if 'ingress' in generic_service:
+      ingress = _dict(generic_service.get('ingress'))
+      self.mod_security = {
+        key: ingress.get(key) or defaults.mod_security.get(key) or default
+        for key, default in MOD_SECURITY_DEFAULTS.items()
+      }
+
+    self.generic_prometheus_alerts = values.get('generic-prometheus-alerts') or None
+    self.alert_severity_label = _dict(self.generic_prometheus_alerts).get(
+      'alertSeverity'
+    )
+
+    found = VALUES_KEYS.visit(values)
+    # IP allowlists are only read from values-<env>.yaml (not .yml) files
+    self.ip_allow_list = found['ip_allow_list'] if allow_list else None
+    self.audit_sqs_defined = defaults.audit_sqs_defined or found['audit_sqs_defined']
+
+
+def _cached(key, build):
+  if key is None:
+    return build()
+  with _lock:
+    if key in _cache:
+      _cache.move_to_end(key)
+      return _cache[key]
+  result = build()
+  with _lock:
+    _cache[key] = result
+    while len(_cache) > MAX_CACHED:
+      _cache.popitem(last=False)
+  return result
+
+
+def defaults_for(helm_files):
+  shas = helm_files.default_values_shas()
+  return _cached(
+    ('defaults', shas) if shas else None,
+    lambda: DefaultValues(helm_files.default_values()),
+  )
+
+
+def environment_for(helm_files, env, defaults):
+  # None if the environment has no values
+  default_shas = helm_files.default_values_shas()
+  env_sha = helm_files.env_values_sha(env)
+  key = None
+  if default_shas and env_sha:
+    key = ('env', helm_files.env_files.get(env), default_shas, env_sha)
+
+  def build():
+    if not (values := helm_files.env_values(env)):
+      return None
+    allow_list = helm_files.env_files.get(env) == f'values-{env}.yaml'
+    return EnvironmentValues(values, defaults, allow_list)
+
+  return _cached(key, build)
@@ -0,0 +1,177 @@
+# Negative-result cache
+# Remembers files and resources that are known not to exist, so that discovery
+# doesn't pay for the same 404s on every run. Only confirmed 404s are
+# remembered - an empty result because of an error is never cached.
+#
+# Missing files are keyed by repository and the time of the repository's last
+# push, so they are forgotten as soon as anything is pushed to the repository.
+# Other resources that can change without a push (eg. repository variables or
+# workflow artifacts) are forgotten after a TTL.
+#
+# Optional environment variables
+# - NEGATIVE_CACHE_FILE: JSON file used to keep the cache between runs. Without
+#   it the cache only lasts for the current run, where it saves next to nothing
+#   (each file is normally only read once per run). The Helm deployment doesn't
+#   set it, since the cron jobs don't have a persistent volume.
+# - NEGATIVE_CACHE_TTL: seconds to remember missing resources (default 86400)
+
+import atexit
+import json
+import os
+import threading
+import time
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug, log_info, log_warning
+
+# local
+from includes import yaml_loader
+
+DEFAULT_TTL = 86400
+
+_lock = threading.Lock()
+_cache = None
+
+
+def _cache_file():
+  return os.getenv('NEGATIVE_CACHE_FILE')
+
+
+def _load():
+  # Called with the lock held
+  global _cache
+  if _cache is not None:
+    return _cache
+  _cache = {'files': {}, 'resources': {}}
+  if cache_file := _cache_file():
+    try:
+      with open(cache_file) as f:
+        _cache.update(json.load(f))
+      log_info(f'Loaded negative cache from {cache_file}')
+    except FileNotFoundError:
+      log_debug(f'No negative cache found at {cache_file}')
+    except Exception as e:
+      log_warning(f'Unable to load negative cache from {cache_file} - {e}')
+    atexit.register(save)
+  return _cache
+
+
+def save():
+  if not (cache_file := _cache_file()):
+    return
+  with _lock:
+    if _cache is None:
+      return
+    now = time.time()
+    _cache['resources'] = {
+      key: expiry for key, expiry in _cache['resources'].items() if expiry > now
+    }
+    try:
+      with open(f'{cache_file}.tmp', 'w') as f:
+        json.dump(_cache, f)
+      os.replace(f'{cache_file}.tmp', cache_file)
+    except Exception as e:
+      log_warning(f'Unable to save negative cache to {cache_file} - {e}')
+
+
+def _repo_version(repo):
+  pushed_at = getattr(repo, 'pushed_at', None)
+  return pushed_at.isoformat() if pushed_at else None
+
+
+def _repo_key(repo):
+  return getattr(repo, 'full_name', None) or repo.name
+
+
+# Files
+#######
+def is_missing_file(repo, path):
+  if not (version := _repo_version(repo)):
+    return False
+  with _lock:
+    entry = _load()['files'].get(_repo_key(repo))
+    return bool(entry and entry['version'] == version and path in entry['paths'])
+
+
+def record_missing_file(repo, path):
+  if not (version := _repo_version(repo)):
+    return
+  with _lock:
+    files = _load()['files']
+    entry = files.get(_repo_key(repo))
+    if not entry or entry['version'] != version:
+      entry = files[_repo_key(repo)] = {'version': version, 'paths': []}
+    if path not in entry['paths']:
+      entry['paths'].append(path)
+
+
+def _get_file(gh, kind, repo, path):
+  if is_missing_file(repo, path):
+    log_debug(f'{path} is known not to exist in {repo.name} - skipping')
+    return None
+  # The git mirror (or the prefetch cache) can say whether the file exists
+  # without asking Github
+  if file_exists := getattr(gh, 'file_exists', None):
+    if (exists := file_exists(repo, path)) is not None:
+      if not exists:
+        record_missing_file(repo, path)
+        return None
+      return getattr(gh, f'get_file_{kind}')(repo, path)
+  return _read_from_github(repo, path, kind)
+
+
+def _read_from_github(repo, path, kind):
+  # One contents request both reads the file and says whether it's missing. The
+  # library's get_file_* also return None / {} for errors (eg. rate limits or
+  # timeouts), so a file is only recorded as missing after a 404.
+  try:
+    content_file = repo.get_contents(path)
+  except Exception as e:
+    if getattr(e, 'status', None) == 404:
+      record_missing_file(repo, path)
+    else:
+      log_warning(f'Unable to read {path} in {repo.name} - {e}')
+    return None
+  if isinstance(content_file, list):
+    log_warning(f'{path} in {repo.name} is a directory, not a file')
+    return None
+  content = content_file.decoded_content.decode('utf-8', errors='replace')
+  try:
+    if kind == 'yaml':
+      return yaml_loader.safe_load(content)
+    if kind == 'json':
+      return json.loads(content)
+  except (yaml_loader.YAMLError, json.JSONDecodeError) as e:
+    log_warning(f'Unable to parse {path} in {repo.name} - {e}')
+    return None
+  return content
+
+
+def get_file_plain(gh, repo, path):
+  return _get_file(gh, 'plain', repo, path)
+
+
+def get_file_yaml(gh, repo, path):
+  return _get_file(gh, 'yaml', repo, path)
+
+
+def get_file_json(gh, repo, path):
+  return _get_file(gh, 'json', repo, path)
+
+
+# Other resources
+#################
+def _resource_key(repo, kind, name):
+  return f'{_repo_key(repo)}:{kind}:{name}'
+
+
+def is_missing(repo, kind, name):
+  with _lock:
+    expiry = _load()['resources'].get(_resource_key(repo, kind, name))
+  return bool(expiry and expiry > time.time())
+
+
+def record_missing(repo, kind, name):
+  ttl = int(os.getenv('NEGATIVE_CACHE_TTL', DEFAULT_TTL))
+  with _lock:
+    _load()['resources'][_resource_key(repo, kind, name)] = time.time() + ttl
@@ -0,0 +1,362 @@
+# Speculative prefetch
+# Runs ahead of the batch dispatcher and warms the repository metadata, file
+# listings and likely-needed file contents for the next few components in the
+# queue, so that worker threads don't wait on the network while they process.
+#
+# The prefetcher stops while the Github rate limit is below PREFETCH_MIN_RATE_LIMIT,
+# and the prefetched data is held in a size-limited cache (least recently used
+# entries are dropped first). The look-ahead depth adapts to how long
+# prefetching takes compared to the rate at which components are dispatched,
+# and is reduced if prefetched data isn't being used.
+#
+# Optional environment variables
+# - PREFETCH_DEPTH: maximum number of components to look ahead (default 0 - disabled)
+# - PREFETCH_THREADS: number of prefetch threads (default 2)
+# - PREFETCH_MAX_BYTES: maximum size of the prefetch cache (default 64MB)
+# - PREFETCH_MIN_RATE_LIMIT: Github API calls to leave for the workers (default 1500)
+
+import json
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict, deque
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug, log_info, log_warning
+
+# local
+from includes import yaml_loader
+from includes.utils import get_dir_contents
+
+# Approximate size of a Repository object - used for the cache size limit
+REPO_OBJECT_SIZE = 8192
+
+# Files in the root of a repository that discovery is likely to read
+LIKELY_ROOT_FILES = {
+  '.snyk',
+  '.npmrc',
+  'package.json',
+  'applicationinsights.json',
+  'build.gradle',
+  'build.gradle.kts',
+  'settings.gradle',
+  'settings.gradle.kts',
+  'Dockerfile',
+  'uv.lock',
+}
+
+
+def _key(kind, repo_name, path):
+  # './helm_deploy/values.yaml' and 'helm_deploy/values.yaml' are the same file
+  return (kind, repo_name, posixpath.normpath(path).lstrip('/'))
+
+
+class _SizeLimitedCache:
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.size = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      if key not in self._entries:
+        return None
+      self._entries.move_to_end(key)
+      return self._entries[key][0]
+
+  def __contains__(self, key):
+    with self._lock:
+      return key in self._entries
+
+  def put(self, key, value, size):
+    with self._lock:
+      if key in self._entries:
+        self.size -= self._entries.pop(key)[1]
+      self._entries[key] = (value, size)
+      self.size += size
+      while self.size > self.max_bytes and self._entries:
+        _, (_, evicted_size) = self._entries.popitem(last=False)
+        self.size -= evicted_size
+
+
+class PrefetchSession:
+  # Wraps a Github session (or git mirror session), serving repository objects,
+  # directory listings and file contents from the prefetch cache when they are
+  # there. Anything else is passed straight through.
+  def __init__(self, gh, max_bytes):
+    self._gh = gh
+    self.cache = _SizeLimitedCache(max_bytes)
+    self.hits = 0
+    self.misses = 0
+    self._warmed = set()
+    self._stats_lock = threading.Lock()
+
+  def __getattr__(self, name):
+    return getattr(self._gh, name)
+
+  def _count(self, repo_name, hit):
+    # Only reads from repositories that have been prefetched count towards the
+    # hit rate - a miss there means prefetching was too late or incomplete
+    with self._stats_lock:
+      if hit:
+        self.hits += 1
+      elif repo_name in self._warmed:
+        self.misses += 1
+
+  def hit_rate(self):
+    with self._stats_lock:
+      total = self.hits + self.misses
+      return self.hits / total if total else None
+
+  # Consumer side
+  def get_org_repo(self, repo_name):
+    if repo := self.cache.get(('repo', repo_name)):
+      self._count(repo_name, True)
+      return repo
+    self._count(repo_name, False)
+    return self._gh.get_org_repo(repo_name)
+
+  def _cached_file(self, repo, path):
+    key = _key('file', repo.name, path)
+    if key in self.cache:
+      self._count(repo.name, True)
+      return True, self.cache.get(key)
+    self._count(repo.name, False)
+    return False, None
+
+  def file_exists(self, repo, path):
+    # Only prefetched files are known to exist here - otherwise it's up to the
+    # git mirror (if there is one), or None if it can't say
+    if _key('file', repo.name, path) in self.cache:
+      return True
+    if mirror_file_exists := getattr(self._gh, 'file_exists', None):
+      return mirror_file_exists(repo, path)
+    return None
+
+  def get_file_plain(self, repo, path):
+    found, content = self._cached_file(repo, path)
+    return content if found else self._gh.get_file_plain(repo, path)
+
+  def get_file_yaml(self, repo, path):
+    found, content = self._cached_file(repo, path)
+    if not found:
+      return self._gh.get_file_yaml(repo, path)
+    try:
+      return yaml_loader.safe_load(content) if content is not None else None
+    except yaml_loader.YAMLError as e:
+      log_warning(f'Unable to parse {path} in {repo.name} - {e}')
+      return None
+
+  def get_file_json(self, repo, path):
+    found, content = self._cached_file(repo, path)
+    if not found:
+      return self._gh.get_file_json(repo, path)
+    try:
+      return json.loads(content) if content is not None else None
+    except json.JSONDecodeError as e:
+      log_warning(f'Unable to parse {path} in {repo.name} - {e}')
+      return None
+
+  def get_dir_contents(self, repo, path):
+    if (contents := self.cache.get(_key('dir', repo.name, path))) is not None:
+      self._count(repo.name, True)
+      return list(contents)
+    self._count(repo.name, False)
+    if get_mirror_contents := getattr(self._gh, 'get_dir_contents', None):
+      return get_mirror_contents(repo, path)
+    return None
+
+  # Prefetch side
+  def warm_repo(self, repo_name):
+    if repo := self.cache.get(('repo', repo_name)):
+      return repo
+    repo = self._gh.get_org_repo(repo_name)
+    if repo:
+      self.cache.put(('repo', repo_name), repo, REPO_OBJECT_SIZE)
+      with self._stats_lock:
+        self._warmed.add(repo_name)
+    return repo
+
+  def warm_dir(self, repo, path):
+    if (contents := self.cache.get(_key('dir', repo.name, path))) is not None:
+      return contents
+    try:
+      contents = list(get_dir_contents(self._gh, repo, path))
+    except Exception as e:
+      log_debug(f'Prefetch: unable to list {path} in {repo.name} - {e}')
+      return []
+    size = sum(len(getattr(item, 'path', '')) + 256 for item in contents)
+    self.cache.put(_key('dir', repo.name, path), contents, size)
+    return contents
+
+  def warm_file(self, repo, path):
+    # Failed reads (and files that turn out to be missing) aren't cached, so
+    # the worker reads them itself
+    key = _key('file', repo.name, path)
+    if key not in self.cache:
+      try:
+        content = self._gh.get_file_plain(repo, path)
+      except Exception as e:
+        log_debug(f'Prefetch: unable to read {path} in {repo.name} - {e}')
+        return
+      if content is not None:
+        self.cache.put(key, content, len(content) + 128)
+
+
+class Prefetcher:
+  def __init__(self, session, max_depth, threads, min_rate_limit, prefetch_files):
+    self.session = session
+    self.max_depth = max_depth
+    self.depth = max_depth
+    self.min_rate_limit = min_rate_limit
+    self.prefetch_files = prefetch_files
+    self._upcoming = deque()
+    self._claimed = set()  # documentIds (or names) of the claimed components
+    self._cond = threading.Condition()
+    self._stopped = False
+    self._rate_limit_remaining = None
+    self._last_dispatch = None
+    self._dispatch_interval = None  # moving averages, in seconds
+    self._prefetch_time = None
+    self.thread_count = threads
+    self._threads = [
+      threading.Thread(target=self._run, daemon=True) for _ in range(threads)
+    ]
+    for t in self._threads:
+      t.start()
+
+  @staticmethod
+  def _average(current, sample, weight=0.2):
+    return sample if current is None else current + weight * (sample - current)
+
+  def extend(self, components):
+    with self._cond:
+      self._upcoming.extend(components)
+      self._cond.notify_all()
+
+  def dispatched(self, component, rate_limit_remaining=None):
+    # Called by the dispatcher as each component is handed to a worker
+    with self._cond:
+      if any(upcoming is component for upcoming in self._upcoming):
+        while self._upcoming.popleft() is not component:
+          pass
+      now = time.monotonic()
+      if self._last_dispatch is not None:
+        self._dispatch_interval = self._average(
+          self._dispatch_interval, now - self._last_dispatch
+        )
+      self._last_dispatch = now
+      if rate_limit_remaining is not None:
+        self._rate_limit_remaining = rate_limit_remaining
+      self._adapt_depth()
+      self._cond.notify_all()
+
+  def _adapt_depth(self):
+    # Look far enough ahead to cover the time it takes to prefetch a component...
+    depth = self.max_depth
+    if self._prefetch_time and self._dispatch_interval:
+      depth = int(self._prefetch_time / max(self._dispatch_interval, 0.01)) + 1
+    # ...but not so far that prefetched data isn't being used
+    hit_rate = self.session.hit_rate()
+    if hit_rate is not None and self.session.hits + self.session.misses > 50:
+      if hit_rate < 0.5:
+        depth = depth // 2
+    self.depth = max(1, min(depth, self.max_depth))
+
+  def _rate_limited(self):
+    return (
+      self._rate_limit_remaining is not None
+      and self._rate_limit_remaining < self.min_rate_limit
+    )
+
+  @staticmethod
+  def _claim_key(component):
+    # Streamed records are released once processed, so their ids can be reused
+    return component.get('documentId') or component.get('name')
+
+  def _next_component(self):
+    # Called with the condition held
+    for component in list(self._upcoming)[: self.depth]:
+      if self._claim_key(component) not in self._claimed:
+        return component
+    return None
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while not self._stopped:
+          if not self._rate_limited() and (component := self._next_component()):
+            break
+          self._cond.wait(timeout=5)
+        if self._stopped:
+          return
+        self._claimed.add(self._claim_key(component))
+
+      started = time.monotonic()
+      try:
+        self._prefetch(component)
+      except Exception as e:
+        log_debug(f'Prefetch failed for {component.get("name")} - {e}')
+      with self._cond:
+        self._prefetch_time = self._average(
+          self._prefetch_time, time.monotonic() - started
+        )
+
+  def _prefetch(self, component):
+    if component.get('archived') or not component.get('github_repo'):
+      return
+    log_debug(f'Prefetching {component.get("name")} (depth {self.depth})')
+    repo = self.session.warm_repo(component.get('github_repo'))
+    if not repo or not self.prefetch_files or repo.archived:
+      return
+
+    project_dir = (
+      (component.get('path_to_project') or component.get('name'))
+      if component.get('part_of_monorepo')
+      else '.'
+    )
+    helm_dir = component.get('path_to_helm_dir') or f'{project_dir}/helm_deploy'
+
+    # Only fetch files that are known to exist from the directory listings
+    for item in self.session.warm_dir(repo, helm_dir):
+      if item.type == 'file' and item.name.endswith(('.yaml', '.yml')):
+        self.session.warm_file(repo, f'{helm_dir}/{item.name}')
+    for directory in {'.', project_dir}:
+      for item in self.session.warm_dir(repo, directory):
+        if item.type == 'file' and item.name in LIKELY_ROOT_FILES:
+          self.session.warm_file(repo, f'{directory}/{item.name}')
+
+  def stop(self):
+    with self._cond:
+      self._stopped = True
+      self._cond.notify_all()
+    log_info(
+      f'Prefetch finished - cache hit rate {self.session.hit_rate() or 0:.0%}, '
+      f'{self.session.cache.size} bytes cached'
+    )
+
+
+def wrap_session(gh):
+  # Returns a prefetching session if PREFETCH_DEPTH is set,
+  # otherwise the Github session unchanged
+  if int(os.getenv('PREFETCH_DEPTH', '0')) > 0:
+    return PrefetchSession(gh, int(os.getenv('PREFETCH_MAX_BYTES', 64 * 1024 * 1024)))
+  return gh
+
+
+def start(services, components, prefetch_files=False):
+  # Starts a prefetcher for the components if the Github session supports it
+  if not isinstance(services.gh, PrefetchSession):
+    return None
+  prefetcher = Prefetcher(
+    services.gh,
+    max_depth=int(os.getenv('PREFETCH_DEPTH', '0')),
+    threads=int(os.getenv('PREFETCH_THREADS', '2')),
+    min_rate_limit=int(os.getenv('PREFETCH_MIN_RATE_LIMIT', '1500')),
+    prefetch_files=prefetch_files,
+  )
+  prefetcher.extend(components)
+  log_info(f'Started prefetching (up to {prefetcher.max_depth} components ahead)')
+  return prefetcher
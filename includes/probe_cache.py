@@ -0,0 +1,103 @@
+# Endpoint probe cache
+# Remembers the results of the environment endpoint checks (see
+# includes/endpoint_probe.py) between runs, keyed by the check and URL. Found
+# endpoints and missing endpoints have their own TTLs, since an endpoint that
+# was missing is more likely to appear than one that was found is to go away.
+# Endpoints that couldn't be reached (eg. connection errors or timeouts) aren't
+# remembered.
+#
+# Full (-f) runs can be made to check every endpoint again, refreshing the cache.
+#
+# Optional environment variables
+# - PROBE_CACHE_FILE: JSON file used to keep the results between runs
+#   (nothing is kept between runs if this isn't set)
+# - PROBE_CACHE_TTL: seconds to remember found endpoints (default 86400)
+# - PROBE_CACHE_NEGATIVE_TTL: seconds to remember missing endpoints (default 3600)
+# - PROBE_CACHE_FULL_REFRESH: set to true to check every endpoint on full runs
+
+import atexit
+import json
+import os
+import threading
+import time
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug, log_info, log_warning
+
+DEFAULT_TTL = 86400
+DEFAULT_NEGATIVE_TTL = 3600
+
+_lock = threading.Lock()
+_cache = None
+_refresh = False
+
+
+def _cache_file():
+  return os.getenv('PROBE_CACHE_FILE')
+
+
+def _load():
+  # Called with the lock held
+  global _cache
+  if _cache is not None:
+    return _cache
+  _cache = {}
+  if cache_file := _cache_file():
+    try:
+      with open(cache_file) as f:
+        _cache.update(json.load(f))
+      log_info(f'Loaded {len(_cache)} endpoint probe results from {cache_file}')
+    except FileNotFoundError:
+      log_debug(f'No endpoint probe cache found at {cache_file}')
+    except Exception as e:
+      log_warning(f'Unable to load endpoint probe cache from {cache_file} - {e}')
+    atexit.register(save)
+  return _cache
+
+
+def save():
+  if not (cache_file := _cache_file()):
+    return
+  with _lock:
+    if _cache is None:
+      return
+    now = time.time()
+    results = {key: entry for key, entry in _cache.items() if entry['expiry'] > now}
+    try:
+      with open(f'{cache_file}.tmp', 'w') as f:
+        json.dump(results, f)
+      os.replace(f'{cache_file}.tmp', cache_file)
+    except Exception as e:
+      log_warning(f'Unable to save endpoint probe cache to {cache_file} - {e}')
+
+
+def refresh_on_full_run(force_update):
+  # Full runs ignore the cached results (but still record new ones) if enabled
+  global _refresh
+  if force_update and os.getenv('PROBE_CACHE_FULL_REFRESH', '').lower() in (
+    '1',
+    'true',
+    'yes',
+  ):
+    log_info('Full run - all endpoints will be probed again')
+    _refresh = True
+
+
+def get(check, url):
+  # Returns the cached result, or None if there isn't one
+  if _refresh:
+    return None
+  with _lock:
+    entry = _load().get(f'{check}:{url}')
+  if entry and entry['expiry'] > time.time():
+    return entry['found']
+  return None
+
+
+def put(check, url, found):
+  if found:
+    ttl = int(os.getenv('PROBE_CACHE_TTL', DEFAULT_TTL))
+  else:
+    ttl = int(os.getenv('PROBE_CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL))
+  with _lock:
+    _load()[f'{check}:{url}'] = {'found': found, 'expiry': time.time() + ttl}
@@ -0,0 +1,146 @@
+# Delta-only Service Catalogue updates
+# Discovery rebuilds the whole set of component fields on every run, but most
+# of them haven't changed since the last run. The new data is compared with the
+# record that was fetched from the Service Catalogue, and only the fields that
+# have actually changed are sent - or nothing at all.
+#
+# The comparison allows for the differences between what discovery sends and
+# what Strapi returns:
+# - relations are sent as an id or documentId, but returned as an object
+# - components (eg. latest_commit) are returned with an extra 'id'
+# - date/times may be returned in a different (but equivalent) ISO format
+#
+# Environments are compared in the same way, with the records from the
+# environment lookup index (see includes/sc_lookups.py).
+
+import copy
+import json
+import re
+import threading
+from datetime import datetime, timezone
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug
+
+ISO_DATETIME = re.compile(
+  r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?$'
+)
+
+
+class WriteStats:
+  def __init__(self, kind='component'):
+    self.kind = kind
+    self.updates = 0
+    self.skipped = 0
+    self.bytes_saved = 0
+    self._lock = threading.Lock()
+
+  def record(self, sent, full_size, sent_size):
+    with self._lock:
+      if sent:
+        self.updates += 1
+      else:
+        self.skipped += 1
+      self.bytes_saved += full_size - sent_size
+
+  def summary(self):
+    with self._lock:
+      return (
+        f'{self.skipped} unchanged {self.kind} update(s) skipped, '
+        f'{self.updates} sent with changed fields only '
+        f'({self.bytes_saved / 1024:.1f}KB saved)\n'
+      )
+
+
+stats = WriteStats()
+environment_stats = WriteStats('environment')
+
+
+def snapshot(record):
+  # Discovery updates some of the record's JSON fields in place, so the diff
+  # needs a copy of the record as it was fetched
+  return copy.deepcopy(record)
+
+
+def _datetime(value):
+  if isinstance(value, str) and ISO_DATETIME.match(value):
+    try:
+      parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+      return None
+    if parsed.tzinfo is None:
+      parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+  return None
+
+
+def _is_relation(value):
+  return isinstance(value, dict) and 'documentId' in value
+
+
+def _relation_ids(value):
+  return {value.get('documentId'), value.get('id')} - {None}
+
+
+def _equal(new, current):
+  # Relation sent as an id or documentId
+  if _is_relation(current) and not isinstance(new, dict):
+    return new in _relation_ids(current)
+  if _is_relation(new) and _is_relation(current):
+    return new['documentId'] == current['documentId']
+
+  if isinstance(new, dict) and isinstance(current, dict):
+    keys = set(new) | set(current)
+    # Strapi adds an id to components - it's not part of the data
+    if 'id' not in new:
+      keys.discard('id')
+    return all(
+      key in new and key in current and _equal(new[key], current[key]) for key in keys
+    )
+
+  if isinstance(new, list) and isinstance(current, list):
+    if len(new) != len(current):
+      return False
+    if current and all(_is_relation(item) for item in current):
+      # Relations are unordered
+      remaining = list(current)
+      for item in new:
+        match = next((rel for rel in remaining if _equal(item, rel)), None)
+        if match is None:
+          return False
+        remaining.remove(match)
+      return True
+    return all(_equal(n, c) for n, c in zip(new, current))
+
+  if (new_dt := _datetime(new)) and (current_dt := _datetime(current)):
+    return new_dt == current_dt
+
+  return new == current
+
+
+def changed_fields(current, data):
+  # Fields that aren't in the fetched record (eg. relations that weren't
+  # populated) can't be compared, so they are always sent
+  return {
+    field: value
+    for field, value in data.items()
+    if field not in current or not _equal(value, current[field])
+  }
+
+
+def _size(data):
+  return len(json.dumps(data, default=str))
+
+
+def update(sc, table, record, data, name=None, write_stats=None):
+  # Sends only the changed fields of data to the record's table, and returns
+  # True if the update was successful or there was nothing to update
+  changes = changed_fields(record, data)
+  name = name or record.get('name') or record.get('documentId')
+  write_stats = write_stats or stats
+  write_stats.record(bool(changes), _size(data), _size(changes) if changes else 0)
+  if not changes:
+    log_debug(f'No changes for {name} - skipping update')
+    return True
+  log_debug(f'Updating {name} - changed fields: {", ".join(changes)}')
+  return sc.update(table, record['documentId'], changes)
@@ -0,0 +1,134 @@
+# Service Catalogue GraphQL read path
+# Fetches a page of components together with their environments, product and
+# namespace references in a single GraphQL request, selecting only the fields
+# in the processor's projection (see includes/sc_query.py). The records are
+# returned in the same shape as the REST API, so the environment processing
+# can work from the pre-joined environments.
+#
+# Strapi's GraphQL API doesn't return numeric ids, only documentIds.
+#
+# Optional environment variables
+# - SC_GRAPHQL: set to true to read components through GraphQL
+# - SC_GRAPHQL_URL: GraphQL endpoint (default <Service Catalogue URL>/graphql)
+
+import os
+import re
+from urllib.parse import parse_qsl
+
+import requests
+
+# hmpps
+from hmpps.services.job_log_handling import log_info
+
+# local
+from includes import sc_pages
+from includes.sc_query import Projection
+
+# Strapi components (as opposed to relations) - these don't have a documentId
+STRAPI_COMPONENTS = {'latest_commit'}
+
+
+def enabled():
+  return os.getenv('SC_GRAPHQL', '').lower() in ('1', 'true', 'yes')
+
+
+def _url(sc):
+  return os.getenv('SC_GRAPHQL_URL') or f'{sc.url.rstrip("/")}/graphql'
+
+
+def selection(projection):
+  # The GraphQL selection set for a projection
+  fields = ['documentId', *projection.fields]
+  for name, nested in projection.populate.items():
+    if isinstance(nested, Projection):
+      fields.append(f'{name} {selection(nested)}')
+    else:
+      nested_fields = list(nested or ('name',))
+      if name not in STRAPI_COMPONENTS:
+        nested_fields.insert(0, 'documentId')
+      fields.append(f'{name} {{ {" ".join(nested_fields)} }}')
+  return f'{{ {" ".join(fields)} }}'
+
+
+def _filter_value(operator, value):
+  if operator in ('null', 'notNull') or value in ('true', 'false'):
+    return value == 'true'
+  return value
+
+
+def filters(query_string):
+  # Converts REST filters (eg. &filters[name][$contains]=x) to GraphQL filters
+  result = {}
+  for key, value in parse_qsl(query_string.lstrip('&?'), keep_blank_values=True):
+    parts = re.findall(r'[^\[\]]+', key)
+    if not parts or parts[0] != 'filters':
+      continue
+    parts = [part.lstrip('$') for part in parts[1:]]
+    node = result
+    for part in parts[:-1]:
+      node = node.setdefault(part, {})
+    node[parts[-1]] = _filter_value(parts[-1], value)
+  return _lists(result)
+
+
+def _lists(node):
+  # $and / $or / $in conditions are given with numeric indices
+  if isinstance(node, dict):
+    if node and all(key.isdigit() for key in node):
+      return [_lists(node[key]) for key in sorted(node, key=int)]
+    return {key: _lists(value) for key, value in node.items()}
+  return node
+
+
+def _query_name(table):
+  return f'{table.replace("-", "_")}_connection'
+
+
+def _filters_type(table):
+  # Filter types are per table in Strapi, eg. components -> ComponentFiltersInput
+  singular = table[:-1] if table.endswith('s') else table
+  return ''.join(part.capitalize() for part in singular.split('-')) + 'FiltersInput'
+
+
+def get_page(sc, projection, page, page_size, extra_filters=''):
+  name = _query_name(projection.table)
+  query = (
+    f'query Page($filters: {_filters_type(projection.table)}, $page: Int, '
+    '$pageSize: Int) { '
+    f'{name}(filters: $filters, sort: ["documentId:asc"], '
+    'pagination: { page: $page, pageSize: $pageSize }) '
+    f'{{ nodes {selection(projection)} pageInfo {{ total pageCount }} }} }}'
+  )
+  variables = {
+    'filters': filters(
+      f'{projection.filters}{getattr(sc, "filter", "") or ""}{extra_filters}'
+    ),
+    'page': page,
+    'pageSize': page_size,
+  }
+  r = requests.post(
+    _url(sc),
+    headers=sc.api_headers,
+    json={'query': query, 'variables': variables},
+    timeout=30,
+  )
+  r.raise_for_status()
+  body = r.json()
+  if body.get('errors'):
+    raise RuntimeError(body['errors'][0].get('message'))
+  connection = body['data'][name]
+  return connection['nodes'], connection['pageInfo']
+
+
+def stream_records(sc, projection, rest_query, on_page=None, extra_filters=''):
+  # Streams records through GraphQL - if the first page can't be read, the
+  # REST query is used instead. Extra filters are given as REST parameters.
+  log_info(f'Reading {projection.table} through GraphQL')
+  return sc_pages.RecordStream(
+    sc,
+    rest_query,
+    on_page=on_page,
+    fetch_page=lambda page, page_size: get_page(
+      sc, projection, page, page_size, extra_filters
+    ),
+  )
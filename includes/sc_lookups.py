@@ -0,0 +1,195 @@
+# Service Catalogue lookups
+# Concurrent identical lookups from worker threads (eg. the same product ID for
+# all the components of a product) share a single call to the Service Catalogue.
+#
+# Lookups of namespaces, products, components and environments are answered
+# from a run-scoped index instead. Each table is loaded in one go (just the
+# fields needed for the lookup) the first time it's used, and the index is
+# kept up to date as discovery adds and deletes records. Anything that isn't
+# in the index is looked up in the Service Catalogue, and the result is kept.
+#
+# Environments are indexed by component name and environment name, with all of
+# their fields, so that environment updates can be compared with them and only
+# sent if something has changed.
+#
+# Optional environment variables
+# - SC_LOOKUP_INDEX: set to false to look up every record in the Service Catalogue
+
+import os
+import threading
+
+# hmpps
+from hmpps.services.job_log_handling import log_info, log_warning
+
+# local
+from includes import sc_pages
+from includes.sc_query import Projection
+from includes.singleflight import SingleFlight
+
+_lookups = SingleFlight()
+_index_lock = threading.Lock()
+
+
+def _coalesced_get_id(sc, table, label, parameter):
+  return _lookups.do(
+    ('get_id', table, label, parameter), sc.get_id, table, label, parameter
+  )
+
+
+def _coalesced_get_record(sc, table, label, parameter):
+  return _lookups.do(
+    ('get_record', table, label, parameter), sc.get_record, table, label, parameter
+  )
+
+
+# Indexed tables - the label that's looked up, and the query used to load them
+INDEXED_TABLES = {
+  'namespaces': ('name', Projection('namespaces', fields=('name',))),
+  'products': ('p_id', Projection('products', fields=('p_id', 'name'))),
+  'components': ('name', Projection('components', fields=('name',))),
+  'environments': (
+    'name',
+    # All fields, for comparing with (see includes/sc_diff.py)
+    Projection('environments', populate={'component': ('name',), 'ns': ('name',)}),
+  ),
+}
+
+
+def _index_key(table, record):
+  label = INDEXED_TABLES[table][0]
+  if table == 'environments':
+    return ((record.get('component') or {}).get('name'), record.get(label))
+  return record.get(label)
+
+
+class CatalogueIndex:
+  def __init__(self, sc):
+    self.sc = sc
+    self._tables = {}
+    self._lock = threading.Lock()
+    self._loads = SingleFlight()
+
+  def _load(self, table):
+    _, projection = INDEXED_TABLES[table]
+    try:
+      records = sc_pages.get_all_records(self.sc, projection.query())
+    except Exception as e:
+      log_warning(f'Unable to load the {table} lookup index - {e}')
+      records = []
+    index = {}
+    for record in records or []:
+      index.setdefault(_index_key(table, record), record)
+    log_info(f'Loaded {len(index)} {table} into the lookup index')
+    return index
+
+  def _table(self, table):
+    if (index := self._tables.get(table)) is None:
+      index = self._loads.do(table, self._load, table)
+      with self._lock:
+        index = self._tables.setdefault(table, index)
+    return index
+
+  def lookup(self, table, key, fetch):
+    # Returns the indexed record, or fetches (and keeps) it if it isn't indexed.
+    # Records that don't exist are kept as None.
+    index = self._table(table)
+    with self._lock:
+      if key in index:
+        return index[key]
+    record = fetch()
+    with self._lock:
+      return index.setdefault(key, record or None)
+
+  def put(self, table, key, record):
+    index = self._table(table)
+    with self._lock:
+      index[key] = record
+
+  def forget(self, table, key):
+    with self._lock:
+      if (index := self._tables.get(table)) is not None:
+        index.pop(key, None)
+
+
+def indexed(sc):
+  return _index(sc) is not None
+
+
+def _index(sc):
+  if os.getenv('SC_LOOKUP_INDEX', 'true').lower() in ('false', '0', 'no'):
+    return None
+  if (index := getattr(sc, '_catalogue_index', None)) is None:
+    with _index_lock:
+      if (index := getattr(sc, '_catalogue_index', None)) is None:
+        index = CatalogueIndex(sc)
+        sc._catalogue_index = index
+  return index
+
+
+# Lookups
+#########
+def get_id(sc, table, label, parameter):
+  index = _index(sc)
+  if index is None or INDEXED_TABLES.get(table, (None,))[0] != label:
+    return _coalesced_get_id(sc, table, label, parameter)
+
+  def fetch():
+    if record_id := _coalesced_get_id(sc, table, label, parameter):
+      return {'id': record_id, label: parameter}
+    return None
+
+  record = index.lookup(table, parameter, fetch)
+  return record.get('id') if record else None
+
+
+def get_record(sc, table, label, parameter):
+  return _coalesced_get_record(sc, table, label, parameter)
+
+
+def get_environment(sc, component_name, env_name):
+  # Returns the environment record (or {}) for a component's environment
+  def fetch():
+    return _coalesced_get_record(
+      sc,
+      sc.environments_get,
+      f'name][$eq]={env_name}&filters[component][name',
+      component_name,
+    )
+
+  if (index := _index(sc)) is None:
+    return fetch() or {}
+  return index.lookup('environments', (component_name, env_name), fetch) or {}
+
+
+# Keeping the index up to date
+##############################
+def record_added(sc, table, key, result):
+  # result is what the Service Catalogue returned for the add
+  if (index := _index(sc)) is None or table not in INDEXED_TABLES:
+    return
+  record = result.get('data') if isinstance(result, dict) else None
+  if isinstance(record, dict) and record.get('documentId'):
+    index.put(table, key, record)
+  else:
+    # It will be looked up if it's needed
+    index.forget(table, key)
+
+
+def record_updated(sc, table, key, record, changes):
+  # record is the indexed record that changes were sent for. Relations are sent
+  # as ids but indexed as populated objects, so if a relation (or a field that
+  # wasn't indexed) has changed, the record is forgotten instead - it'll be
+  # looked up again if it's needed.
+  if (index := _index(sc)) is None or table not in INDEXED_TABLES:
+    return
+  if all(
+    field in record and not isinstance(record[field], dict) for field in changes
+  ):
+    index.put(table, key, {**record, **changes})
+  else:
+    index.forget(table, key)
+
+
+def record_deleted(sc, table, key):
+  if (index := _index(sc)) is not None and table in INDEXED_TABLES:
+    index.put(table, key, None)
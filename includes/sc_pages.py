@@ -0,0 +1,171 @@
+# Streaming Service Catalogue results
+# Reads the pages of a Service Catalogue query in the background and yields the
+# records as each page arrives, so that processing can start on the first page
+# rather than waiting for every page. Only a couple of pages are read ahead, so
+# records that have been processed can be released.
+#
+# The total number of records is taken from the pagination metadata of the
+# first page. Pages are read in id order, so that records updated while the
+# pages are being read don't move between pages (and get skipped or read twice).
+# If a page after the first can't be read, iterating the stream raises the error
+# rather than ending early.
+#
+# get_all_records reads a whole query at once - the first page gives the number
+# of pages, and the rest are read concurrently and put back in order.
+#
+# Optional environment variables
+# - SC_PAGE_SIZE: number of records per page (default 100)
+# - SC_PAGE_THREADS: pages read at the same time by get_all_records (default 4)
+
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug, log_error, log_warning
+
+PAGE_ATTEMPTS = 3
+READ_AHEAD_PAGES = 2
+PAGINATION_PARAM = re.compile(r'[?&]pagination\[[a-zA-Z]+\]=[^&]*')
+SORT_PARAM = re.compile(r'[?&]sort(\[\d*\])?=')
+STABLE_SORT = 'sort[0]=id:asc'
+
+_END = object()
+
+
+def page_url(sc, query, page, page_size):
+  # Any pagination in the query is replaced
+  query = PAGINATION_PARAM.sub('', query)
+  if '?' not in query and '&' in query:
+    query = query.replace('&', '?', 1)
+  separator = '&' if '?' in query else '?'
+  # Offset pagination needs a stable order
+  sort = '' if SORT_PARAM.search(query) else f'{STABLE_SORT}&'
+  return (
+    f'{sc.url}/v1/{query}{separator}{sort}'
+    f'pagination[page]={page}&pagination[pageSize]={page_size}'
+  )
+
+
+def get_page(sc, query, page, page_size):
+  # Returns the records and pagination metadata for a page
+  url = page_url(sc, query, page, page_size)
+  for attempt in range(1, PAGE_ATTEMPTS + 1):
+    try:
+      r = requests.get(url, headers=sc.api_headers, timeout=30)
+      r.raise_for_status()
+      body = r.json()
+      return body.get('data') or [], body.get('meta', {}).get('pagination', {})
+    except Exception as e:
+      if attempt == PAGE_ATTEMPTS:
+        raise
+      log_debug(f'Retrying page {page} of {query} ({attempt}) - {e}')
+      time.sleep(attempt)
+
+
+class RecordStream:
+  def __init__(self, sc, query, on_page=None, page_size=None, fetch_page=None):
+    self.sc = sc
+    self.query = query
+    self.on_page = on_page
+    # Returns (records, pagination) for a page - the REST API by default
+    self.fetch_page = fetch_page or (
+      lambda page, page_size: get_page(sc, query, page, page_size)
+    )
+    self.page_size = page_size or int(os.getenv('SC_PAGE_SIZE', '100'))
+    self._pages = queue.Queue(maxsize=READ_AHEAD_PAGES)
+    self._first_page = threading.Event()
+    self._total = None
+    self._error = None
+    self._reader = None
+    self._started = threading.Lock()
+
+  def _start(self):
+    with self._started:
+      if self._reader is None:
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+  def _put(self, records):
+    if self.on_page and records:
+      self.on_page(records)
+    self._pages.put(records)
+
+  def _read(self):
+    page = 1
+    try:
+      while True:
+        try:
+          records, pagination = self.fetch_page(page, self.page_size)
+        except Exception as e:
+          if page > 1:
+            # The records so far are only part of the query
+            log_error(f'Unable to read page {page} of {self.query} - {e}')
+            self._error = e
+            break
+          # Fall back to reading every page in one go
+          log_warning(f'Unable to stream {self.query} - {e}')
+          records = self.sc.get_all_records(self.query)
+          pagination = {'total': len(records), 'pageCount': 1}
+        if page == 1:
+          self._total = pagination.get('total', len(records))
+          self._first_page.set()
+        self._put(records)
+        if page >= pagination.get('pageCount', page):
+          break
+        page += 1
+    finally:
+      self._first_page.set()
+      self._pages.put(_END)
+
+  @property
+  def total(self):
+    # Waits for the first page
+    self._start()
+    self._first_page.wait()
+    return self._total or 0
+
+  def __len__(self):
+    return self.total
+
+  def __iter__(self):
+    self._start()
+    while (records := self._pages.get()) is not _END:
+      yield from records
+    if self._error is not None:
+      raise RuntimeError(
+        f'Unable to read all of {self.query} - {self._error}'
+      ) from self._error
+
+
+def stream_records(sc, query, on_page=None):
+  return RecordStream(sc, query, on_page=on_page)
+
+
+def get_all_records(sc, query, threads=None):
+  # Drop-in replacement for sc.get_all_records - if a page can't be read, the
+  # whole query is read by the library instead
+  page_size = int(os.getenv('SC_PAGE_SIZE', '100'))
+  threads = threads or int(os.getenv('SC_PAGE_THREADS', '4'))
+  try:
+    records, pagination = get_page(sc, query, 1, page_size)
+    page_count = pagination.get('pageCount', 1)
+    if page_count > 1:
+      with ThreadPoolExecutor(
+        max_workers=min(threads, page_count - 1), thread_name_prefix='sc-page'
+      ) as executor:
+        # map returns the pages in order
+        for page_records, _ in executor.map(
+          lambda page: get_page(sc, query, page, page_size), range(2, page_count + 1)
+        ):
+          records.extend(page_records)
+    log_debug(f'Read {len(records)} records in {page_count} pages from {query}')
+    return records
+  except Exception as e:
+    log_warning(f'Unable to read pages of {query} concurrently - {e}')
+    return sc.get_all_records(query)
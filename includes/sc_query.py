@@ -0,0 +1,270 @@
+# Service Catalogue field projections
+# Most jobs only need a handful of component fields, but the default component
+# query returns every field and populated relation. Each projection lists the
+# fields (and relation fields) that a job reads - and the fields that it
+# updates, so that the delta-only updates can compare them - and is turned
+# into a Strapi query using fields[] and populate parameters.
+#
+# Strapi always returns id and documentId, so they don't need to be listed.
+#
+# A Selection narrows a batch run down to some of the components (by name,
+# product, team or recent changes) using Strapi filters. Archived components are
+# always filtered out, unless they're asked for.
+
+import re
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+
+class Projection:
+  def __init__(self, table, fields=(), populate=None, filters=''):
+    self.table = table
+    self.fields = tuple(fields)
+    # relation (or component) name -> tuple of fields to return (empty for all
+    # fields), or a nested Projection
+    self.populate = populate or {}
+    self.filters = filters
+
+  def params(self, prefix=''):
+    def key(name):
+      return f'{prefix}[{name}]' if prefix else name
+
+    params = [f'{key("fields")}[{i}]={field}' for i, field in enumerate(self.fields)]
+    for relation, relation_fields in self.populate.items():
+      relation_prefix = f'{key("populate")}[{relation}]'
+      if isinstance(relation_fields, Projection):
+        params += relation_fields.params(relation_prefix)
+      elif relation_fields:
+        params += [
+          f'{relation_prefix}[fields][{i}]={field}'
+          for i, field in enumerate(relation_fields)
+        ]
+      else:
+        params.append(f'{relation_prefix}=true')
+    return params
+
+  def query(self, sc=None):
+    query = f'{self.table}?{"&".join(self.params())}{self.filters}'
+    # Keep any filter that the Service Catalogue was configured with
+    if sc is not None and (sc_filter := getattr(sc, 'filter', '')):
+      query += sc_filter if sc_filter.startswith('&') else f'&{sc_filter}'
+    return query
+
+
+# Component selections
+######################
+def filter_params(conditions, prefix='filters'):
+  # Turns nested filter conditions into Strapi filter parameters, eg.
+  # {'name': {'$eq': 'x'}} -> &filters[name][$eq]=x
+  if isinstance(conditions, dict):
+    items = conditions.items()
+  elif isinstance(conditions, (list, tuple)):
+    items = enumerate(conditions)
+  else:
+    return f'&{prefix}={quote(str(conditions), safe="")}'
+  return ''.join(filter_params(value, f'{prefix}[{key}]') for key, value in items)
+
+
+# Most pushed repositories that are sent as a filter - with more than this, the
+# query string gets too long, so recent changes are checked as the components
+# are read instead
+MAX_FILTER_REPOS = 100
+
+
+def _datetime(value):
+  if not value:
+    return None
+  try:
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+  except ValueError:
+    return None
+  return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class Selection:
+  # Restricts a batch to a selection of components. Everything except the name
+  # regex (which Strapi can't filter on), and recent changes when there are too
+  # many pushed repositories to send, is filtered by the Service Catalogue.
+  def __init__(
+    self,
+    names=None,
+    name_regex=None,
+    products=None,
+    teams=None,
+    since=None,
+    pushed_repos=None,
+    include_archived=False,
+  ):
+    self.names = list(names or [])
+    self.name_regex = re.compile(name_regex) if name_regex else None
+    self.products = list(products or [])
+    self.teams = list(teams or [])
+    self.since = since  # datetime
+    self.pushed_repos = sorted(pushed_repos or [])
+    self.include_archived = include_archived
+    self._since_client_side = bool(since) and len(self.pushed_repos) > MAX_FILTER_REPOS
+
+  def conditions(self):
+    conditions = []
+    if not self.include_archived:
+      conditions.append(
+        {'$or': [{'archived': {'$eq': 'false'}}, {'archived': {'$null': 'true'}}]}
+      )
+    if self.names:
+      conditions.append({'name': {'$in': self.names}})
+    if self.products:
+      conditions.append({'product': {'p_id': {'$in': self.products}}})
+    if self.teams:
+      conditions.append({'product': {'team': {'name': {'$in': self.teams}}}})
+    if self.since and not self._since_client_side:
+      # Changed in the Service Catalogue, or pushed to in Github, since then
+      since = self.since.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+      changed = [
+        {'updatedAt': {'$gte': since}},
+        {'latest_commit': {'date_time': {'$gte': since}}},
+      ]
+      if self.pushed_repos:
+        changed.append({'github_repo': {'$in': self.pushed_repos}})
+      conditions.append({'$or': changed})
+    return conditions
+
+  def filters(self):
+    conditions = self.conditions()
+    return filter_params({'$and': conditions}) if conditions else ''
+
+  def is_selective(self):
+    # Whether only some of the (unarchived) components are selected
+    return bool(
+      self.names or self.name_regex or self.products or self.teams or self.since
+    )
+
+  def client_side(self):
+    # Whether some of the selection is only checked as the components are read
+    return bool(self.name_regex or self._since_client_side)
+
+  def _changed_since(self, component):
+    if component.get('github_repo') in set(self.pushed_repos):
+      return True
+    changed = (
+      component.get('updatedAt'),
+      (component.get('latest_commit') or {}).get('date_time'),
+    )
+    return any(
+      (changed_at := _datetime(value)) and changed_at >= self.since
+      for value in changed
+    )
+
+  def matches(self, component):
+    if self.name_regex and not self.name_regex.search(component.get('name') or ''):
+      return False
+    if self._since_client_side and not self._changed_since(component):
+      return False
+    return True
+
+  def describe(self):
+    parts = []
+    if self.names:
+      parts.append(f'names {", ".join(self.names)}')
+    if self.name_regex:
+      parts.append(f'names matching {self.name_regex.pattern}')
+    if self.products:
+      parts.append(f'products {", ".join(self.products)}')
+    if self.teams:
+      parts.append(f'teams {", ".join(self.teams)}')
+    if self.since:
+      parts.append(f'changed since {self.since.isoformat()}')
+    return '; '.join(parts) or 'all unarchived components'
+
+
+TEAM_FIELDS = (
+  'github_project_teams_admin',
+  'github_project_teams_maintain',
+  'github_project_teams_write',
+  'github_project_branch_protection_restricted_teams',
+)
+
+# Security discovery - repository variables, codescanning and standards
+SECURITY_COMPONENTS = Projection(
+  'components',
+  fields=(
+    'name',
+    'github_repo',
+    'archived',
+    'security_settings',
+    'codescanning_summary',
+    'standards_compliance',
+    'workflow_runs_waiting',
+    'slack_channel_security_scans_notify',
+    'slack_channel_prod_release_notify',
+    'slack_channel_nonprod_release_notify',
+  ),
+  populate={'product': ('p_id',)},
+)
+
+# Workflows discovery - non-local Github actions and workflows
+WORKFLOWS_COMPONENTS = Projection(
+  'components', fields=('name', 'github_repo', 'archived', 'versions')
+)
+
+# Dependency discovery - the Github actions in use
+COMPONENT_VERSIONS = Projection('components', fields=('name', 'versions'))
+
+# Duplicate Application Insights cloud role names
+APP_INSIGHTS_COMPONENTS = Projection(
+  'components',
+  fields=('name', 'app_insights_cloud_role_name'),
+  filters='&filters[archived][$eq]=false',
+)
+
+# Github teams discovery - teams referenced by components. These (and the
+# duplicate cloud role names) are read from every component, so they're queried
+# without the Service Catalogue filter.
+COMPONENT_TEAMS = Projection('components', fields=('name',) + TEAM_FIELDS)
+
+# --since selections - the Github repositories in the Service Catalogue
+COMPONENT_REPOS = Projection('components', fields=('github_repo',))
+
+# Full component discovery - only used for the GraphQL read path (see
+# includes/sc_graphql.py), since the REST path uses the library's own query
+DISCOVERY_COMPONENTS = Projection(
+  'components',
+  fields=(
+    'name',
+    'github_repo',
+    'archived',
+    'part_of_monorepo',
+    'path_to_project',
+    'path_to_helm_dir',
+    'base_template_repo',
+    'language',
+    'description',
+    'github_project_visibility',
+    'github_enforce_admins_enabled',
+    'github_topics',
+    'disabled_workflows',
+    'api',
+    'frontend',
+    'library',
+    'worker',
+    'container_image',
+    'app_insights_cloud_role_name',
+    'app_insights_alerts_enabled',
+    'snyk_ignore',
+    'versions',
+    'security_settings',
+    'ip_allowlist_version',
+    'ip_allowlist_digest_sha',
+    # for --since selections that are checked as the components are read
+    'updatedAt',
+  )
+  + TEAM_FIELDS,
+  populate={
+    'latest_commit': ('sha', 'date_time'),
+    'product': ('p_id',),
+    'envs': Projection(
+      'environments',
+      fields=('name', 'type', 'namespace', 'url', 'build_image_tag'),
+      populate={'ns': ('name',)},
+    ),
+  },
+)
@@ -0,0 +1,95 @@
+# Dry-run recording of Service Catalogue writes
+# In dry-run mode the Service Catalogue is wrapped so that updates, adds,
+# deletes and scheduled job updates aren't sent - each one is written as a line
+# of JSON to a recording file instead. Reads still go to the Service Catalogue.
+#
+# Each line has the operation, table, documentId and data, along with when the
+# call was made (seconds since the recording started) and which thread made it.
+# Recordings can be replayed with utilities/replay_writes.py.
+#
+# Optional environment variables
+# - DRY_RUN_FILE: recording file (default dry-run-<job name>-<timestamp>.jsonl)
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# hmpps
+from hmpps.services.job_log_handling import log_info
+
+# Added records are given a placeholder documentId, which is mapped to the real
+# one wherever it appears (eg. as an added environment's component) when the
+# recording is replayed
+PLACEHOLDER_PREFIX = 'dry-run-'
+
+
+class RecordingCatalogue:
+  def __init__(self, sc, path, job_name=None):
+    self._sc = sc
+    self.path = path
+    self.job_name = job_name
+    self._file = open(path, 'a')
+    self._lock = threading.Lock()
+    self._started = time.monotonic()
+    self.count = 0
+    atexit.register(self.close)
+
+  def __getattr__(self, name):
+    return getattr(self._sc, name)
+
+  def _record(self, operation, table=None, document_id=None, data=None, **extra):
+    with self._lock:
+      self.count += 1
+      if operation == 'add':
+        document_id = f'{PLACEHOLDER_PREFIX}{self.count}'
+      entry = {
+        'seq': self.count,
+        'time': datetime.now(timezone.utc).isoformat(),
+        'elapsed': round(time.monotonic() - self._started, 3),
+        'thread': threading.current_thread().name,
+        'operation': operation,
+        'table': table,
+        'documentId': document_id,
+        'data': data,
+        **extra,
+      }
+      self._file.write(json.dumps(entry, default=str) + '\n')
+      self._file.flush()
+      return document_id
+
+  def update(self, table, document_id, data):
+    self._record('update', table, document_id, data)
+    return True
+
+  def add(self, table, data):
+    document_id = self._record('add', table, data=data)
+    # Look like a Strapi response, so the caller can carry on
+    return {'data': {**data, 'documentId': document_id}}
+
+  def delete(self, table, document_id):
+    self._record('delete', table, document_id)
+    return True
+
+  def update_scheduled_job(self, *args):
+    self._record(
+      'scheduled_job', job=self.job_name, args=[a for a in args if isinstance(a, str)]
+    )
+    return True
+
+  def close(self):
+    with self._lock:
+      if self._file.closed:
+        return
+      self._file.close()
+    log_info(f'Dry run - {self.count} Service Catalogue writes recorded in {self.path}')
+
+
+def record_writes(sc, job_name):
+  path = os.getenv('DRY_RUN_FILE') or (
+    f'dry-run-{job_name}-{datetime.now().strftime("%Y%m%d-%H%M%S")}.jsonl'
+  )
+  log_info(f'Dry run - Service Catalogue writes will be recorded in {path}')
+  return RecordingCatalogue(sc, path, job_name)
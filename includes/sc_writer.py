@@ -0,0 +1,219 @@
+# Write-behind Service Catalogue updates
+# Component and environment updates and deletes are queued and sent by a
+# separate pool of writer threads, so that the Github worker threads don't wait
+# on the Service Catalogue (and a slow Service Catalogue doesn't hold up Github
+# processing).
+#
+# - updates to the same record that are still waiting in the queue are merged
+#   into a single update, and a delete replaces any waiting updates
+# - writes to the same record are never sent concurrently, and are sent in order
+# - the writers back off when Service Catalogue writes fail (and are paced by
+#   the write latency when they slow down), and failed writes are retried
+#   before being logged as errors
+# - adds are still sent straight away, since the caller needs the new record
+#
+# Queued writes are reported as successful - write failures are logged as
+# errors (and so reported in the job status) when they are finally sent.
+# The queue is flushed at the end of each batch, and when the job finishes.
+#
+# Optional environment variables
+# - SC_WRITER_THREADS: number of writer threads (default 0 - writes are sent inline)
+# - SC_WRITER_SLOW_SECONDS: write latency above which the writers are paced
+#   (default 2)
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# hmpps
+from hmpps.services.job_log_handling import log_debug, log_error, log_info, log_warning
+
+MAX_ATTEMPTS = 4
+MAX_BACKOFF = 60
+
+
+class WriteBehindCatalogue:
+  def __init__(self, sc, threads, slow_seconds):
+    self._sc = sc
+    self.slow_seconds = slow_seconds
+    self.thread_count = threads
+    self._pending = OrderedDict()  # (table, documentId) -> ['update'|'delete', data]
+    self._in_flight = set()
+    self._cond = threading.Condition()
+    self._closed = False
+    self._backoff = 0
+    self._resume_at = 0
+    self._latency = None  # moving average, in seconds
+    self.sent = 0
+    self.coalesced = 0
+    self.retries = 0
+    self.failed = 0
+    self._threads = [
+      threading.Thread(target=self._run, daemon=True) for _ in range(threads)
+    ]
+    for t in self._threads:
+      t.start()
+    atexit.register(self.close)
+
+  def __getattr__(self, name):
+    return getattr(self._sc, name)
+
+  # Queueing
+  def update(self, table, document_id, data):
+    with self._cond:
+      key = (table, document_id)
+      if pending := self._pending.get(key):
+        # Merge with the waiting update (there's no point updating a record
+        # that's waiting to be deleted)
+        if pending[0] == 'update':
+          pending[1].update(data)
+        self.coalesced += 1
+      else:
+        self._pending[key] = ['update', dict(data)]
+      self._cond.notify()
+    return True
+
+  def delete(self, table, document_id):
+    with self._cond:
+      key = (table, document_id)
+      if key in self._pending:
+        self.coalesced += 1
+      self._pending[key] = ['delete', None]
+      self._pending.move_to_end(key)
+      self._cond.notify()
+    return True
+
+  def add(self, table, data):
+    return self._sc.add(table, data)
+
+  # Writers
+  def _next_write(self):
+    # Called with the condition held - the oldest write for a record that
+    # isn't already being written
+    for key in self._pending:
+      if key not in self._in_flight:
+        self._in_flight.add(key)
+        return key, self._pending.pop(key)
+    return None, None
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while True:
+          if self._closed and not self._pending:
+            return
+          if (wait := self._resume_at - time.monotonic()) > 0:
+            self._cond.wait(timeout=wait)
+            continue
+          key, write = self._next_write()
+          if key:
+            break
+          self._cond.wait(timeout=5)
+      operation, data = write
+      try:
+        self._write(key, operation, data)
+      finally:
+        with self._cond:
+          self._in_flight.discard(key)
+          self._cond.notify_all()
+
+  def _write(self, key, operation, data):
+    table, document_id = key
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+      started = time.monotonic()
+      try:
+        if operation == 'update':
+          result = self._sc.update(table, document_id, data)
+        else:
+          result = self._sc.delete(table, document_id)
+      except Exception as e:
+        log_warning(f'Service Catalogue {operation} of {table}/{document_id} - {e}')
+        result = None
+      self._adapt(time.monotonic() - started, bool(result))
+      if result:
+        with self._cond:
+          self.sent += 1
+        return
+      if attempt < MAX_ATTEMPTS:
+        with self._cond:
+          self.retries += 1
+        log_debug(f'Retrying {operation} of {table}/{document_id} ({attempt})')
+        time.sleep(self._backoff)
+    with self._cond:
+      self.failed += 1
+    log_error(f'Error in Service Catalogue {operation} of {table}/{document_id}')
+
+  def _adapt(self, latency, ok):
+    # Back off all of the writers (exponentially) when writes are failing
+    # (eg. 429 Too Many Requests or 5xx responses), and recover gradually.
+    # Writes that are slow but succeeding are only paced by their latency.
+    with self._cond:
+      if self._latency is None:
+        self._latency = latency
+      else:
+        self._latency += 0.2 * (latency - self._latency)
+      if not ok:
+        self._backoff = min(max(self._backoff * 2, 1), MAX_BACKOFF)
+        self._resume_at = time.monotonic() + self._backoff
+        log_debug(f'Service Catalogue writes backing off for {self._backoff}s')
+      else:
+        self._backoff = self._backoff // 2
+        if self._latency > self.slow_seconds:
+          self._resume_at = max(
+            self._resume_at, time.monotonic() + min(self._latency, MAX_BACKOFF)
+          )
+
+  # Shutdown
+  def flush(self):
+    # Waits until every queued write has been sent
+    with self._cond:
+      self._cond.notify_all()
+      while self._pending or self._in_flight:
+        self._cond.wait(timeout=1)
+
+  def close(self):
+    with self._cond:
+      if self._closed:
+        return
+      self._closed = True
+      self._cond.notify_all()
+    for t in self._threads:
+      t.join()
+    log_info(
+      f'Service Catalogue writer finished - {self.sent} writes sent, '
+      f'{self.coalesced} coalesced, {self.retries} retried, {self.failed} failed'
+    )
+
+
+def wrap_catalogue(sc):
+  # Returns a write-behind Service Catalogue if SC_WRITER_THREADS is set,
+  # otherwise the Service Catalogue unchanged
+  if (threads := int(os.getenv('SC_WRITER_THREADS', '0'))) > 0:
+    return WriteBehindCatalogue(
+      sc, threads, float(os.getenv('SC_WRITER_SLOW_SECONDS', '2'))
+    )
+  return sc
+
+
+def _writer(sc):
+  # The write-behind catalogue, which may itself be wrapped (eg. by the dry-run
+  # recorder - see includes/sc_recorder.py)
+  while sc is not None and not isinstance(sc, WriteBehindCatalogue):
+    sc = getattr(sc, '__dict__', {}).get('_sc')
+  return sc
+
+
+def thread_count(sc):
+  return writer.thread_count if (writer := _writer(sc)) else 0
+
+
+def flush(sc):
+  if writer := _writer(sc):
+    writer.flush()
+
+
+def close(sc):
+  if writer := _writer(sc):
+    writer.close()
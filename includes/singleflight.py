@@ -0,0 +1,43 @@
+# Request coalescing (single-flight)
+# When several worker threads ask for the same thing at the same time, only the
+# first one makes the call - the others wait for it to finish and share its
+# result (or its exception). Nothing is cached once the call has completed.
+
+import threading
+
+
+class _Call:
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class SingleFlight:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._calls = {}
+
+  def do(self, key, func, *args, **kwargs):
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = _Call()
+
+    if not leader:
+      call.done.wait()
+      if call.error:
+        raise call.error
+      return call.result
+
+    try:
+      call.result = func(*args, **kwargs)
+      return call.result
+    except Exception as e:
+      call.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+      call.done.set()
@@ -93,6 +93,21 @@ def get_existing_env_config(component, env_name, config, services):
   return config_value
 
 
+# Directory listings - served from a local git mirror if the session has one
+# (see includes/git_mirror.py), otherwise from the Github contents API.
+# API listings are pinned to the latest default branch commit unless
+# pin_to_head is False
+def get_dir_contents(gh, repo, path, pin_to_head=True):
+  if get_mirror_contents := getattr(gh, 'get_dir_contents', None):
+    if (contents := get_mirror_contents(repo, path)) is not None:
+      return contents
+  if pin_to_head:
+    return repo.get_contents(
+      path, ref=repo.get_branch(repo.default_branch).commit.sha
+    )
+  return repo.get_contents(path)
+
+
 def remove_version(data, version):
   log_debug(f'attempting to remove {version} from data["versions"]')
   if versions := data.get('versions', {}):
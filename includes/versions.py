@@ -14,6 +14,7 @@ from hmpps.services.job_log_handling import (
 )
 
 # local
+from includes import negative_cache
 from includes.utils import remove_version
 
 # Contains functions that return versions
@@ -26,7 +27,9 @@ from includes.utils import remove_version
 def get_circle_ci_orb_version(services, repo):
   circle_ci_config = '.circleci/config.yml'
   versions_data = {}
-  if circleci_config := services.gh.get_file_yaml(repo, circle_ci_config):
+  if circleci_config := negative_cache.get_file_yaml(
+    services.gh, repo, circle_ci_config
+  ):
     # CircleCI Orb version
     cirleci_orbs = circleci_config.get('orbs', {})
     for key, value in cirleci_orbs.items():
@@ -116,9 +119,9 @@ def _parse_gradle_content(content):
 
 def _get_gradle_subprojects(gh, repo):
   projects = []
-  if settings_content := gh.get_file_plain(
-    repo, 'settings.gradle.kts'
-  ) or gh.get_file_plain(repo, 'settings.gradle'):
+  if settings_content := negative_cache.get_file_plain(
+    gh, repo, 'settings.gradle.kts'
+  ) or negative_cache.get_file_plain(gh, repo, 'settings.gradle'):
     # Remove comments to avoid false positives
     settings_content_no_comments = re.sub(r'//.*', '', settings_content)
 
@@ -138,9 +141,9 @@ def get_gradle_config(gh, repo, component_name):
   gradle_config = {}
 
   # Check root
-  if build_gradle_config_content := gh.get_file_plain(
-    repo, 'build.gradle.kts'
-  ) or gh.get_file_plain(repo, 'build.gradle'):
+  if build_gradle_config_content := negative_cache.get_file_plain(
+    gh, repo, 'build.gradle.kts'
+  ) or negative_cache.get_file_plain(gh, repo, 'build.gradle'):
     gradle_config.update(_parse_gradle_content(build_gradle_config_content))
 
   # Check subprojects
@@ -154,9 +157,9 @@ def get_gradle_config(gh, repo, component_name):
       log_debug(f'{path} is not in {["common", f"{component_name}"]} - skipping')
       continue
 
-    if sub_content := gh.get_file_plain(
-      repo, f'{path}/build.gradle.kts'
-    ) or gh.get_file_plain(repo, f'{path}/build.gradle'):
+    if sub_content := negative_cache.get_file_plain(
+      gh, repo, f'{path}/build.gradle.kts'
+    ) or negative_cache.get_file_plain(gh, repo, f'{path}/build.gradle'):
       log_debug(f'Parsing gradle files in {path}')
       gradle_config.update(_parse_gradle_content(sub_content))
 
@@ -225,7 +228,9 @@ def get_docker_versions(services, repo, component_project_dir):
   docker_versions = {}
   dockerfile_path = f'{component_project_dir}/Dockerfile'
   log_debug(f'Looking for Dockerfile at {dockerfile_path}')
-  if dockerfile_contents := services.gh.get_file_plain(repo, dockerfile_path):
+  if dockerfile_contents := negative_cache.get_file_plain(
+    services.gh, repo, dockerfile_path
+  ):
     if docker_data := get_dockerfile_data(dockerfile_contents):
       # Reprocess the dictionary to include the path name
       for key, value in docker_data.items():
@@ -237,7 +242,9 @@ def get_docker_versions(services, repo, component_project_dir):
 def get_python_versions(services, repo):
   uv_lock = 'uv.lock'
   python_versions = {}
-  if pyproject_toml_contents := services.gh.get_file_plain(repo, uv_lock):
+  if pyproject_toml_contents := negative_cache.get_file_plain(
+    services.gh, repo, uv_lock
+  ):
     toml_data = tomllib.loads(pyproject_toml_contents)
 
     for pkg in toml_data.get('package', []):
@@ -0,0 +1,30 @@
+# YAML parsing
+# Parses YAML with libyaml's C loader (CSafeLoader) when PyYAML has been built
+# with it, which is several times faster than the pure-Python SafeLoader. Both
+# use the same constructors and resolvers, so the results are the same as
+# yaml.safe_load.
+#
+# Only the files that discovery parses itself are covered - yaml.safe_load (and
+# so the hmpps library's parsing) is left as it is.
+#
+# Benchmark with utilities/benchmark_yaml.py.
+#
+# Optional environment variables
+# - YAML_PURE_PYTHON: set to true to always use the pure-Python loader
+
+import os
+
+import yaml
+
+YAMLError = yaml.YAMLError
+
+
+def loader():
+  if os.getenv('YAML_PURE_PYTHON', '').lower() in ('1', 'true', 'yes'):
+    return yaml.SafeLoader
+  return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def safe_load(stream):
+  return yaml.load(stream, Loader=loader())
+
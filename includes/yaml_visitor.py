@@ -0,0 +1,96 @@
+# Single-pass YAML key visitor
+# Extractors register the keys they're interested in, and a KeyVisitor collects
+# all of them in one walk of a parsed document, rather than one walk per key:
+#
+#   HELM_KEYS = KeyVisitor(
+#     ip_allow_list=Subtree('allowlist'), audit_sqs=Exists('AUDIT_SQS_QUEUE_URL')
+#   )
+#   found = HELM_KEYS.visit(values)  # {'ip_allow_list': {...}, 'audit_sqs': True}
+#
+# Each kind of interest gives the same result as the hmpps library function it
+# replaces: Collect as find_matching_keys, Subtree as fetch_yaml_values_for_key.
+
+
+class Collect:
+  # Every value of the key, without looking inside the values themselves
+  def __init__(self, key):
+    self.key = key
+
+
+class Exists:
+  # Whether the key appears anywhere (case insensitive)
+  def __init__(self, key):
+    self.key = key
+
+
+class Subtree:
+  # The values of the key, nested under the keys of the dictionaries above them
+  def __init__(self, key):
+    self.key = key
+
+
+class KeyVisitor:
+  def __init__(self, **interests):
+    self.names = list(interests)
+    # key -> names, so each dictionary key is looked up once for every interest
+    self._collect = {}
+    self._exists = {}
+    self._subtree = {}
+    for name, interest in interests.items():
+      if isinstance(interest, Collect):
+        self._collect.setdefault(interest.key, set()).add(name)
+      elif isinstance(interest, Exists):
+        self._exists.setdefault(str(interest.key).upper(), set()).add(name)
+      elif isinstance(interest, Subtree):
+        self._subtree[name] = interest.key
+      else:
+        raise TypeError(f'Unknown interest for {name}: {interest}')
+
+  def visit(self, document):
+    collected = {name: [] for names in self._collect.values() for name in names}
+    found = set()
+    subtrees = self._walk(document, collected, found, frozenset())
+    results = {}
+    for name in self.names:
+      if name in collected:
+        results[name] = collected[name]
+      elif name in self._subtree:
+        results[name] = subtrees.get(name, {})
+      else:
+        results[name] = name in found
+    return results
+
+  def _walk(self, node, collected, found, suppressed):
+    # Returns name -> subtree values for this node
+    subtrees = {}
+    if isinstance(node, dict):
+      for name, key in self._subtree.items():
+        if key in node:
+          value = node[key]
+          if isinstance(value, dict):
+            subtrees.setdefault(name, {}).update(value)
+          else:
+            subtrees.setdefault(name, {})[key] = value
+      for k, v in node.items():
+        if self._exists and (names := self._exists.get(str(k).upper())):
+          found.update(names)
+        child_suppressed = suppressed
+        if names := self._collect.get(k):
+          for name in names - suppressed:
+            collected[name].append(v)
+          # Matched values aren't searched for the same key
+          child_suppressed = suppressed | names
+        if isinstance(v, (dict, list)):
+          for name, child_values in self._walk(
+            v, collected, found, child_suppressed
+          ).items():
+            if child_values:
+              subtrees.setdefault(name, {})[k] = child_values
+    elif isinstance(node, list):
+      for item in node:
+        for name, child_values in self._walk(
+          item, collected, found, suppressed
+        ).items():
+          if child_values:
+            subtrees.setdefault(name, {}).update(child_values)
+    return subtrees
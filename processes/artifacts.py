@@ -4,6 +4,7 @@ import os
 import zipfile
 import requests
 from hmpps.services.job_log_handling import log_debug, log_info, log_warning, log_error
+from includes import negative_cache
 from includes.github_api import GITHUB_API_BASE_URL, get_github_api_headers
 
 DEFAULT_ARTIFACT_NAME = 'prod-deploy-details'
@@ -16,8 +17,16 @@ class ArtifactDetailsFetcher:
     self.artifact_name = os.getenv('ARTIFACT_NAME', DEFAULT_ARTIFACT_NAME)
     self.target_file = os.getenv('TARGET_FILE', DEFAULT_TARGET_FILE)
     self.repo_full_name = getattr(repo, 'full_name', f'ministryofjustice/{repo.name}')
+    self.repo = repo
 
   def get_latest_artifact(self):
+    if negative_cache.is_missing(self.repo, 'artifact', self.artifact_name):
+      log_debug(
+        f'Artifact {self.artifact_name} is known not to exist for '
+        f'{self.repo_full_name} - skipping'
+      )
+      return None
+
     try:
       response = requests.get(
         f'{self.api}/repos/{self.repo_full_name}/actions/artifacts',
@@ -47,6 +56,7 @@ class ArtifactDetailsFetcher:
     ]
 
     if not matching_active_artifacts:
+      negative_cache.record_missing(self.repo, 'artifact', self.artifact_name)
       return None
 
     return max(
@@ -25,7 +25,10 @@ from hmpps.services.job_log_handling import (
 
 
 # local
-from includes import helm, environments, versions
+from includes import helm, environments, negative_cache, prefetch, versions
+from includes import sc_diff, sc_graphql, sc_pages, sc_query, sc_writer
+from includes.github_api import get_org_repo
+from includes.github_models import RepoModel
 import processes.artifacts as artifacts
 
 max_threads = 10
@@ -101,13 +104,15 @@ def get_repo_teams_info(repo, branch_protection):
 ##########################################
 def get_repo_properties(repo, default_branch):
   log_debug('get_repo_properties running')
-  description = repo.description or ''
-  if repo.archived and 'ARCHIVED' not in description:
+  # Read from the repository JSON, so no hidden completion requests are made
+  repo_model = RepoModel.from_github(repo)
+  description = repo_model.description or ''
+  if repo_model.archived and 'ARCHIVED' not in description:
     description = f'[ARCHIVED] {description}'
   return {
-    'language': repo.language,
+    'language': repo_model.language,
     'description': description,
-    'github_project_visibility': repo.visibility,
+    'github_project_visibility': repo_model.visibility,
     'github_repo': repo.name,
     'latest_commit': {
       'sha': default_branch.commit.sha,
@@ -177,8 +182,8 @@ def get_app_insights_cloud_role_name(
       f'Detected Kotlin/Java - looking in {component_project_dir}/'
       'applicationinsights.json'
     )
-    app_insights_config = gh.get_file_json(
-      repo, f'{component_project_dir}/applicationinsights.json'
+    app_insights_config = negative_cache.get_file_json(
+      gh, repo, f'{component_project_dir}/applicationinsights.json'
     )
     if app_insights_config:
       if app_insights_cloud_role_name := app_insights_config.get('role', {}).get(
@@ -203,7 +208,9 @@ def get_app_insights_cloud_role_name(
       f'Detected JavaScript/TypeScript - '
       f'looking in {component_project_dir}/package.json'
     )
-    if package_json := gh.get_file_json(repo, f'{component_project_dir}/package.json'):
+    if package_json := negative_cache.get_file_json(
+      gh, repo, f'{component_project_dir}/package.json'
+    ):
       if app_insights_cloud_role_name := package_json.get('name'):
         if re.match(r'^[a-zA-Z0-9-_]+$', app_insights_cloud_role_name):
           log_debug(f'app_insights_cloud_role_name is {app_insights_cloud_role_name}')
@@ -316,7 +323,7 @@ def process_independent_component(data, component, repo):
 #################################################¢¢¢¢¢############################
 # Changed Component Function - only runs if main branch or environment has changed
 ##################################################################################
-def process_changed_component(data, component, repo, services):
+def process_changed_component(data, component, repo, services, resolver=None):
   gh = services.gh
 
   # Shortcuts to make it easier to read
@@ -340,7 +347,8 @@ def process_changed_component(data, component, repo, services):
   # - Product ID if it's valid
 
   log_debug(f'Getting information for {component_name} from Helm config')
-  if helm.get_info_from_helm(data, component, repo, services):
+  helm_dirs = resolver.helm_dirs() if resolver else None
+  if helm.get_info_from_helm(data, component, repo, services, helm_dirs):
     log_debug(f'Updated Helm data for record id {component_name}')
 
   log_debug(
@@ -367,7 +375,7 @@ def process_changed_component(data, component, repo, services):
   versions.get_versions(services, data, repo, component_name, component_project_dir)
 
   # Snyk ignore config - set from root .snyk only when the file exists.
-  snyk_ignore_content = gh.get_file_plain(repo, '.snyk')
+  snyk_ignore_content = negative_cache.get_file_plain(gh, repo, '.snyk')
   if snyk_ignore_content is not None:
     data['snyk_ignore'] = snyk_ignore_content
   else:
@@ -407,6 +415,8 @@ def process_sc_component(services, component, bootstrap_projects, force_update=F
 
   component_flags = {}
   component_name = component.get('name')
+  # The component as fetched, to work out which fields have changed
+  sc_component = sc_diff.snapshot(component)
 
   log_info(f'Processing component: {component_name}')
 
@@ -428,7 +438,7 @@ def process_sc_component(services, component, bootstrap_projects, force_update=F
       sc_latest_commit = sha
 
   log_debug(f'Latest commit in SC for {component_name} is {sc_latest_commit}')
-  repo = gh.get_org_repo(component.get('github_repo', {}))
+  repo = get_org_repo(gh, component.get('github_repo'))
   if repo:
     gh_latest_commit = repo.get_branch(repo.default_branch).commit.sha
     log_debug(f'Latest commit in Github for {component_name} is {gh_latest_commit}')
@@ -438,9 +448,13 @@ def process_sc_component(services, component, bootstrap_projects, force_update=F
     ##############################################################################
     log_info(f'Processing main branch independent components for: {component_name}')
     component_flags = process_independent_component(data, component, repo)
-    component_flags['env_changed'] = environments.check_env_change(
+    # The component's environments are worked out once and shared from here on
+    resolver = environments.EnvironmentResolver(
       component, repo, bootstrap_projects, services
     )
+    component_flags['env_changed'] = environments.check_env_change(
+      component, repo, bootstrap_projects, services, resolver
+    )
 
     # Check if the commit has changed:
     if sc_latest_commit and sc_latest_commit != gh_latest_commit:
@@ -459,7 +473,7 @@ def process_sc_component(services, component, bootstrap_projects, force_update=F
       # if main branch / environments have changed (full only)
       #################################################################################
       log_info(f'Processing changed components for: {component_name}')
-      process_changed_component(data, component, repo, services)
+      process_changed_component(data, component, repo, services, resolver)
 
       #################################################################################
       # Processing the environment data -
@@ -477,7 +491,7 @@ def process_sc_component(services, component, bootstrap_projects, force_update=F
       else:
         helm_environments = {}
       env_flags = environments.process_environments(
-        component, repo, helm_environments, bootstrap_projects, services
+        component, repo, helm_environments, bootstrap_projects, services, resolver
       )
       # Add environment flags to the component flags, since they're related
       for each_flag in env_flags:
@@ -491,8 +505,8 @@ def process_sc_component(services, component, bootstrap_projects, force_update=F
     # no code or environment changes and the pipeline runs manually or on a schedule.
     artifacts.update_prod_ip_allowlist_version_details(services, repo, data)
 
-    # Update component with all results in data dictionary
-    if not sc.update(sc.components, component['documentId'], data):
+    # Update component with any changed results in data dictionary
+    if not sc_diff.update(sc, sc.components, sc_component, data):
       log_error(f'Error updating component {component_name}')
       component_flags['update_error'] = True
 
@@ -514,6 +528,8 @@ def batch_process_sc_components(
   module='processes.components',
   function='process_sc_component',
   force_update=False,
+  projection=None,
+  selection=None,
 ):
   sc = services.sc
 
@@ -521,9 +537,40 @@ def batch_process_sc_components(
 
   bootstrap_projects = get_bootstrap_projects(services)
 
-  components = sc.get_all_records(sc.components_get)
+  # Warm up Github data for the next few components while the workers are busy.
+  # File contents are only worth prefetching if every component will be read.
+  prefetcher = prefetch.start(services, [], prefetch_files=force_update)
+
+  # Only fetch the component fields the processing function needs, if known.
+  # Components are processed as each page arrives (and passed to the prefetcher)
+  query = projection.query(sc) if projection else sc.components_get
+  # Only read the selected components, if the batch has been narrowed down
+  selection_filters = selection.filters() if selection else ''
+  query += selection_filters
+  log_info(f'Selected {selection.describe() if selection else "all components"}')
+  on_page = prefetcher.extend if prefetcher else None
+  if on_page and selection and selection.client_side():
+    on_page = lambda records, extend=on_page: extend(  # noqa: E731
+      [record for record in records if selection.matches(record)]
+    )
+  if sc_graphql.enabled() and (projection or function == 'process_sc_component'):
+    # Components with their environments, product and namespaces in one request
+    components = sc_graphql.stream_records(
+      sc,
+      projection or sc_query.DISCOVERY_COMPONENTS,
+      query,
+      on_page=on_page,
+      extra_filters=selection_filters,
+    )
+  else:
+    components = sc_pages.stream_records(sc, query, on_page=on_page)
+  component_total = components.total
 
-  log_info(f'Processing batch of {len(components)} components...')
+  log_info(f'Processing batch of {component_total} components...')
+  # Prefetch and Service Catalogue writer threads don't count towards the limit
+  background_threads = (prefetcher.thread_count if prefetcher else 0) + (
+    sc_writer.thread_count(sc)
+  )
 
   threads = []
   component_count = 0
@@ -533,12 +580,15 @@ def batch_process_sc_components(
     if component.get('archived'):
       log_info(f'Skipping archived component {component.get("name")}')
       continue
+    if selection and not selection.matches(component):
+      log_debug(f'Skipping unselected component {component.get("name")}')
+      continue
     # Wait until the API limit is reset if we are close to the limit
 
     log_info(
-      f'{component_count}/{len(components)} - preparing to process '
-      f'{component.get("name")} ({int(component_count / len(components) * 100)}'
-      '% complete)'
+      f'{component_count}/{component_total} - preparing to process '
+      f'{component.get("name")} '
+      f'({int(component_count / max(component_total, 1) * 100)}% complete)'
     )
     if cur_rate_limit := services.gh.get_rate_limit():
       log_info(
@@ -598,10 +648,12 @@ def batch_process_sc_components(
     threads.append(t_repo)
 
     # Apply limit on total active threads, avoid github secondary API rate limit
-    while threading.active_count() > (max_threads - 1):
+    while threading.active_count() > (max_threads - 1 + background_threads):
       log_debug(f'Active Threads={threading.active_count()}, Max Threads={max_threads}')
       sleep(10)
 
+    if prefetcher:
+      prefetcher.dispatched(component, cur_rate_limit.remaining)
     t_repo.start()
     log_info(f'Started thread for component {component.get("name")}')
 
@@ -609,6 +661,11 @@ def batch_process_sc_components(
   for t in threads:
     t.join()
 
+  if prefetcher:
+    prefetcher.stop()
+  # Later processing may read the records that were updated by this batch
+  sc_writer.flush(sc)
+
   return processed_components
 
 
@@ -621,7 +678,8 @@ def find_duplicate_app_cloud_role(
 ):
   sc = services.sc
 
-  components = sc.get_all_records('components?filters[archived][$eq]=false')
+  # Every unarchived component, whatever the Service Catalogue filter
+  components = sc_pages.get_all_records(sc, sc_query.APP_INSIGHTS_COMPONENTS.query())
   log_info(
     f'Processing batch of {len(components)} components '
     'for finding duplicate app insights cloud role names...'
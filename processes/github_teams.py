@@ -8,6 +8,8 @@ from hmpps.services.job_log_handling import log_debug, log_error, log_info
 
 # local
 import includes.teams as teams
+from includes import sc_pages, sc_query
+from includes.github_models import TeamModel
 
 
 class Services:
@@ -17,7 +19,7 @@ class Services:
 
 def remove_team_from_components(sc, team_name):
   log_info(f'Removing team {team_name} from all components in the service catalogue')
-  components = sc.get_all_records(sc.components)
+  components = sc_pages.get_all_records(sc, sc_query.COMPONENT_TEAMS.query())
   for component in components:
     component_name = component.get("name")
     for team_list_key in ['github_project_teams_admin',
@@ -35,7 +37,7 @@ def remove_team_from_components(sc, team_name):
           log_error(f'Failed to remove team {team_name} from {component_name}')
 
 def find_all_teams_ref_in_sc(sc):
-  components = sc.get_all_records(sc.components)
+  components = sc_pages.get_all_records(sc, sc_query.COMPONENT_TEAMS.query())
   combined_teams = set()
   for component in components:
     combined_teams.update(component.get('github_project_teams_write', []) or [])
@@ -51,7 +53,7 @@ def process_github_teams(services):
 
   # Get the github teams data from SC
   log_info('Retrieving Github teams data ...')
-  sc_teams = sc.get_all_records(sc.github_teams)
+  sc_teams = sc_pages.get_all_records(sc, sc.github_teams)
   # Get the github teams refenered in admin, manintain and write teams from SC
   log_info('Getting Github teams references in components')
   all_repo_ref_gh_teams = find_all_teams_ref_in_sc(sc)
@@ -89,27 +91,27 @@ def process_github_teams(services):
           team_flags['team_references_removed'] = True
 
     if gh_team:
+      # Read from the team JSON, so no hidden completion requests are made
+      team_model = TeamModel.from_github(gh_team)
       if any(team_name == tf_team for tf_team in tf_team_names):
         terraform_managed = True
         team_flags['terraform_managed'] = True
       else:
         terraform_managed = False
       team_data = {
-        'github_team_id': gh_team.id,
+        'github_team_id': team_model.id,
         'team_name': team_name,
-        'parent_team_name': gh_team.parent.name if gh_team.parent else None,
-        'team_desc': gh_team.description.replace(
+        'parent_team_name': team_model.parent_name,
+        'team_desc': team_model.description.replace(
           '• This team is managed by Terraform, '
           'see https://github.com/ministryofjustice/hmpps-github-teams - '
           'DO NOT UPDATE MANUALLY!',
           '',
         )
-        if gh_team.description
+        if team_model.description
         else '',
         'terraform_managed': terraform_managed,
-        'members': [
-          member.login for member in gh.org.get_team(gh_team.id).get_members()
-        ],
+        'members': [member.login for member in gh_team.get_members()],
       }
 
       log_debug(f'team_data: {team_data}')
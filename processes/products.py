@@ -7,6 +7,9 @@ from hmpps import Slack
 from hmpps import ServiceCatalogue
 from hmpps.services.job_log_handling import log_debug, log_info
 
+# local
+from includes import sc_pages
+
 max_threads = 10
 
 
@@ -43,7 +46,7 @@ def batch_process_sc_products(services, max_threads=10):
   sc = services.sc
   threads = []
 
-  products = sc.get_all_records(sc.products_get)
+  products = sc_pages.get_all_records(sc, sc.products_get)
   log_info(f'Processing batch of {len(products)} products...')
   for product in products:
     t_repo = threading.Thread(
@@ -6,7 +6,12 @@ from hmpps.services.job_log_handling import log_debug, log_info, log_warning, lo
 
 # local
 from includes import standards
-from includes.github_api import GITHUB_API_BASE_URL, get_github_api_headers
+from includes import negative_cache, sc_diff, sc_lookups
+from includes.github_api import (
+  GITHUB_API_BASE_URL,
+  get_github_api_headers,
+  get_org_repo,
+)
 from datetime import datetime, timezone
 import requests
 
@@ -22,11 +27,16 @@ def get_repo_variables(services, repo, component_name):
     ('slack_channel_nonprod_release_notify', 'NONPROD_RELEASES_SLACK_CHANNEL'),
   ]
   for var in repo_var_list:
+    if negative_cache.is_missing(repo, 'variable', var[1]):
+      log_debug(f'{var[1]} repo variable is known not to exist for {component_name}')
+      continue
     try:
       repo_var = repo.get_variable(var[1])
       repo_var_value = repo_var.value
       if var[1] == 'HMPPS_PRODUCT_ID':
-        if sc_product_id := services.sc.get_id('products', 'p_id', repo_var_value):
+        if sc_product_id := sc_lookups.get_id(
+          services.sc, 'products', 'p_id', repo_var_value
+        ):
           repo_vars[var[0]] = sc_product_id
         else:
           log_debug(f'Unable to find product entry for {repo_var_value}')
@@ -35,6 +45,7 @@ def get_repo_variables(services, repo, component_name):
     except Exception as e:
       if '404' in str(e):
         log_debug(f'No {var[1]} repo variable found for {component_name}')
+        negative_cache.record_missing(repo, 'variable', var[1])
       else:
         log_debug(f'Could not get {var[1]} repo variable for {component_name} - {e}')
       pass
@@ -169,7 +180,7 @@ def get_waiting_runs(services, repo):
 def get_npmrc_config(gh, repo):
   """Parse .npmrc file and extract configuration settings."""
   npmrc_config = {}
-  if npmrc_content := gh.get_file_plain(repo, '.npmrc'):
+  if npmrc_content := negative_cache.get_file_plain(gh, repo, '.npmrc'):
     try:
       # Parse each line looking for key = value pairs
       for line in npmrc_content.splitlines():
@@ -217,6 +228,8 @@ def process_sc_component_security(services, component, **kwargs):
   sc = services.sc
   gh = services.gh
   component_name = component.get('name')
+  # The component as fetched, to work out which fields have changed
+  sc_component = sc_diff.snapshot(component)
   component_security_settings = component.get('security_settings') or {}
   github_repo = component.get('github_repo')
 
@@ -227,7 +240,7 @@ def process_sc_component_security(services, component, **kwargs):
   component_flags = {}
 
   try:
-    repo = gh.get_org_repo(f'{github_repo}')
+    repo = get_org_repo(gh, f'{github_repo}')
   except Exception as e:
     log_error(
       f'ERROR accessing ministryofjustice/{github_repo}, '
@@ -280,7 +293,7 @@ def process_sc_component_security(services, component, **kwargs):
   # variables. Update component with all results in data dictionary
   # if there's data to do so
   if data:
-    if not sc.update(sc.components, component['documentId'], data):
+    if not sc_diff.update(sc, sc.components, sc_component, data):
       log_error(f'Error updating component {component_name}')
       component_flags['update_error'] = True
 
@@ -1,4 +1,3 @@
-import yaml
 import re
 import json
 
@@ -8,10 +7,14 @@ from hmpps.services.job_log_handling import (
   log_error,
   log_warning,
 )
-from hmpps import find_matching_keys
 
 # local
+from includes import sc_diff, yaml_loader
+from includes.github_api import get_org_repo
+from includes.singleflight import SingleFlight
+from includes.utils import get_dir_contents
 from includes.values import actions_allowlist
+from includes.yaml_visitor import Collect, KeyVisitor
 
 # SHA is a 40-character hex string
 _SHA_RE = re.compile(r'^[0-9a-f]{40}$')
@@ -24,12 +27,20 @@ _SHA_COMMENT_RE = re.compile(r'uses:\s+\S+@([0-9a-f]{40})\s+#\s*(\S+)', re.MULTI
 # GitHub API are reused across all files and components processed in this run.
 _sha_version_cache: dict[str, str] = {}
 
+# The keys read from each workflow file, in one walk of the file
+WORKFLOW_KEYS = KeyVisitor(uses=Collect('uses'))
+
 
 def _extract_sha_comments(yml_content):
   """Return a {sha: version} dict parsed from inline YAML comments."""
   return {m.group(1): m.group(2) for m in _SHA_COMMENT_RE.finditer(yml_content)}
 
 
+# Many repos pin the same action SHA, so concurrent lookups of a SHA that isn't
+# in the cache yet share a single walk through the action's tags.
+_sha_lookups = SingleFlight()
+
+
 def _lookup_sha_via_api(gh, action_name, sha):
   """Look up the version tag for a commit SHA via the GitHub API.
 
@@ -39,6 +50,14 @@ def _lookup_sha_via_api(gh, action_name, sha):
   if sha in _sha_version_cache:
     return _sha_version_cache[sha]
 
+  return _sha_lookups.do(sha, _lookup_sha_tags, gh, action_name, sha)
+
+
+def _lookup_sha_tags(gh, action_name, sha):
+  """Walk the action repository's tags to find the one pointing at sha."""
+  if sha in _sha_version_cache:
+    return _sha_version_cache[sha]
+
   try:
     parts = action_name.split('/')
     if len(parts) >= 2:
@@ -86,7 +105,7 @@ def add_non_local_actions(yml_data, actions, path, yml_content=None, gh=None):
     discovered = _extract_sha_comments(yml_content)
     _sha_version_cache.update(discovered)
 
-  if uses := find_matching_keys(yml_data, 'uses'):
+  if uses := WORKFLOW_KEYS.visit(yml_data)['uses']:
     log_debug(f'qty of uses in {path}: {len(uses)}')
 
     for value in uses:
@@ -123,13 +142,15 @@ def scan_for_local_actions(workflow_dir, repo, gh=None):
     file_content = workflow_dir.pop(0)
     log_debug(f'file_content.name: {file_content.name}')
     if file_content.type == 'dir':
-      workflow_dir.extend(repo.get_contents(file_content.path))
+      workflow_dir.extend(
+        get_dir_contents(gh, repo, file_content.path, pin_to_head=False)
+      )
     elif file_content.name.endswith(('.yaml', '.yml')):
       yml_content = file_content.decoded_content.decode()
 
       try:
-        yml_data = yaml.safe_load(yml_content)
-      except yaml.YAMLError as e:
+        yml_data = yaml_loader.safe_load(yml_content)
+      except yaml_loader.YAMLError as e:
         log_error(f'Error parsing {file_content.path}: {e}')
         continue
       if yml_data:
@@ -155,13 +176,15 @@ def process_sc_component_workflows(services, component, **kwargs):
   gh = services.gh
   component_name = component.get('name')
   github_repo = component.get('github_repo')
+  # The component as fetched, to work out which fields have changed
+  sc_component = sc_diff.snapshot(component)
 
   # Reset the data ready for updating
   data = {}  # dictionary to hold all the updated data for the component
   component_flags = {}
 
   try:
-    repo = gh.get_org_repo(f'{github_repo}')
+    repo = get_org_repo(gh, f'{github_repo}')
   except Exception as e:
     log_error(
       f'ERROR accessing ministryofjustice/{github_repo},'
@@ -172,9 +195,7 @@ def process_sc_component_workflows(services, component, **kwargs):
 
   # get the non-standard workflows
   try:
-    workflow_dir = repo.get_contents(
-      '.github', ref=repo.get_branch(repo.default_branch).commit.sha
-    )
+    workflow_dir = get_dir_contents(gh, repo, '.github')
   except Exception as e:
     log_warning(f'Unable to load the workflows folder for {component_name}: {e}')
     component_flags['update_error'] = True
@@ -206,7 +227,7 @@ def process_sc_component_workflows(services, component, **kwargs):
 
   # Update component with all results in data dictionary if there's data to do so
   if data:
-    if not sc.update(sc.components, component['documentId'], data):
+    if not sc_diff.update(sc, sc.components, sc_component, data):
       log_error(f'Error updating component {component_name}')
       component_flags['update_error'] = True
 
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""Benchmark the YAML loaders used by discovery
+
+Parses a corpus of Helm values files, Github workflow files and a Helm
+repository index with the pure-Python SafeLoader and with libyaml's CSafeLoader
+(see includes/yaml_loader.py), checks that both give the same results, and
+reports the time taken by each.
+
+The corpus is generated to look like hmpps repositories, unless a directory of
+YAML files is given with --corpus. --helm-index reads the real hmpps-helm-charts
+index instead of a generated one.
+
+Usage
+-----
+  python -m utilities.benchmark_yaml --rounds 5
+  python -m utilities.benchmark_yaml --corpus ~/repos --helm-index
+"""
+
+import argparse
+import pathlib
+import time
+
+import requests
+import yaml
+
+HELM_INDEX_URL = 'https://ministryofjustice.github.io/hmpps-helm-charts/index.yaml'
+
+
+def values_file(n, env=None):
+  host = f'service-{n}{"-" + env if env else ""}.hmpps.service.justice.gov.uk'
+  values = {
+    'generic-service': {
+      'nameOverride': f'service-{n}',
+      'productId': f'DPS{n:03}',
+      'replicaCount': 4,
+      'image': {
+        'repository': f'ghcr.io/ministryofjustice/service-{n}',
+        'tag': 'app_version',
+        'port': 8080,
+      },
+      'ingress': {
+        'enabled': True,
+        'host': host,
+        'tlsSecretName': f'service-{n}-cert',
+        'modsecurity_enabled': n % 2 == 0,
+        'modsecurity_snippet': 'SecRuleEngine On\nSecRuleUpdateActionById 949110 '
+        '"t:none,deny,status:406"\n',
+      },
+      'env': {
+        'JAVA_OPTS': '-Xmx512m',
+        'SERVER_PORT': '8080',
+        'SPRING_PROFILES_ACTIVE': 'logstash',
+        'APPLICATIONINSIGHTS_CONNECTION_STRING': 'InstrumentationKey=$(KEY)',
+        **{f'API_BASE_URL_{i}': f'https://api-{i}.hmpps.service' for i in range(20)},
+      },
+      'namespace_secrets': {
+        f'service-{n}-secret-{i}': {
+          'SECRET_KEY': 'secret',
+          'CLIENT_ID': 'client_id',
+          'CLIENT_SECRET': 'client_secret',
+        }
+        for i in range(8)
+      },
+      'allowlist': {
+        **{f'office-{i}': f'10.{n % 255}.{i}.0/24' for i in range(30)},
+        'groups': ['internal', 'prisons', 'probation'],
+      },
+    },
+    'generic-prometheus-alerts': {
+      'targetApplication': f'service-{n}',
+      'alertSeverity': f'team-{n % 7}',
+      'sqsAlertsQueueNames': [f'service-{n}-queue-{i}' for i in range(4)],
+    },
+  }
+  return yaml.safe_dump(values, sort_keys=False)
+
+
+def workflow_file(n):
+  steps = [
+    {'uses': 'actions/checkout@v4'},
+    {
+      'name': 'Set up JDK',
+      'uses': 'actions/setup-java@v4',
+      'with': {'java-version': 21},
+    },
+    {'name': 'Build', 'run': './gradlew build\n./gradlew check\n'},
+    {
+      'uses': 'ministryofjustice/hmpps-github-actions/.github/actions/build@v2',
+      'with': {'project': f'service-{n}', 'push': True},
+    },
+  ]
+  workflow = {
+    'name': 'Pipeline',
+    'on': {'push': {'branches': ['main']}, 'workflow_dispatch': None},
+    'permissions': {'contents': 'read', 'packages': 'write'},
+    'jobs': {
+      f'job-{i}': {'runs-on': 'ubuntu-latest', 'needs': [], 'steps': steps}
+      for i in range(12)
+    },
+  }
+  return yaml.safe_dump(workflow, sort_keys=False)
+
+
+def helm_index(charts=40, versions=150):
+  index = {
+    'apiVersion': 'v1',
+    'entries': {
+      f'chart-{c}': [
+        {
+          'apiVersion': 'v2',
+          'name': f'chart-{c}',
+          'version': f'{v // 100}.{v // 10 % 10}.{v % 10}',
+          'created': '2025-01-01T00:00:00.000000000Z',
+          'description': 'A Helm chart for hmpps services',
+          'digest': f'{c:032x}{v:032x}',
+          'urls': [
+            f'https://github.com/ministryofjustice/hmpps-helm-charts/releases/'
+            f'download/chart-{c}-{v}/chart-{c}-{v}.tgz'
+          ],
+        }
+        for v in range(versions, 0, -1)
+      ]
+      for c in range(charts)
+    },
+  }
+  return yaml.safe_dump(index, sort_keys=False)
+
+
+def generated_corpus(components):
+  corpus = {'helm values': [], 'workflows': []}
+  for n in range(components):
+    corpus['helm values'].append(values_file(n))
+    corpus['helm values'] += [values_file(n, env) for env in ('dev', 'preprod', 'prod')]
+    corpus['workflows'] += [workflow_file(n) for _ in range(3)]
+  return corpus
+
+
+def directory_corpus(directory):
+  corpus = {'helm values': [], 'workflows': [], 'other': []}
+  for path in pathlib.Path(directory).expanduser().rglob('*.y*ml'):
+    if path.suffix not in ('.yaml', '.yml') or not path.is_file():
+      continue
+    if '.github' in path.parts:
+      kind = 'workflows'
+    elif path.name.startswith('values'):
+      kind = 'helm values'
+    else:
+      kind = 'other'
+    corpus[kind].append(path.read_text(errors='replace'))
+  return corpus
+
+
+def parse_all(documents, loader):
+  results = []
+  for document in documents:
+    try:
+      results.append(yaml.load(document, Loader=loader))
+    except yaml.YAMLError:
+      results.append(None)
+  return results
+
+
+def best_time(documents, loader, rounds):
+  best = None
+  for _ in range(rounds):
+    started = time.perf_counter()
+    results = parse_all(documents, loader)
+    elapsed = time.perf_counter() - started
+    best = elapsed if best is None else min(best, elapsed)
+  return best, results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--corpus', help='directory of YAML files to parse')
+  parser.add_argument('--components', type=int, default=50)
+  parser.add_argument('--helm-index', action='store_true', help='read the real index')
+  parser.add_argument('--rounds', type=int, default=3)
+  args = parser.parse_args()
+
+  c_loader = getattr(yaml, 'CSafeLoader', None)
+  if c_loader is None:
+    print('PyYAML was built without libyaml - only the pure-Python loader is available')
+
+  corpus = (
+    directory_corpus(args.corpus) if args.corpus else generated_corpus(args.components)
+  )
+  if args.helm_index:
+    response = requests.get(HELM_INDEX_URL, timeout=30)
+    response.raise_for_status()
+    corpus['helm index'] = [response.text]
+  else:
+    corpus['helm index'] = [helm_index()]
+
+  print(f'{"corpus":<14}{"files":>7}{"MB":>8}{"python s":>11}{"libyaml s":>11}{"x":>7}')
+  for kind, documents in corpus.items():
+    if not documents:
+      continue
+    size = sum(len(document) for document in documents) / 1024 / 1024
+    python_time, python_results = best_time(documents, yaml.SafeLoader, args.rounds)
+    line = f'{kind:<14}{len(documents):>7}{size:>8.1f}{python_time:>11.3f}'
+    if c_loader:
+      c_time, c_results = best_time(documents, c_loader, args.rounds)
+      if c_results != python_results:
+        line += '  results differ!'
+      else:
+        line += f'{c_time:>11.3f}{python_time / c_time:>7.1f}'
+    print(line)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 """Check for duplicate environments
 
+Run from the repository root with
+  python -m utilities.check_duplicate_environments
+
 Required environment variables
 ------------------------------
 
@@ -15,6 +18,9 @@ import json
 import sys
 from hmpps import ServiceCatalogue
 
+# local
+from includes import sc_pages
+
 
 def eprint(*args, **kwargs):
   print(*args, file=sys.stderr, **kwargs)
@@ -57,7 +63,7 @@ def main():
   }
 
   # environments bits
-  environments = sc.get_all_records('environments?populate=component')
+  environments = sc_pages.get_all_records(sc, 'environments?populate=component')
   env_dict = {}
   for env in environments:
     env_name = env.get('name')
@@ -1,3 +1,5 @@
+# Run from the repository root with python -m utilities.compare_dev_prod
+
 # Classes for the various parts of the script
 from hmpps import ServiceCatalogue
 import os
@@ -5,6 +7,9 @@ from hmpps.services.job_log_handling import (
   log_info,
 )
 
+# local
+from includes import sc_pages
+
 
 def compare_attributes(prod_attributes, dev_attributes):
   differences = []
@@ -47,8 +52,8 @@ def main():
     key=os.getenv('SERVICE_CATALOGUE_DEV_API_KEY', ''),
   )
 
-  prod_data = sc_prod.get_all_records(sc_prod.components_get)
-  dev_data = sc_dev.get_all_records(sc_dev.components_get)
+  prod_data = sc_pages.get_all_records(sc_prod, sc_prod.components_get)
+  dev_data = sc_pages.get_all_records(sc_dev, sc_dev.components_get)
 
   for component in prod_data:
     log_info(f'{component.get("name")}')
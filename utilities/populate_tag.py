@@ -1,3 +1,5 @@
+# Run from the repository root with python -m utilities.populate_tag
+
 import os
 import json
 
@@ -5,6 +7,9 @@ import json
 from hmpps import ServiceCatalogue
 from hmpps.services.job_log_handling import log_debug, log_info
 
+# local
+from includes import sc_pages
+
 
 def main():
   # service catalogue parameters
@@ -18,9 +23,9 @@ def main():
     key=os.getenv('SERVICE_CATALOGUE_DEV_API_KEY', ''),
   )
 
-  prod_components = sc_prod.get_all_records(sc_prod.components_get)
-  dev_components = sc_dev.get_all_records(sc_dev.components_get)
-  dev_environments = sc_dev.get_all_records(sc_dev.environments)
+  prod_components = sc_pages.get_all_records(sc_prod, sc_prod.components_get)
+  dev_components = sc_pages.get_all_records(sc_dev, sc_dev.components_get)
+  dev_environments = sc_pages.get_all_records(sc_dev, sc_dev.environments)
 
   for component in prod_components:
     log_info(f'Getting environment data for {component.get("name")}')
@@ -1,6 +1,8 @@
 # This needs to be validated before use
 # since it has been re-written to use Strapi v5 and
 # hmpps-sre-python-lib shared libraries
+#
+# Run from the repository root with python -m utilities.prod_to_local
 
 import os
 import json
@@ -9,6 +11,9 @@ import json
 from hmpps import ServiceCatalogue
 from hmpps.services.job_log_handling import log_debug, log_info
 
+# local
+from includes import sc_pages
+
 # service catalogue parameters
 
 sc_in = ServiceCatalogue(
@@ -62,7 +67,7 @@ for table in tables:
     in_table = table
     query = table
 
-  records = sc_in.get_all_records(query)
+  records = sc_pages.get_all_records(sc_in, query)
 
   for record in records:
     log_debug(f'Dealing with {in_table} record: {json.dumps(record, indent=2)}')
@@ -119,7 +124,7 @@ for table in tables:
     else:
       sc_out.add(in_table, record['attributes'])
 
-records = sc_in.get_all_records('github-teams')
+records = sc_pages.get_all_records(sc_in, 'github-teams')
 for record in records:
   if existing_id := sc_out.get_id('github-teams', 'team_name', record.get('team_name')):
     sc_out.update('github-teams', existing_id, record)
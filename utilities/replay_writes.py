@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Replay Service Catalogue writes recorded by a discovery job's --dry-run
+
+Records added in the dry run are given placeholder documentIds, which are
+mapped to the real ones as the adds are replayed - wherever they appear, eg. an
+added environment's component. So the adds are replayed first, in the order they
+were recorded. Then updates and deletes to different records are sent
+concurrently, while writes to the same record are sent in the order they were
+recorded. Scheduled job updates are skipped unless --scheduled-job is given.
+
+Usage
+-----
+  python -m utilities.replay_writes dry-run-hmpps-github-discovery-full.jsonl \\
+    --threads 8
+
+Required environment variables
+------------------------------
+
+Service Catalogue
+- SERVICE_CATALOGUE_API_ENDPOINT: Service Catalogue API endpoint
+- SERVICE_CATALOGUE_API_KEY: Service Catalogue API key
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# hmpps
+from hmpps import ServiceCatalogue
+from hmpps.services.job_log_handling import job, log_error, log_info
+
+# local
+from includes.sc_recorder import PLACEHOLDER_PREFIX
+
+
+def load(path, tables=None):
+  with open(path) as f:
+    entries = [json.loads(line) for line in f if line.strip()]
+  entries.sort(key=lambda entry: entry['seq'])
+  if tables:
+    entries = [entry for entry in entries if entry.get('table') in tables]
+  return entries
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('recording', help='JSONL file recorded with --dry-run')
+  parser.add_argument('--threads', type=int, default=4)
+  parser.add_argument('--table', action='append', help='only replay these tables')
+  parser.add_argument(
+    '--scheduled-job', action='store_true', help='replay scheduled job updates'
+  )
+  args = parser.parse_args()
+
+  sc = ServiceCatalogue()
+  entries = load(args.recording, args.table)
+
+  # Group the updates and deletes by record, keeping their order
+  adds = [entry for entry in entries if entry['operation'] == 'add']
+  groups = {}
+  for entry in entries:
+    if entry['operation'] in ('add', 'scheduled_job'):
+      continue
+    groups.setdefault((entry['table'], entry['documentId']), []).append(entry)
+
+  document_ids = {}  # placeholder -> real documentId
+  lock = threading.Lock()
+  results = {'sent': 0, 'failed': 0}
+
+  def real_id(value):
+    # Placeholders anywhere in the value are mapped to the real documentIds
+    if isinstance(value, str) and value.startswith(PLACEHOLDER_PREFIX):
+      return document_ids.get(value, value)
+    if isinstance(value, dict):
+      return {key: real_id(item) for key, item in value.items()}
+    if isinstance(value, list):
+      return [real_id(item) for item in value]
+    return value
+
+  def record(entry, result):
+    with lock:
+      results['sent' if result else 'failed'] += 1
+    if not result:
+      log_error(
+        f'Unable to replay {entry["operation"]} #{entry["seq"]} on {entry["table"]}'
+      )
+
+  started = time.monotonic()
+  for entry in adds:
+    result = sc.add(entry['table'], real_id(entry.get('data')))
+    if isinstance(result, dict) and (added := result.get('data')):
+      document_ids[entry['documentId']] = added.get('documentId')
+    record(entry, result)
+
+  def replay(group):
+    for entry in group:
+      table, data = entry['table'], real_id(entry.get('data'))
+      if entry['operation'] == 'update':
+        result = sc.update(table, real_id(entry['documentId']), data)
+      else:
+        result = sc.delete(table, real_id(entry['documentId']))
+      record(entry, result)
+
+  with ThreadPoolExecutor(max_workers=args.threads) as executor:
+    list(executor.map(replay, groups.values()))
+
+  if args.scheduled_job:
+    for entry in entries:
+      if entry['operation'] == 'scheduled_job' and entry.get('args'):
+        job.name = entry.get('job') or job.name
+        sc.update_scheduled_job(entry['args'][-1])
+
+  log_info(
+    f'Replayed {results["sent"]} writes ({results["failed"]} failed) '
+    f'in {time.monotonic() - started:.1f}s'
+  )
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,580 @@
+#!/usr/bin/env python
+"""Offline stand-in for the Service Catalogue, Slack, Alertmanager and CircleCI
+
+Serves just enough of each API for the discovery jobs' Service Catalogue,
+Slack, Alertmanager and CircleCI calls to be made without touching the real
+services - for benchmarking and load testing the Service Catalogue side of the
+jobs. It isn't a full offline environment.
+
+- Service Catalogue (Strapi v5 REST) on /v1/<table> (or /api/<table>):
+  pagination, filters (including relation filters and $and/$or/$not), fields,
+  populate, and documentId get/add/update/delete
+- Slack Web API on /slack/api/<method> (or /api/<method>) - messages are logged
+- Alertmanager status on /alertmanager/status
+- CircleCI on /circleci/... - every request succeeds
+
+Github is not stood in - the jobs still need Github credentials for the
+repositories in the seed data (local git mirrors, see GIT_MIRROR_URL, only
+replace the file reads). There's no /graphql endpoint either, so leave
+SC_GRAPHQL unset.
+
+Usage
+-----
+  python utilities/stand_in_server.py --components 200 --latency-ms 50 \\
+    --error-rate 0.01
+
+then point the jobs at it, eg.
+  SERVICE_CATALOGUE_API_ENDPOINT=http://localhost:8080
+  SERVICE_CATALOGUE_API_KEY=stand-in
+  ALERTMANAGER_ENDPOINT=http://localhost:8080/alertmanager/status
+  CIRCLECI_API_ENDPOINT=http://localhost:8080/circleci/
+  CIRCLECI_TOKEN=stand-in
+
+Seed data is either generated (--components) or loaded from a JSON file of
+{table: [records]} (--seed), where relations are given as documentIds.
+
+Optional environment variables (each can also be set with the matching option)
+- STANDIN_PORT: port to listen on (default 8080)
+- STANDIN_LATENCY_MS / STANDIN_JITTER_MS: added response time (default 0)
+- STANDIN_ERROR_RATE: fraction of requests that fail (default 0)
+- STANDIN_ERROR_STATUS: status code of the failed requests (default 500)
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import yaml
+
+# Relations between the tables - field -> (table, 'one' | 'inverse:<field>')
+RELATIONS = {
+  'components': {
+    'product': ('products', 'one'),
+    'envs': ('environments', 'inverse:component'),
+  },
+  'environments': {
+    'component': ('components', 'one'),
+    'ns': ('namespaces', 'one'),
+  },
+  'products': {
+    'components': ('components', 'inverse:product'),
+    'team': ('teams', 'one'),
+    'product_set': ('product-sets', 'one'),
+    'service_area': ('service-areas', 'one'),
+    'parent': ('products', 'one'),
+  },
+}
+
+ALERT_SEVERITIES = {
+  'hmpps-sre-alerts': '#hmpps-sre-alerts',
+  'hmpps-sre-alerts-nonprod': '#hmpps-sre-alerts-nonprod',
+  'digital-prison-service': '#dps-alerts',
+  'digital-prison-service-dev': '#dps-alerts-nonprod',
+}
+
+
+def now():
+  return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace(
+    '+00:00', 'Z'
+  )
+
+
+# Strapi query parameters
+#########################
+def parse_query(query_string):
+  # Turns filters[component][name][$eq]=x into nested dictionaries
+  params = {}
+  for key, value in parse_qsl(query_string, keep_blank_values=True):
+    parts = re.findall(r'[^\[\]]+', key)
+    node = params
+    for part in parts[:-1]:
+      if not isinstance(node.get(part), dict):
+        node[part] = {}
+      node = node[part]
+    if parts:
+      node[parts[-1]] = value
+  return params
+
+
+def as_list(value):
+  # Strapi arrays are either repeated indices (fields[0]=a&fields[1]=b)
+  # or comma separated
+  if isinstance(value, dict):
+    return [value[k] for k in sorted(value, key=lambda k: int(k) if k.isdigit() else 0)]
+  if isinstance(value, str):
+    return [v for v in value.split(',') if v]
+  return list(value or [])
+
+
+def populate_spec(table, populate):
+  # Returns relation -> {'fields': [...], 'populate': {...}}
+  relations = RELATIONS.get(table, {})
+  if populate in ('*', 'true'):
+    return {relation: {} for relation in relations}
+  if isinstance(populate, str) or (
+    isinstance(populate, dict) and all(k.isdigit() for k in populate)
+  ):
+    return {relation: {} for relation in as_list(populate)}
+  spec = {}
+  for relation, value in (populate or {}).items():
+    if isinstance(value, dict):
+      spec[relation] = {
+        'fields': as_list(value.get('fields')),
+        'populate': value.get('populate'),
+      }
+    elif value not in ('false', '0'):
+      spec[relation] = {}
+  return spec
+
+
+def _text(value):
+  if value is None:
+    return 'null'
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  return str(value)
+
+
+def _number(value):
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
+OPERATORS = {
+  '$eq': lambda v, c: _text(v) == c,
+  '$eqi': lambda v, c: _text(v).lower() == c.lower(),
+  '$ne': lambda v, c: _text(v) != c,
+  '$nei': lambda v, c: _text(v).lower() != c.lower(),
+  '$contains': lambda v, c: v is not None and c in _text(v),
+  '$containsi': lambda v, c: v is not None and c.lower() in _text(v).lower(),
+  '$notContains': lambda v, c: v is None or c not in _text(v),
+  '$notContainsi': lambda v, c: v is None or c.lower() not in _text(v).lower(),
+  '$startsWith': lambda v, c: v is not None and _text(v).startswith(c),
+  '$endsWith': lambda v, c: v is not None and _text(v).endswith(c),
+  '$null': lambda v, c: (v is None) == (c == 'true'),
+  '$notNull': lambda v, c: (v is not None) == (c == 'true'),
+  '$in': lambda v, c: _text(v) in as_list(c),
+  '$notIn': lambda v, c: _text(v) not in as_list(c),
+  '$lt': lambda v, c: v is not None and _text(v) < c,
+  '$lte': lambda v, c: v is not None and _text(v) <= c,
+  '$gt': lambda v, c: v is not None and _text(v) > c,
+  '$gte': lambda v, c: v is not None and _text(v) >= c,
+}
+
+
+class Store:
+  def __init__(self):
+    self.tables = {}
+    self.next_id = {}
+    self.lock = threading.RLock()
+
+  # Records
+  def _table(self, table):
+    self.next_id.setdefault(table, 1)
+    return self.tables.setdefault(table, {})
+
+  def find(self, table, ref):
+    # A relation can be given as an id, a documentId or a record
+    if isinstance(ref, dict):
+      if 'connect' in ref or 'set' in ref:
+        refs = as_list(ref.get('connect') or ref.get('set'))
+        return self.find(table, refs[0]) if refs else None
+      ref = ref.get('documentId') or ref.get('id')
+    records = self._table(table)
+    if ref in records:
+      return records[ref]
+    if (number := _number(ref)) is not None:
+      return next((r for r in records.values() if r['id'] == number), None)
+    return None
+
+  def _store_relations(self, table, record, data):
+    for field, value in data.items():
+      relation = RELATIONS.get(table, {}).get(field)
+      if relation is None:
+        record[field] = value
+      elif relation[1] == 'one':
+        related = self.find(relation[0], value) if value is not None else None
+        record[field] = related['documentId'] if related else None
+
+  def add(self, table, data, document_id=None):
+    with self.lock:
+      records = self._table(table)
+      timestamp = now()
+      record = {
+        'id': self.next_id[table],
+        'documentId': document_id or uuid.uuid4().hex[:24],
+        'createdAt': timestamp,
+        'updatedAt': timestamp,
+        'publishedAt': timestamp,
+      }
+      self.next_id[table] += 1
+      self._store_relations(table, record, data)
+      records[record['documentId']] = record
+      return record
+
+  def update(self, table, document_id, data):
+    with self.lock:
+      if (record := self._table(table).get(document_id)) is None:
+        return None
+      self._store_relations(table, record, data)
+      record['updatedAt'] = now()
+      return record
+
+  def delete(self, table, document_id):
+    with self.lock:
+      return self._table(table).pop(document_id, None)
+
+  def related(self, table, record, field):
+    target, kind = RELATIONS[table][field]
+    if kind == 'one':
+      return self._table(target).get(record.get(field))
+    inverse = kind.split(':', 1)[1]
+    return [
+      r for r in self._table(target).values() if r.get(inverse) == record['documentId']
+    ]
+
+  # Queries
+  def matches(self, table, record, filters):
+    for key, condition in filters.items():
+      if key in ('$and', '$or'):
+        results = [self.matches(table, record, c) for c in as_list(condition)]
+        if not (all(results) if key == '$and' else any(results)):
+          return False
+      elif key == '$not':
+        if self.matches(table, record, condition):
+          return False
+      elif key in OPERATORS:
+        continue
+      elif key in RELATIONS.get(table, {}):
+        target = RELATIONS[table][key][0]
+        related = self.related(table, record, key)
+        related = related if isinstance(related, list) else [related]
+        if isinstance(condition, dict) and any(k in OPERATORS for k in condition):
+          # eg. filters[component][$null]=true
+          value = related[0]['documentId'] if related and related[0] else None
+          if not self._check(value, condition):
+            return False
+        elif not any(
+          r and self.matches(target, r, condition)
+          for r in related
+          if isinstance(condition, dict)
+        ):
+          return False
+      elif isinstance(condition, dict):
+        if not self._check(record.get(key), condition):
+          return False
+      elif _text(record.get(key)) != condition:
+        return False
+    return True
+
+  @staticmethod
+  def _check(value, condition):
+    return all(
+      OPERATORS[op](value, operand)
+      for op, operand in condition.items()
+      if op in OPERATORS
+    )
+
+  def serialise(self, table, record, fields=None, populate=None):
+    relations = RELATIONS.get(table, {})
+    result = {
+      key: value
+      for key, value in record.items()
+      if key not in relations
+      and (not fields or key in fields or key in ('id', 'documentId'))
+    }
+    for relation, spec in populate_spec(table, populate).items():
+      if relation not in relations:
+        continue
+      target = relations[relation][0]
+      related = self.related(table, record, relation)
+      nested = (spec.get('fields'), spec.get('populate'))
+      if isinstance(related, list):
+        result[relation] = [self.serialise(target, r, *nested) for r in related]
+      else:
+        result[relation] = self.serialise(target, related, *nested) if related else None
+    return result
+
+  def query(self, table, params):
+    with self.lock:
+      records = [
+        r
+        for r in self._table(table).values()
+        if self.matches(table, r, params.get('filters') or {})
+      ]
+      for sort in reversed(as_list(params.get('sort'))):
+        field, _, direction = sort.partition(':')
+        records.sort(
+          key=lambda r: _text(r.get(field)), reverse=direction.lower() == 'desc'
+        )
+      pagination = params.get('pagination') or {}
+      page_size = int(pagination.get('pageSize', 25))
+      page = int(pagination.get('page', 1))
+      total = len(records)
+      fields = as_list(params.get('fields'))
+      data = [
+        self.serialise(table, r, fields, params.get('populate'))
+        for r in records[(page - 1) * page_size : page * page_size]
+      ]
+    return {
+      'data': data,
+      'meta': {
+        'pagination': {
+          'page': page,
+          'pageSize': page_size,
+          'pageCount': max(1, -(-total // page_size)),
+          'total': total,
+        }
+      },
+    }
+
+
+# Seed data
+###########
+def generate_seed(store, component_count):
+  teams = [store.add('teams', {'name': f'Stand-in team {i}'}) for i in range(5)]
+  products = [
+    store.add(
+      'products',
+      {
+        'name': f'Stand-in product {i}',
+        'p_id': f'SI{i:04d}',
+        'slack_channel_id': f'C{i:08d}',
+        'team': teams[i % len(teams)]['documentId'],
+      },
+    )
+    for i in range(max(1, component_count // 5))
+  ]
+  for i in range(component_count):
+    name = f'stand-in-component-{i}'
+    component = store.add(
+      'components',
+      {
+        'name': name,
+        'github_repo': name,
+        'archived': False,
+        'part_of_monorepo': False,
+        'product': products[i % len(products)]['documentId'],
+        'latest_commit': {
+          'sha': uuid.uuid4().hex + uuid.uuid4().hex[:8],
+          'date_time': now(),
+        },
+        'versions': {},
+        'security_settings': {},
+        'github_project_teams_write': [f'stand-in-team-{i % 5}'],
+        'github_project_teams_admin': [],
+        'github_project_teams_maintain': [],
+        'github_project_branch_protection_restricted_teams': [],
+      },
+    )
+    for env, env_type in (('dev', 'dev'), ('preprod', 'preprod'), ('prod', 'prod')):
+      namespace = store.add('namespaces', {'name': f'{name}-{env}'})
+      store.add(
+        'environments',
+        {
+          'name': env,
+          'type': env_type,
+          'namespace': namespace['name'],
+          'ns': namespace['documentId'],
+          'component': component['documentId'],
+        },
+      )
+  for i in range(5):
+    store.add('github-teams', {'team_name': f'stand-in-team-{i}', 'members': []})
+
+
+def load_seed(store, seed_file):
+  with open(seed_file) as f:
+    seed = json.load(f)
+  # Add the records before linking them, since relations can refer to records
+  # anywhere in the seed
+  for table, records in seed.items():
+    for record in records:
+      plain = {k: v for k, v in record.items() if k not in RELATIONS.get(table, {})}
+      plain.pop('id', None)
+      store.add(table, plain, document_id=record.get('documentId'))
+  for table, records in seed.items():
+    for record in records:
+      links = {k: v for k, v in record.items() if k in RELATIONS.get(table, {})}
+      if links and record.get('documentId'):
+        store.update(table, record['documentId'], links)
+
+
+def alertmanager_status():
+  routes = [
+    {'receiver': channel.lstrip('#'), 'match': {'severity': severity}}
+    for severity, channel in ALERT_SEVERITIES.items()
+  ]
+  receivers = [
+    {'name': channel.lstrip('#'), 'slack_configs': [{'channel': channel}]}
+    for channel in ALERT_SEVERITIES.values()
+  ]
+  config = {'route': {'receiver': 'default', 'routes': routes}, 'receivers': receivers}
+  return {'config': {'original': yaml.safe_dump(config)}}
+
+
+# Server
+########
+class StandInHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  store = None
+  settings = None
+
+  def log_message(self, format, *args):
+    if self.settings.verbose:
+      super().log_message(format, *args)
+
+  def _send(self, status, body=None, headers=None):
+    payload = json.dumps(body).encode() if body is not None else b''
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(payload)))
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def _error(self, status, message):
+    self._send(
+      status,
+      {'data': None, 'error': {'status': status, 'name': 'Error', 'message': message}},
+    )
+
+  def _body(self):
+    length = int(self.headers.get('Content-Length') or 0)
+    if not length:
+      return {}
+    try:
+      return json.loads(self.rfile.read(length))
+    except json.JSONDecodeError:
+      return {}
+
+  def _inject(self):
+    # Returns True if the request has been failed on purpose
+    settings = self.settings
+    if settings.latency_ms or settings.jitter_ms:
+      delay = settings.latency_ms + random.uniform(0, settings.jitter_ms)
+      time.sleep(delay / 1000)
+    if settings.error_rate and random.random() < settings.error_rate:
+      headers = {'Retry-After': '1'} if settings.error_status == 429 else None
+      self._body()
+      self._send(settings.error_status, {'error': 'injected failure'}, headers)
+      return True
+    return False
+
+  def _route(self, method):
+    url = urlsplit(self.path)
+    path = url.path.rstrip('/')
+    if path in ('', '/_health', '/health'):
+      return self._send(200, {'status': 'UP'})
+    if self._inject():
+      return
+    if path.startswith('/alertmanager'):
+      return self._send(200, alertmanager_status())
+    if path.startswith('/circleci'):
+      self._body()
+      return self._send(200, {})
+    if match := re.match(r'^(?:/slack)?/api/([a-z]+\.[A-Za-z.]+)$', path):
+      body = self._body() or dict(parse_qsl(url.query))
+      if self.settings.verbose:
+        print(f'Slack {match.group(1)}: {body.get("text", "")[:200]}')
+      return self._send(
+        200, {'ok': True, 'channel': body.get('channel'), 'ts': f'{time.time():.6f}'}
+      )
+    if match := re.match(r'^(?:/v1|/api)?/([a-z][a-z0-9-]*)(?:/([^/]+))?$', path):
+      return self._strapi(method, match.group(1), match.group(2), url.query)
+    return self._error(404, 'Not Found')
+
+  def _strapi(self, method, table, document_id, query):
+    store = self.store
+    params = parse_query(query)
+    if method == 'GET':
+      if document_id is None:
+        return self._send(200, store.query(table, params))
+      if record := store._table(table).get(document_id):
+        fields = as_list(params.get('fields'))
+        return self._send(
+          200, {'data': store.serialise(table, record, fields, params.get('populate'))}
+        )
+      return self._error(404, 'Not Found')
+    if method == 'POST' and document_id is None:
+      record = store.add(table, self._body().get('data') or {})
+      return self._send(201, {'data': store.serialise(table, record)})
+    if method == 'PUT' and document_id:
+      if record := store.update(table, document_id, self._body().get('data') or {}):
+        return self._send(200, {'data': store.serialise(table, record)})
+      return self._error(404, 'Not Found')
+    if method == 'DELETE' and document_id:
+      if store.delete(table, document_id):
+        return self._send(204)
+      return self._error(404, 'Not Found')
+    return self._error(405, 'Method Not Allowed')
+
+  def do_GET(self):
+    self._route('GET')
+
+  def do_POST(self):
+    self._route('POST')
+
+  def do_PUT(self):
+    self._route('PUT')
+
+  def do_DELETE(self):
+    self._route('DELETE')
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+    '--port', type=int, default=int(os.getenv('STANDIN_PORT', '8080'))
+  )
+  parser.add_argument('--seed', help='JSON file of {table: [records]} to load')
+  parser.add_argument(
+    '--components', type=int, default=50, help='number of components to generate'
+  )
+  parser.add_argument(
+    '--latency-ms', type=float, default=float(os.getenv('STANDIN_LATENCY_MS', '0'))
+  )
+  parser.add_argument(
+    '--jitter-ms', type=float, default=float(os.getenv('STANDIN_JITTER_MS', '0'))
+  )
+  parser.add_argument(
+    '--error-rate', type=float, default=float(os.getenv('STANDIN_ERROR_RATE', '0'))
+  )
+  parser.add_argument(
+    '--error-status', type=int, default=int(os.getenv('STANDIN_ERROR_STATUS', '500'))
+  )
+  parser.add_argument('--verbose', action='store_true', help='log every request')
+  settings = parser.parse_args()
+
+  store = Store()
+  if settings.seed:
+    load_seed(store, settings.seed)
+  else:
+    generate_seed(store, settings.components)
+
+  StandInHandler.store = store
+  StandInHandler.settings = settings
+  server = ThreadingHTTPServer(('127.0.0.1', settings.port), StandInHandler)
+  counts = ', '.join(
+    f'{len(records)} {table}' for table, records in store.tables.items()
+  )
+  print(f'Stand-in server listening on http://127.0.0.1:{settings.port} ({counts})')
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  main()